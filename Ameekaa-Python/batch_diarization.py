@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Batch speaker diarization over many meetings with a process pool.
+
+Jobs come from a CSV or JSONL manifest with one meeting per row:
+
+    JSONL: {"meeting": "a.wav", "speakers": {"sami": "sami_enroll.wav"}, "output": "a_sami.wav"}
+    CSV:   meeting,speakers,output
+           a.wav,sami=sami_enroll.wav;raj=raj_enroll.wav,out_dir/a
+
+A speaker given without an enrollment file is looked up in --speaker-store.
+As in run_dynamic_quantized_diarization.py, "output" is a WAV file for one
+speaker and a directory for several.
+
+Each worker keeps one warm ONNX session and gets cpu_count // workers
+intra-op threads so the pool does not oversubscribe the host. Every distinct
+enrollment is embedded once for the whole batch, then the meetings are
+diarized in parallel. A failing meeting is recorded and the batch continues;
+all results go into one aggregated JSON file. If a worker process dies (out
+of memory, a crash in ONNX Runtime, a failing initializer) the pool is
+replaced and the jobs it left unfinished are retried, each in its own
+single-use worker so one crashing meeting cannot take others down with it.
+"""
+import os
+import csv
+import json
+import time
+import logging
+import argparse
+import soundfile as sf
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from run_dynamic_quantized_diarization import load_config
+from enrollment_dynamic_quantize import get_audio_processor, session_options_from_config
+from diarization_dynamic_quantize import DynamicQuantizedDiarizationEngine
+from speaker_store import SpeakerEmbeddingStore
+
+logger = logging.getLogger(__name__)
+
+class BatchManifestError(Exception):
+    pass
+
+def _parse_speakers(speakers) -> Dict[str, Optional[str]]:
+    if isinstance(speakers, dict):
+        return {name: path or None for name, path in speakers.items()}
+    if isinstance(speakers, str):
+        speakers = [item for item in speakers.split(';') if item.strip()]
+    parsed = {}
+    for item in speakers:
+        name, _, path = item.partition('=')
+        parsed[name.strip()] = path.strip() or None
+    return parsed
+
+def load_manifest(manifest_path: str) -> List[Dict[str, Any]]:
+    try:
+        with open(manifest_path, 'r', newline='') as f:
+            if manifest_path.lower().endswith('.csv'):
+                rows = list(csv.DictReader(f))
+            else:
+                rows = [json.loads(line) for line in f if line.strip()]
+        jobs = []
+        for i, row in enumerate(rows):
+            if not row.get('meeting') or not row.get('speakers') or not row.get('output'):
+                raise BatchManifestError(f"Row {i + 1}: 'meeting', 'speakers' and 'output' are required")
+            jobs.append({
+                'job_id': i,
+                'meeting': row['meeting'],
+                'speakers': _parse_speakers(row['speakers']),
+                'output': row['output']
+            })
+        return jobs
+    except BatchManifestError:
+        raise
+    except Exception as e:
+        raise BatchManifestError(f"Failed to read manifest {manifest_path}: {str(e)}")
+
+# Per-process state, set up once by _init_worker
+_worker_config: Dict[str, Any] = {}
+
+def _init_worker(config: Dict[str, Any]) -> None:
+    global _worker_config
+    _worker_config = config
+    logging.basicConfig(level=logging.WARNING)
+    if config['frontend'] == 'torch':
+        import torch
+        torch.set_num_threads(max(1, int(config['intra_op_num_threads'])))
+    get_audio_processor(config['model_path'], config['sample_rate'], session_options=session_options_from_config(config),
+                        frontend=config['frontend'])
+
+def _enroll_job(speaker_name: str, enrollment_path: str):
+    config = _worker_config
+    processor = get_audio_processor(config['model_path'], config['sample_rate'], session_options=session_options_from_config(config),
+                                    frontend=config['frontend'])
+    audio, sr = processor.load_audio(enrollment_path)
+    return processor.extract_embedding(audio, sr)
+
+def _diarize_job(job: Dict[str, Any], enrollment_embeddings: Dict[str, Any]) -> Dict[str, Any]:
+    config = _worker_config
+    start_time = time.time()
+    result = {'job_id': job['job_id'], 'meeting_file': job['meeting'], 'output': job['output'],
+              'speakers': list(job['speakers']), 'worker_pid': os.getpid()}
+    try:
+        result['audio_duration'] = sf.info(job['meeting']).duration
+        processor = get_audio_processor(config['model_path'], config['sample_rate'], session_options=session_options_from_config(config),
+                                        frontend=config['frontend'])
+        engine = DynamicQuantizedDiarizationEngine(config['model_path'], config, processor)
+        threshold = config['default_threshold']
+        if len(enrollment_embeddings) == 1:
+            speaker_name, embedding = next(iter(enrollment_embeddings.items()))
+            if config['speaker_turns']:
+                timeline = engine.diarize_meeting_turns(job['meeting'], embedding, speaker_name, threshold)
+            else:
+                segments = engine.diarize_meeting(job['meeting'], embedding, speaker_name, threshold)
+                timeline = [{'start': float(start), 'end': float(end), 'speaker': speaker_name} for start, end in segments]
+            Path(job['output']).parent.mkdir(parents=True, exist_ok=True)
+            outputs = {speaker_name: job['output']}
+        else:
+            timeline = engine.diarize_meeting_multi(job['meeting'], enrollment_embeddings, threshold)
+            Path(job['output']).mkdir(parents=True, exist_ok=True)
+            outputs = {name: str(Path(job['output']) / f"{name}_dynamic_segments.wav") for name in enrollment_embeddings}
+        written = {}
+        for speaker_name, output_file in outputs.items():
+            segments = [(turn['start'], turn['end']) for turn in timeline if turn['speaker'] == speaker_name]
+            if segments and engine.extract_segments(job['meeting'], segments, output_file):
+                written[speaker_name] = output_file
+        result.update({
+            'status': 'success',
+            'timeline': timeline,
+            'output_files': written,
+            'total_segments': len(timeline),
+            'performance': engine.get_performance_summary()
+        })
+    except Exception as e:
+        result.update({'status': 'failed', 'error': str(e)})
+    finally:
+        # The meeting is done; don't let a long-lived worker hold on to it
+        get_audio_processor(config['model_path'], config['sample_rate'],
+                            session_options=session_options_from_config(config),
+                            frontend=config['frontend']).audio_cache.clear()
+    result['processing_time'] = time.time() - start_time
+    return result
+
+def _new_pool(config: Dict[str, Any], workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(config,))
+
+def _isolated_call(config: Dict[str, Any], func, args: tuple):
+    # One task in a fresh single-worker pool; if it kills its worker, only this task fails
+    pool = _new_pool(config, 1)
+    try:
+        return pool.submit(func, *args).result()
+    except BrokenProcessPool as e:
+        raise RuntimeError(f"Worker process died: {str(e)}")
+    finally:
+        pool.shutdown(wait=False)
+
+class _WorkerPool:
+    # Process pool that survives worker deaths. A dead worker breaks a
+    # ProcessPoolExecutor for good (every pending future and later submit
+    # raises BrokenProcessPool), and which task killed it is unknown, so the
+    # pool is replaced and the unfinished tasks are retried in isolation.
+
+    def __init__(self, config: Dict[str, Any], workers: int):
+        self.config = config
+        self.workers = workers
+        self.restarts = 0
+        self.pool = _new_pool(config, workers)
+
+    def run(self, tasks: Dict[Any, Tuple]) -> Iterator[Tuple[Any, Any, Optional[Exception]]]:
+        # tasks: key -> (func, args); yields (key, result, None) or (key, None, error) as tasks finish
+        futures = {}
+        unfinished = []
+        for key, (func, args) in tasks.items():
+            try:
+                futures[self.pool.submit(func, *args)] = key
+            except BrokenProcessPool:
+                unfinished.append(key)
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except BrokenProcessPool:
+                unfinished.append(futures[future])
+            except Exception as e:
+                yield futures[future], None, e
+        if not unfinished:
+            return
+        logger.warning(f"Worker process died; restarting the pool and retrying {len(unfinished)} unfinished "
+                       f"jobs in isolated workers")
+        self.pool.shutdown(wait=False)
+        self.pool = _new_pool(self.config, self.workers)
+        self.restarts += 1
+        with ThreadPoolExecutor(max_workers=self.workers) as threads:
+            retries = {threads.submit(_isolated_call, self.config, *tasks[key]): key for key in unfinished}
+            for future in as_completed(retries):
+                try:
+                    yield retries[future], future.result(), None
+                except Exception as e:
+                    yield retries[future], None, e
+
+    def shutdown(self) -> None:
+        self.pool.shutdown()
+
+def run_batch(jobs: List[Dict[str, Any]], config: Dict[str, Any], workers: int) -> Dict[str, Any]:
+    start_time = time.time()
+    workers = max(1, min(workers, len(jobs)))
+    config = dict(config)
+    if not config['intra_op_num_threads']:
+        config['intra_op_num_threads'] = max(1, (os.cpu_count() or 1) // workers)
+    config['inter_op_num_threads'] = 1
+    config['benchmark_model'] = False
+    logger.info(f"Running {len(jobs)} jobs on {workers} workers x {config['intra_op_num_threads']} threads")
+
+    store = SpeakerEmbeddingStore(config['speaker_store_dir']) if config.get('speaker_store_dir') else None
+    embeddings: Dict[tuple, Any] = {}
+    enrollment_errors: Dict[tuple, str] = {}
+    results = []
+    pool = _WorkerPool(config, workers)
+    try:
+        # 1. Embed every distinct enrollment once for the whole batch
+        pending = {}
+        for job in jobs:
+            for speaker_name, enrollment_path in job['speakers'].items():
+                key = (speaker_name, enrollment_path)
+                if key in embeddings or key in pending or key in enrollment_errors:
+                    continue
+                cached = store.get(speaker_name, config['model_path'], enrollment_path) if store else None
+                if cached is not None:
+                    embeddings[key] = cached
+                elif enrollment_path is None:
+                    enrollment_errors[key] = f"Speaker '{speaker_name}' has no enrollment file and no valid store entry"
+                else:
+                    pending[key] = (_enroll_job, (speaker_name, enrollment_path))
+        for key, embedding, error in pool.run(pending):
+            if error is not None:
+                enrollment_errors[key] = f"Enrollment of '{key[0]}' from {key[1]} failed: {str(error)}"
+                logger.warning(enrollment_errors[key])
+                continue
+            embeddings[key] = embedding
+            if store:
+                store.put(key[0], embedding, key[1], config['model_path'])
+
+        # 2. Diarize the meetings
+        tasks = {}
+        for job in jobs:
+            keys = list(job['speakers'].items())
+            errors = [enrollment_errors[key] for key in keys if key in enrollment_errors]
+            if errors:
+                results.append({'job_id': job['job_id'], 'meeting_file': job['meeting'], 'output': job['output'],
+                                'speakers': list(job['speakers']), 'status': 'failed', 'error': '; '.join(errors)})
+                continue
+            job_embeddings = {name: embeddings[(name, path)] for name, path in keys}
+            tasks[job['job_id']] = (_diarize_job, (job, job_embeddings))
+        jobs_by_id = {job['job_id']: job for job in jobs}
+        for job_id, result, error in pool.run(tasks):
+            job = jobs_by_id[job_id]
+            if error is not None:
+                # Worker crashed outright (e.g. out of memory), even when retried alone
+                result = {'job_id': job['job_id'], 'meeting_file': job['meeting'], 'output': job['output'],
+                          'speakers': list(job['speakers']), 'status': 'failed', 'error': str(error)}
+            if result['status'] == 'success':
+                logger.info(f"[SUCCESS] {job['meeting']}: {result['total_segments']} segments in {result['processing_time']:.1f}s")
+            else:
+                logger.warning(f"Job {job['job_id']} ({job['meeting']}) failed: {result['error']}")
+            results.append(result)
+    finally:
+        pool.shutdown()
+
+    results.sort(key=lambda r: r['job_id'])
+    wall_clock_time = time.time() - start_time
+    succeeded = [r for r in results if r['status'] == 'success']
+    audio_seconds = sum(r.get('audio_duration', 0.0) for r in succeeded)
+    summary = {
+        'total_jobs': len(jobs),
+        'succeeded': len(succeeded),
+        'failed': len(results) - len(succeeded),
+        'workers': workers,
+        'pool_restarts': pool.restarts,
+        'threads_per_worker': config['intra_op_num_threads'],
+        'audio_hours': audio_seconds / 3600.0,
+        'wall_clock_hours': wall_clock_time / 3600.0,
+        'throughput_audio_hours_per_hour': audio_seconds / wall_clock_time if wall_clock_time > 0 else 0.0
+    }
+    return {'summary': summary, 'jobs': results, 'timestamp': datetime.now().isoformat(), 'config': config}
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch speaker diarization over a manifest of meetings")
+    parser.add_argument('--manifest', required=True, help='CSV or JSONL manifest (meeting, speakers, output)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of worker processes')
+    parser.add_argument('--results', default='diarization_output/batch_results.json', help='Aggregated results JSON')
+    parser.add_argument('--model', help='Dynamic quantized ECAPA ONNX model path')
+    parser.add_argument('--threshold', type=float, help='Similarity threshold (0.0-1.0)')
+    parser.add_argument('--speaker-store', help='Directory of the persistent speaker embedding store')
+    parser.add_argument('--config', help='Configuration JSON file')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose logging')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    try:
+        config = load_config(args.config)
+        if args.model:
+            config['model_path'] = args.model
+        if args.threshold:
+            config['default_threshold'] = args.threshold
+        if args.speaker_store:
+            config['speaker_store_dir'] = args.speaker_store
+        jobs = load_manifest(args.manifest)
+        batch = run_batch(jobs, config, args.workers)
+        results_path = Path(args.results)
+        results_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(results_path, 'w') as f:
+            json.dump(batch, f, indent=2, default=str)
+        summary = batch['summary']
+        print("=" * 70)
+        print(f"[SUCCESS] {summary['succeeded']}/{summary['total_jobs']} meetings diarized ({summary['failed']} failed)")
+        print(f"[SUCCESS] Throughput: {summary['throughput_audio_hours_per_hour']:.1f} audio-hours per wall-clock hour "
+              f"({summary['workers']} workers x {summary['threads_per_worker']} threads)")
+        print(f"[SUCCESS] Saved results to {results_path}")
+        print("=" * 70)
+    except BatchManifestError as e:
+        print(f"[ERROR] {str(e)}")
+    except KeyboardInterrupt:
+        print("Batch diarization interrupted by user")
+    except Exception as e:
+        print(f"[ERROR] Unexpected error: {str(e)}")
+
+if __name__ == "__main__":
+    main()
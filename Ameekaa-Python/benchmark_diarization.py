@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""
+Benchmark the diarization pipeline end to end with a per-stage breakdown.
+
+Every input runs in a fresh process (so start-up cost and peak RSS are per
+input) through the real enrollment -> diarize_meeting -> extract_segments
+path. The processor and engine methods are wrapped with timers to split wall
+time into stages:
+
+    import, model_load, decode (load + resample), stft_mel, normalization, onnx,
+    similarity, wav_write
+
+Stage times are exclusive (a stage nested inside another is not counted
+twice). Per-window embedding latency is reported as p50/p95/p99 along with
+the real-time factor and peak RSS. Results go to a JSON file; pass an earlier
+file with --compare to flag RTF regressions between commits.
+
+--frontend-benchmark compares the torch and numpy log-mel front-ends instead:
+import time, first-window time, per-window latency and peak RSS (each in a
+fresh process), plus the feature / embedding difference against torch.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import logging
+import argparse
+import subprocess
+import tempfile
+import multiprocessing
+import numpy as np
+import soundfile as sf
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STAGES = ['import', 'model_load', 'decode', 'stft_mel', 'normalization', 'onnx', 'similarity', 'wav_write']
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+        except Exception:
+            return None
+
+class StageProfiler:
+    def __init__(self):
+        self.totals = {stage: 0.0 for stage in STAGES}
+        self.calls = {stage: 0 for stage in STAGES}
+        self._stack = []
+
+    def timed(self, stage: str, func):
+        def wrapper(*args, **kwargs):
+            self._stack.append(0.0)
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start_time
+                nested = self._stack.pop()
+                self.totals[stage] += elapsed - nested
+                self.calls[stage] += 1
+                if self._stack:
+                    self._stack[-1] += elapsed
+        return wrapper
+
+    def wrap(self, obj, method_name: str, stage: str) -> None:
+        setattr(obj, method_name, self.timed(stage, getattr(obj, method_name)))
+
+class _TimedSession:
+    def __init__(self, session, profiler: StageProfiler):
+        self._session = session
+        self.run = profiler.timed('onnx', session.run)
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+def _tap_window_latencies(engine, latencies: List[float]) -> None:
+    # _embed_windows is a generator and _embed_windows_batched returns a list
+    # (callers take its len()); the taps keep those return types
+    original_windows = engine._embed_windows
+    original_batched = engine._embed_windows_batched
+
+    def tapped_windows(*args, **kwargs):
+        for window in original_windows(*args, **kwargs):
+            if window[2] is not None:
+                latencies.append(window[3])
+            yield window
+
+    def tapped_batched(*args, **kwargs):
+        windows = original_batched(*args, **kwargs)
+        latencies.extend(window[3] for window in windows if window[2] is not None)
+        return windows
+    engine._embed_windows = tapped_windows
+    engine._embed_windows_batched = tapped_batched
+
+def _time_incremental_log_mel(processor, profiler: StageProfiler) -> None:
+    # Streaming whole-file features compute log-mel frames in
+    # IncrementalLogMelExtractor.push / finish, not extract_log_mel
+    original = processor.incremental_log_mel
+
+    def timed(*args, **kwargs):
+        extractor = original(*args, **kwargs)
+        profiler.wrap(extractor, 'push', 'stft_mel')
+        profiler.wrap(extractor, 'finish', 'stft_mel')
+        return extractor
+    processor.incremental_log_mel = timed
+
+def _benchmark_case(meeting_path: str, enroll_path: str, config: Dict[str, Any], repeat: int) -> Dict[str, Any]:
+    logging.basicConfig(level=logging.WARNING)
+    start_time = time.perf_counter()
+    from enrollment_dynamic_quantize import DynamicQuantizedAudioProcessor, session_options_from_config
+    from diarization_dynamic_quantize import DynamicQuantizedDiarizationEngine
+    import_time = time.perf_counter() - start_time
+
+    profiler = StageProfiler()
+    profiler.totals['import'] = import_time
+    profiler.calls['import'] = 1
+    processor = profiler.timed('model_load', DynamicQuantizedAudioProcessor)(
+        config['model_path'], config['sample_rate'], session_options=session_options_from_config(config),
+        frontend=config['frontend']
+    )
+    processor.session = _TimedSession(processor.session, profiler)
+    profiler.wrap(processor, 'load_audio', 'decode')
+    profiler.wrap(processor, 'extract_log_mel', 'stft_mel')
+    _time_incremental_log_mel(processor, profiler)
+    profiler.wrap(processor, 'normalize_features', 'normalization')
+    engine = DynamicQuantizedDiarizationEngine(config['model_path'], config, processor)
+    profiler.wrap(engine, 'compute_similarity', 'similarity')
+    profiler.wrap(engine, 'compute_similarity_matrix', 'similarity')
+    profiler.wrap(engine, 'extract_segments', 'wav_write')
+    latencies: List[float] = []
+    _tap_window_latencies(engine, latencies)
+
+    audio, sr = processor.load_audio(enroll_path)
+    enrollment_embedding = processor.extract_embedding(audio, sr)
+    duration = sf.info(meeting_path).duration
+    diarization_times = []
+    segments = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for _ in range(repeat):
+            run_start = time.perf_counter()
+            if config['speaker_turns']:
+                turns = engine.diarize_meeting_turns(meeting_path, enrollment_embedding, 'benchmark', config['default_threshold'],
+                                                     stream=config.get('stream'), block_duration=config['stream_block_duration'])
+                segments = [(turn['start'], turn['end']) for turn in turns]
+            elif config.get('stream'):
+                segments = list(engine.diarize_meeting_stream(meeting_path, enrollment_embedding, 'benchmark',
+                                                              config['default_threshold'], config['stream_block_duration']))
+            else:
+                segments = engine.diarize_meeting(meeting_path, enrollment_embedding, 'benchmark', config['default_threshold'])
+            if segments:
+                engine.extract_segments(meeting_path, segments, os.path.join(tmp_dir, 'segments.wav'))
+            diarization_times.append(time.perf_counter() - run_start)
+    total_time = time.perf_counter() - start_time
+    latencies_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        'input': meeting_path,
+        'audio_duration': duration,
+        'repeat': repeat,
+        'windows': len(latencies) // max(repeat, 1),
+        'matched_segments': len(segments),
+        'stages': {stage: profiler.totals[stage] / (1 if stage in ('import', 'model_load') else repeat) for stage in STAGES},
+        'stage_calls': profiler.calls,
+        'latency_ms': {
+            'mean': float(np.mean(latencies_ms)),
+            'p50': float(np.percentile(latencies_ms, 50)),
+            'p95': float(np.percentile(latencies_ms, 95)),
+            'p99': float(np.percentile(latencies_ms, 99))
+        },
+        'diarization_time': float(np.median(diarization_times)),
+        'rtf': float(np.median(diarization_times)) / duration if duration > 0 else 0.0,
+        'total_time': total_time,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+def _run_isolated(meeting_path: str, enroll_path: str, config: Dict[str, Any], repeat: int) -> Dict[str, Any]:
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1) as pool:
+        return pool.apply(_benchmark_case, (meeting_path, enroll_path, config, repeat))
+
+def _meeting_windows(inputs: List[str], config: Dict[str, Any], max_windows: int) -> List[np.ndarray]:
+    from enrollment_dynamic_quantize import decode_audio
+    window_samples = int(config['segment_length'] * config['sample_rate'])
+    step_samples = int(config['segment_step'] * config['sample_rate'])
+    windows = []
+    for path in inputs:
+        audio, _ = decode_audio(path, config['sample_rate'])
+        for start in range(0, len(audio) - window_samples + 1, step_samples):
+            windows.append(audio[start:start + window_samples])
+            if len(windows) >= max_windows:
+                return windows
+    return windows
+
+def _frontend_case(frontend: str, inputs: List[str], config: Dict[str, Any], max_windows: int,
+                   repeat: int) -> Dict[str, Any]:
+    # Runs in a fresh process: nothing imported yet, so import time and peak
+    # RSS are those of this front-end alone (no ONNX session is created)
+    start_time = time.perf_counter()
+    from enrollment_dynamic_quantize import compute_log_mel, DynamicQuantizedAudioProcessor
+    import_time = time.perf_counter() - start_time
+    windows = _meeting_windows(inputs, config, max_windows)
+    sr = config['sample_rate']
+    # First window pays the lazy torch import and filterbank construction
+    start_time = time.perf_counter()
+    DynamicQuantizedAudioProcessor.normalize_features(compute_log_mel(windows[0], sr, frontend=frontend))
+    first_window = time.perf_counter() - start_time
+    latencies = []
+    for _ in range(repeat):
+        for window in windows:
+            window_start = time.perf_counter()
+            DynamicQuantizedAudioProcessor.normalize_features(compute_log_mel(window, sr, frontend=frontend))
+            latencies.append(time.perf_counter() - window_start)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'frontend': frontend,
+        'windows': len(windows),
+        'import_time_ms': import_time * 1000,
+        'first_window_ms': first_window * 1000,
+        'cold_start_ms': (import_time + first_window) * 1000,
+        'latency_ms': {
+            'mean': float(np.mean(latencies_ms)),
+            'p50': float(np.percentile(latencies_ms, 50)),
+            'p95': float(np.percentile(latencies_ms, 95))
+        },
+        'peak_rss_mb': peak_rss_mb(),
+        'torch_imported': 'torch' in sys.modules
+    }
+
+def compare_frontends(inputs: List[str], config: Dict[str, Any], max_windows: int = 200,
+                      repeat: int = 3) -> Dict[str, Any]:
+    from enrollment_dynamic_quantize import FRONTENDS, get_audio_processor, session_options_from_config
+
+    ctx = multiprocessing.get_context('spawn')
+    cases = []
+    for frontend in FRONTENDS:
+        with ctx.Pool(1) as pool:
+            cases.append(pool.apply(_frontend_case, (frontend, inputs, config, max_windows, repeat)))
+    # Equivalence against the torch front-end, through the configured model
+    windows = _meeting_windows(inputs, config, max_windows)
+    processors = {frontend: get_audio_processor(config['model_path'], config['sample_rate'],
+                                                session_options=session_options_from_config(config), frontend=frontend)
+                  for frontend in FRONTENDS}
+    reference = processors['torch']
+    for case in cases:
+        processor = processors[case['frontend']]
+        feature_diffs, cosines = [], []
+        for window in windows:
+            features = processor.extract_features(window, config['sample_rate'])
+            reference_features = reference.extract_features(window, config['sample_rate'])
+            feature_diffs.append(float(np.max(np.abs(features - reference_features))))
+            embedding = processor.extract_embeddings_batch(features[np.newaxis])[0]
+            reference_embedding = reference.extract_embeddings_batch(reference_features[np.newaxis])[0]
+            cosines.append(float(np.dot(embedding, reference_embedding) /
+                                 (np.linalg.norm(embedding) * np.linalg.norm(reference_embedding))))
+        case['max_feature_diff'] = max(feature_diffs)
+        case['min_embedding_cosine'] = min(cosines)
+    print(f"{'front-end':<10} {'import':>9} {'1st window':>11} {'p50':>8} {'p95':>8} {'peak RSS':>9} "
+          f"{'torch':>6} {'max diff':>9} {'cos min':>9}")
+    for case in cases:
+        print(f"{case['frontend']:<10} {case['import_time_ms']:>7.0f}ms {case['first_window_ms']:>9.0f}ms "
+              f"{case['latency_ms']['p50']:>6.2f}ms {case['latency_ms']['p95']:>6.2f}ms {case['peak_rss_mb'] or 0:>7.0f}MB "
+              f"{'yes' if case['torch_imported'] else 'no':>6} {case['max_feature_diff']:>9.1e} {case['min_embedding_cosine']:>9.6f}")
+    return {'windows': len(windows), 'repeat': repeat, 'cases': cases}
+
+def make_synthetic_meeting(source_path: str, minutes: float, output_dir: str) -> str:
+    audio, sr = sf.read(source_path, dtype='int16')
+    n_samples = int(minutes * 60 * sr)
+    output_path = os.path.join(output_dir, f"synthetic_{minutes:g}min_{Path(source_path).stem}.wav")
+    with sf.SoundFile(output_path, 'w', samplerate=sr, channels=1 if audio.ndim == 1 else audio.shape[1], subtype='PCM_16') as f:
+        written = 0
+        while written < n_samples:
+            chunk = audio[:n_samples - written]
+            f.write(chunk)
+            written += len(chunk)
+    return output_path
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except Exception:
+        return None
+
+def compare_results(current: Dict[str, Any], previous: Dict[str, Any], tolerance: float) -> List[str]:
+    previous_cases = {Path(case['input']).name: case for case in previous.get('cases', [])}
+    regressions = []
+    print(f"{'input':<45} {'rtf before':>10} {'rtf now':>10} {'change':>8}")
+    for case in current['cases']:
+        before = previous_cases.get(Path(case['input']).name)
+        if before is None or not before.get('rtf'):
+            continue
+        change = (case['rtf'] - before['rtf']) / before['rtf']
+        print(f"{Path(case['input']).name:<45} {before['rtf']:>10.3f} {case['rtf']:>10.3f} {change:>+8.1%}")
+        if change > tolerance:
+            regressions.append(f"{Path(case['input']).name}: RTF {before['rtf']:.3f} -> {case['rtf']:.3f} ({change:+.1%})")
+    return regressions
+
+def _frame_labels(timeline: List[Dict[str, Any]], speakers: List[str], duration: float, frame: float = 0.01) -> np.ndarray:
+    labels = np.full(int(np.ceil(duration / frame)), -1)
+    # Where turns of different speakers overlap, the better-scoring one wins
+    for turn in sorted(timeline, key=lambda turn: turn['similarity']):
+        labels[int(turn['start'] / frame):int(turn['end'] / frame)] = speakers.index(turn['speaker'])
+    return labels
+
+def _boundaries(timeline: List[Dict[str, Any]]) -> np.ndarray:
+    return np.array(sorted({t for turn in timeline for t in (turn['start'], turn['end'])}))
+
+def compare_search_modes(inputs: List[str], enroll_paths: List[str], config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    from enrollment_dynamic_quantize import get_audio_processor, session_options_from_config
+    from diarization_dynamic_quantize import DynamicQuantizedDiarizationEngine
+
+    processor = get_audio_processor(config['model_path'], config['sample_rate'], session_options=session_options_from_config(config),
+                                    frontend=config['frontend'])
+    enrollments = {Path(path).stem.replace('_speaker_enrollment', ''): processor.extract_embedding(*processor.load_audio(path))
+                   for path in enroll_paths}
+    speakers = list(enrollments)
+    modes = {
+        'dense': {'segment_step': config['fine_step'], 'coarse_to_fine': False},
+        'coarse': {'segment_step': config['segment_step'], 'coarse_to_fine': False},
+        'coarse_to_fine': {'segment_step': config['segment_step'], 'coarse_to_fine': True}
+    }
+    comparisons = []
+    for meeting_path in inputs:
+        duration = sf.info(meeting_path).duration
+        processor.load_audio(meeting_path)
+        runs = {}
+        for mode, overrides in modes.items():
+            engine = DynamicQuantizedDiarizationEngine(config['model_path'], dict(config, **overrides), processor)
+            start_time = time.perf_counter()
+            timeline = engine.diarize_meeting_multi(meeting_path, enrollments, config['default_threshold'])
+            elapsed = time.perf_counter() - start_time
+            performance = engine.get_performance_summary()
+            runs[mode] = {
+                'time': elapsed,
+                'rtf': elapsed / duration if duration > 0 else 0.0,
+                'embedded_windows': performance['vad_processed_windows'],
+                'refined_windows': performance['refined_windows'],
+                'turns': len(timeline),
+                'timeline': timeline
+            }
+        dense_labels = _frame_labels(runs['dense']['timeline'], speakers, duration)
+        dense_boundaries = _boundaries(runs['dense']['timeline'])
+        for run in runs.values():
+            labels = _frame_labels(run['timeline'], speakers, duration)
+            boundaries = _boundaries(run['timeline'])
+            run['frame_agreement_with_dense'] = float(np.mean(labels == dense_labels)) if len(labels) else 1.0
+            run['mean_boundary_error'] = (float(np.mean([np.min(np.abs(boundaries - b)) for b in dense_boundaries]))
+                                          if len(dense_boundaries) and len(boundaries) else 0.0)
+        for run in runs.values():
+            run.pop('timeline')
+        comparisons.append({'input': meeting_path, 'audio_duration': duration, 'speakers': speakers, 'modes': runs})
+        print(f"{Path(meeting_path).name} ({duration:.0f}s, {len(speakers)} speakers)")
+        print(f"  {'mode':<16} {'windows':>8} {'time':>8} {'RTF':>7} {'turns':>6} {'agreement':>10} {'boundary err':>13}")
+        for mode, run in runs.items():
+            print(f"  {mode:<16} {run['embedded_windows']:>8} {run['time']:>7.2f}s {run['rtf']:>7.3f} {run['turns']:>6} "
+                  f"{run['frame_agreement_with_dense']:>10.1%} {run['mean_boundary_error']:>12.2f}s")
+    return comparisons
+
+def benchmark_speaker_index(gallery_sizes: List[int], dim: int = 192, n_queries: int = 30,
+                            repeat: int = 20) -> List[Dict[str, Any]]:
+    from speaker_index import SpeakerEmbeddingIndex
+
+    rng = np.random.default_rng(0)
+    results = []
+    print(f"{'gallery':>8} {'variant':<10} {'MB':>7} {'1 query':>9} {f'{n_queries} queries':>11} {'recall@1':>9}")
+    for size in gallery_sizes:
+        gallery = rng.standard_normal((size, dim)).astype(np.float32)
+        # Queries are noisy copies of enrolled speakers, like real windows
+        targets = rng.integers(0, size, n_queries)
+        queries = gallery[targets] + 0.8 * rng.standard_normal((n_queries, dim)).astype(np.float32)
+        names = [f"speaker_{i}" for i in range(size)]
+        exact_best = None
+        for variant in ('float32', 'int8', 'ivf'):
+            index = SpeakerEmbeddingIndex(names, gallery, 'int8' if variant == 'int8' else 'float32')
+            if variant == 'ivf':
+                if size < 1000:
+                    continue
+                index.build_ivf()
+            timings = {}
+            for batch in (1, n_queries):
+                index.search(queries[:batch], k=5)
+                start_time = time.perf_counter()
+                for _ in range(repeat):
+                    best, _ = index.search(queries[:batch], k=5)
+                timings[batch] = (time.perf_counter() - start_time) / repeat * 1000
+            if exact_best is None:
+                exact_best = best[:, 0]
+            recall = float(np.mean(best[:, 0] == exact_best))
+            results.append({'gallery_size': size, 'variant': variant, 'index_mb': index.nbytes / (1024 * 1024),
+                            'latency_ms_single': timings[1], f'latency_ms_batch_{n_queries}': timings[n_queries],
+                            'recall_at_1_vs_exact': recall})
+            print(f"{size:>8} {variant:<10} {index.nbytes / (1024 * 1024):>7.1f} {timings[1]:>7.2f}ms "
+                  f"{timings[n_queries]:>9.2f}ms {recall:>9.1%}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the diarization pipeline with a per-stage breakdown")
+    parser.add_argument('--inputs', nargs='+', default=['test_data/*_meeting_audio.wav'], help='Meeting WAV files or glob patterns')
+    parser.add_argument('--enroll', default='test_data/sami_speaker_enrollment.wav', help='Enrollment WAV used for every input')
+    parser.add_argument('--synthetic-minutes', type=float, nargs='*', default=[], help='Also benchmark synthetic meetings of these lengths')
+    parser.add_argument('--repeat', type=int, default=1, help='Diarization runs per input (model loaded once)')
+    parser.add_argument('--model', help='Dynamic quantized ECAPA ONNX model path')
+    parser.add_argument('--batch-size', type=int, help='Number of windows per ONNX batch')
+    parser.add_argument('--whole-file-features', action='store_true', help='Compute log-mel features once per meeting')
+    parser.add_argument('--stream', action='store_true', help='Use streaming diarization')
+    parser.add_argument('--config', help='Configuration JSON file')
+    parser.add_argument('--output', default='benchmark_output/benchmark_results.json', help='Results JSON file')
+    parser.add_argument('--compare', help='Earlier results JSON to compare against')
+    parser.add_argument('--search-comparison', action='store_true',
+                        help='Compare dense, coarse and coarse-to-fine window search on the inputs instead')
+    parser.add_argument('--speakers', default='test_data/*_speaker_enrollment.wav',
+                        help='Enrollment WAV glob for --search-comparison (all speakers are scored)')
+    parser.add_argument('--index-benchmark', type=int, nargs='*',
+                        help='Benchmark speaker index search latency for these gallery sizes instead')
+    parser.add_argument('--frontend', choices=['torch', 'numpy'], help='Log-mel front-end for the pipeline benchmark')
+    parser.add_argument('--frontend-benchmark', action='store_true',
+                        help='Compare the torch and numpy log-mel front-ends on windows of the inputs instead')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative RTF increase before flagging a regression')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.index_benchmark is not None:
+        index_results = benchmark_speaker_index(args.index_benchmark or [100, 1000, 10000, 100000])
+        output_path = Path(args.output)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'w') as f:
+            json.dump({'revision': git_revision(), 'timestamp': datetime.now().isoformat(),
+                       'speaker_index': index_results}, f, indent=2)
+        print(f"[SUCCESS] Saved speaker index benchmark to {output_path}")
+        return
+    from run_dynamic_quantized_diarization import load_config
+
+    config = load_config(args.config)
+    if args.model:
+        config['model_path'] = args.model
+    if args.batch_size:
+        config['batch_size'] = args.batch_size
+    if args.whole_file_features:
+        config['whole_file_features'] = True
+    if args.frontend:
+        config['frontend'] = args.frontend
+    config['stream'] = args.stream
+    config['model_path'] = os.path.abspath(config['model_path'])
+
+    inputs = sorted({path for pattern in args.inputs for path in glob.glob(pattern)})
+    if not inputs and not args.synthetic_minutes:
+        print("[ERROR] No input files found")
+        sys.exit(1)
+    if args.search_comparison:
+        comparisons = compare_search_modes(inputs, sorted(glob.glob(args.speakers)), config)
+        output_path = Path(args.output)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'w') as f:
+            json.dump({'revision': git_revision(), 'timestamp': datetime.now().isoformat(), 'config': config,
+                       'search_comparison': comparisons}, f, indent=2, default=str)
+        print(f"[SUCCESS] Saved search comparison to {output_path}")
+        return
+    if args.frontend_benchmark:
+        frontends = compare_frontends(inputs, config, repeat=max(args.repeat, 3))
+        output_path = Path(args.output)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'w') as f:
+            json.dump({'revision': git_revision(), 'timestamp': datetime.now().isoformat(), 'config': config,
+                       'frontend_benchmark': frontends}, f, indent=2, default=str)
+        print(f"[SUCCESS] Saved front-end benchmark to {output_path}")
+        return
+    cases = []
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        source = inputs[0] if inputs else args.enroll
+        inputs += [make_synthetic_meeting(source, minutes, synthetic_dir) for minutes in args.synthetic_minutes]
+        for meeting_path in inputs:
+            logger.info(f"Benchmarking {meeting_path}")
+            try:
+                case = _run_isolated(os.path.abspath(meeting_path), os.path.abspath(args.enroll), config, args.repeat)
+            except Exception as e:
+                logger.warning(f"Benchmark of {meeting_path} failed: {str(e)}")
+                continue
+            if meeting_path.startswith(synthetic_dir):
+                case['input'] = os.path.basename(meeting_path)
+            cases.append(case)
+            stages = ', '.join(f"{stage} {seconds:.2f}s" for stage, seconds in case['stages'].items())
+            logger.info(f"[SUCCESS] {Path(meeting_path).name}: RTF {case['rtf']:.3f}, p50/p95/p99 "
+                        f"{case['latency_ms']['p50']:.1f}/{case['latency_ms']['p95']:.1f}/{case['latency_ms']['p99']:.1f}ms, "
+                        f"peak RSS {case['peak_rss_mb'] or 0:.0f}MB")
+            logger.info(f"          {stages}")
+
+    total_audio = sum(case['audio_duration'] for case in cases)
+    total_diarization = sum(case['diarization_time'] for case in cases)
+    results = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(),
+        'config': config,
+        'cases': cases,
+        'aggregate': {
+            'audio_duration': total_audio,
+            'diarization_time': total_diarization,
+            'rtf': total_diarization / total_audio if total_audio > 0 else 0.0,
+            'stages': {stage: sum(case['stages'][stage] for case in cases) for stage in STAGES},
+            'peak_rss_mb': max((case['peak_rss_mb'] or 0 for case in cases), default=0)
+        }
+    }
+    output_path = Path(args.output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"[SUCCESS] Saved benchmark results to {output_path} (aggregate RTF {results['aggregate']['rtf']:.3f})")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)
+        regressions = compare_results(results, previous, args.tolerance)
+        if regressions:
+            print("[ERROR] Performance regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("[SUCCESS] No RTF regressions beyond tolerance")
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,89 @@ import os
 import numpy as np
 import soundfile as sf
 import logging
+import threading
 import time
-from typing import List, Tuple, Dict, Any
-from datetime import datetime
+from typing import List, Tuple, Dict, Any, Iterable, Iterator, Optional, Union
+
+from speaker_index import SpeakerEmbeddingIndex
 
 logger = logging.getLogger(__name__)
 
 class DynamicQuantizedDiarizationError(Exception):
     pass
 
+def merge_segments(segments: Iterable[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    merged: List[Tuple[float, float]] = []
+    for start, end in sorted(segments):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def is_speech(log_mel: np.ndarray, energy_threshold: float = -45.0, min_active_ratio: float = 0.1,
+              min_energy_range: float = 3.0, min_flux: float = 0.05) -> bool:
+    # Cheap VAD on a window's natural-log mel frames [frames, n_mels]. Speech
+    # needs enough frames above an absolute energy floor, syllable-rate energy
+    # modulation (p90 - p10 of frame energy) and spectral change between
+    # frames. Silence fails the first test, stationary noise (fans, white
+    # noise) the second and tones / hum the third.
+    if len(log_mel) < 2:
+        return True
+    frame_energy = (10.0 / np.log(10.0)) * np.logaddexp.reduce(log_mel, axis=1)
+    if np.mean(frame_energy > energy_threshold) < min_active_ratio:
+        return False
+    p10, p90 = np.percentile(frame_energy, [10, 90])
+    if p90 - p10 < min_energy_range:
+        return False
+    flux = np.maximum(np.diff(log_mel, axis=0), 0.0).mean()
+    return bool(flux >= min_flux)
+
+def build_speaker_turns(scored_windows: Iterable[Tuple[float, float, float]], enter_threshold: float,
+                        exit_threshold: float, min_duration: float = 0.0,
+                        max_gap: float = 0.0) -> Iterator[Dict[str, Any]]:
+    # Hysteresis over time-ordered (start, end, similarity) windows: a turn
+    # opens at enter_threshold and stays open while windows score at least
+    # exit_threshold. A match starting within max_gap of the first window that
+    # fell below it re-opens the turn instead of starting a new one (measured
+    # from window starts, so overlapping windows don't bridge every dip). A
+    # match that starts before the turn's end always continues it, so one
+    # speaker's turns never overlap.
+    # Turns are yielded as soon as no later window can extend them, so this
+    # also works on streamed windows.
+    turn = None
+    in_turn = False
+    gap_start = 0.0
+
+    def finish(turn):
+        return {
+            'start': float(turn['start']),
+            'end': float(turn['end']),
+            'similarity': float(np.mean(turn['similarities'])),
+            'windows': len(turn['similarities'])
+        }
+
+    for start, end, similarity in scored_windows:
+        if in_turn and start > turn['end']:
+            # Windows in between were skipped
+            in_turn = False
+            gap_start = turn['end']
+        if turn is not None and not in_turn and start - gap_start > max_gap and start >= turn['end']:
+            if turn['end'] - turn['start'] >= min_duration:
+                yield finish(turn)
+            turn = None
+        if similarity >= (exit_threshold if in_turn else enter_threshold):
+            if turn is None:
+                turn = {'start': start, 'end': end, 'similarities': []}
+            turn['end'] = max(turn['end'], end)
+            turn['similarities'].append(similarity)
+            in_turn = True
+        elif in_turn:
+            in_turn = False
+            gap_start = start
+    if turn is not None and turn['end'] - turn['start'] >= min_duration:
+        yield finish(turn)
+
 class DynamicQuantizedDiarizationEngine:
     def __init__(self, model_path: str, config: Dict[str, Any], audio_processor):
         self.config = config
@@ -18,12 +92,40 @@ class DynamicQuantizedDiarizationEngine:
         self.segment_length = config['segment_length']
         self.segment_step = config['segment_step']
         self.min_segment_ratio = config['min_segment_ratio']
+        self.batch_size = max(1, int(config.get('batch_size', 1)))
+        self.whole_file_features = bool(config.get('whole_file_features', False))
+        self.stream_block_duration = float(config.get('stream_block_duration', 10.0))
+        self.vad_enabled = bool(config.get('vad_enabled', False))
+        self.vad_params = {
+            'energy_threshold': float(config.get('vad_energy_threshold', -45.0)),
+            'min_active_ratio': float(config.get('vad_min_active_ratio', 0.1)),
+            'min_energy_range': float(config.get('vad_min_energy_range', 3.0)),
+            'min_flux': float(config.get('vad_min_flux', 0.05))
+        }
+        self.coarse_to_fine = bool(config.get('coarse_to_fine', False))
+        self.fine_step = float(config.get('fine_step', 0.5))
+        self.refine_margin = float(config.get('refine_margin', 0.1))
+        self.speaker_turns = bool(config.get('speaker_turns', False))
+        self.turn_hysteresis = float(config.get('turn_hysteresis', 0.05))
+        self.min_turn_duration = float(config.get('min_turn_duration', 0.0))
+        self.max_turn_gap = float(config.get('max_turn_gap', 0.0))
+        if self.batch_size > 1 and not getattr(self.audio_processor, 'supports_batching', False):
+            logger.warning("ONNX model has a fixed batch axis; falling back to per-window inference "
+                           "(re-export with ecapa_to_onnx_pipeline.py to enable batching)")
+            self.batch_size = 1
         self.performance_stats = {
             'total_inference_time': 0.0,
             'total_segments_processed': 0,
             'enrollment_time': 0.0,
-            'diarization_time': 0.0
+            'diarization_time': 0.0,
+            'feature_extraction_time': 0.0,
+            'vad_skipped_windows': 0,
+            'vad_processed_windows': 0,
+            'refined_windows': 0,
+            'first_window_time': None
         }
+        # window_features may run on several threads at once (diarization service)
+        self._stats_lock = threading.Lock()
         logger.info(f"[SUCCESS] Initialized dynamic quantized diarization engine")
         logger.info(f"[SUCCESS] Model performance: {getattr(self.audio_processor, 'benchmark_results', None)}")
 
@@ -37,6 +139,334 @@ class DynamicQuantizedDiarizationEngine:
             logger.warning(f"Similarity computation failed: {str(e)}")
             return 0.0
 
+    def compute_similarity_matrix(self, embeddings1: np.ndarray, embeddings2: np.ndarray) -> np.ndarray:
+        emb1_norm = embeddings1 / (np.linalg.norm(embeddings1, axis=1, keepdims=True) + 1e-8)
+        emb2_norm = embeddings2 / (np.linalg.norm(embeddings2, axis=1, keepdims=True) + 1e-8)
+        return np.clip(emb1_norm @ emb2_norm.T, -1.0, 1.0)
+
+    def _iter_windows(self, audio: np.ndarray, sr: int, duration: float, starts: Optional[Iterable[float]] = None):
+        if starts is None:
+            starts = np.arange(0, duration, self.segment_step)
+        for start in starts:
+            end = min(start + self.segment_length, duration)
+            segment_audio = audio[int(start*sr):int(end*sr)]
+            if len(segment_audio) < int(self.segment_length * sr * self.min_segment_ratio):
+                continue
+            yield start, end, segment_audio
+
+    def _meeting_log_mel(self, audio: np.ndarray, sr: int):
+        if not self.whole_file_features:
+            return None
+        feature_start_time = time.time()
+        log_mel = self.audio_processor.extract_log_mel(audio, sr)
+        self._add_stat('feature_extraction_time', time.time() - feature_start_time)
+        logger.info(f"Computed whole-file log-mel features: {log_mel.shape[0]} frames")
+        return log_mel
+
+    def _add_stat(self, key: str, value) -> None:
+        with self._stats_lock:
+            self.performance_stats[key] += value
+
+    def _reset_run_stats(self) -> None:
+        self.performance_stats['feature_extraction_time'] = 0.0
+        self.performance_stats['vad_skipped_windows'] = 0
+        self.performance_stats['vad_processed_windows'] = 0
+        self.performance_stats['refined_windows'] = 0
+
+    def _window_features(self, segment_audio: np.ndarray, start: float, sr: int, log_mel) -> Optional[np.ndarray]:
+        # Returns None for windows the VAD marks as non-speech. Windows from
+        # _iter_stream_frame_windows arrive as [frames, n_mels] log-mel views
+        # rather than samples. A waveform-input model gets the samples and
+        # log-mel is only computed for the VAD.
+        feature_start_time = time.time()
+        waveform_input = getattr(self.audio_processor, 'waveform_input', False)
+        if segment_audio.ndim == 2:
+            window_log_mel = segment_audio
+        elif waveform_input and not self.vad_enabled:
+            window_log_mel = None
+        elif log_mel is None:
+            window_log_mel = self.audio_processor.extract_log_mel(segment_audio, sr)
+        else:
+            # Frames of a centred STFT over the window line up with the
+            # whole-file frames at the same hop; only the couple of frames at
+            # each edge differ, because they see real neighbouring audio here
+            # instead of reflect padding.
+            hop_length = self.audio_processor.hop_length
+            first_frame = int(round(start * sr / hop_length))
+            n_frames = 1 + len(segment_audio) // hop_length
+            window_log_mel = log_mel[first_frame:first_frame + n_frames]
+        feats = None
+        if not self.vad_enabled or is_speech(window_log_mel, **self.vad_params):
+            if waveform_input:
+                feats = self.audio_processor.model_input(segment_audio, sr)
+            else:
+                feats = self.audio_processor.normalize_features(window_log_mel)
+            self._add_stat('vad_processed_windows', 1)
+        else:
+            self._add_stat('vad_skipped_windows', 1)
+            logger.debug(f"Segment {start:.2f}s: no speech detected, skipping")
+        self._add_stat('feature_extraction_time', time.time() - feature_start_time)
+        return feats
+
+    def _iter_stream_windows(self, blocks: Iterable[np.ndarray], sr: int, stream_info: Dict[str, Any]):
+        # Mirrors _iter_windows without knowing the duration up front: a window
+        # is emitted once enough samples have arrived to cover it, and samples
+        # before the next window start are dropped, so at most one window plus
+        # one block of audio is held in memory.
+        window_samples = int(np.ceil(self.segment_length * sr))
+        buffer = np.zeros(window_samples, dtype=np.float32)
+        buffer_start = 0
+        buffer_len = 0
+        samples_read = 0
+        window_index = 0
+        start = 0.0
+        for block in blocks:
+            block_offset = max(buffer_start - samples_read, 0)
+            samples_read += len(block)
+            stream_info['samples_read'] = samples_read
+            block = block[block_offset:]
+            if buffer_len + len(block) > len(buffer):
+                grown = np.zeros(buffer_len + len(block), dtype=np.float32)
+                grown[:buffer_len] = buffer[:buffer_len]
+                buffer = grown
+            buffer[buffer_len:buffer_len + len(block)] = block
+            buffer_len += len(block)
+            while (start + self.segment_length) * sr <= samples_read:
+                end = start + self.segment_length
+                yield start, end, buffer[int(start*sr) - buffer_start:int(end*sr) - buffer_start].copy()
+                window_index += 1
+                start = window_index * self.segment_step
+                drop = int(start*sr) - buffer_start
+                if drop > 0:
+                    keep = max(buffer_len - drop, 0)
+                    buffer[:keep] = buffer[buffer_len - keep:buffer_len]
+                    buffer_len = keep
+                    buffer_start += drop
+        duration = samples_read / sr
+        while start < duration:
+            end = min(start + self.segment_length, duration)
+            segment_audio = buffer[int(start*sr) - buffer_start:int(end*sr) - buffer_start].copy()
+            if len(segment_audio) >= int(self.segment_length * sr * self.min_segment_ratio):
+                yield start, end, segment_audio
+            window_index += 1
+            start = window_index * self.segment_step
+
+    def _iter_stream_frame_windows(self, blocks: Iterable[np.ndarray], sr: int, stream_info: Dict[str, Any]):
+        # Streaming counterpart of whole_file_features: every log-mel frame is
+        # computed once by an IncrementalLogMelExtractor as blocks arrive, and
+        # each window is yielded as a view into its ring buffer as soon as its
+        # last frame exists, so overlapping windows share frames and the work
+        # per block is proportional to the new samples. Windows and frames
+        # match _iter_windows over whole-file features.
+        hop_length = self.audio_processor.hop_length
+        window_frames = 1 + int(self.segment_length * sr) // hop_length
+        extractor = self.audio_processor.incremental_log_mel(capacity=2 * window_frames)
+        window_index = 0
+
+        def ready_windows(final):
+            nonlocal window_index
+            samples_read = extractor.samples_received
+            while True:
+                start = window_index * self.segment_step
+                end = start + self.segment_length
+                first_sample, last_sample = int(start*sr), int(end*sr)
+                if last_sample > samples_read:
+                    if not final or first_sample >= samples_read:
+                        return
+                    end = samples_read / sr
+                    last_sample = int(end*sr)
+                first_frame = int(round(start * sr / hop_length))
+                n_frames = 1 + (last_sample - first_sample) // hop_length
+                if first_frame + n_frames > extractor.frames_computed:
+                    return
+                window_index += 1
+                if last_sample - first_sample >= int(self.segment_length * sr * self.min_segment_ratio):
+                    yield start, end, extractor.frames(first_frame, n_frames)
+                extractor.release(int(round(window_index * self.segment_step * sr / hop_length)))
+
+        for block in blocks:
+            feature_start_time = time.time()
+            extractor.push(block)
+            self._add_stat('feature_extraction_time', time.time() - feature_start_time)
+            stream_info['samples_read'] = extractor.samples_received
+            yield from ready_windows(False)
+        extractor.finish()
+        yield from ready_windows(True)
+
+    def _embed_windows(self, windows: Iterable[Tuple[float, float, np.ndarray]], sr: int, log_mel=None):
+        for start, end, segment_audio in windows:
+            try:
+                segment_start_time = time.time()
+                feats = self._window_features(segment_audio, start, sr, log_mel)
+                if feats is None:
+                    yield start, end, None, 0.0
+                    continue
+                segment_embedding = self.audio_processor.extract_embeddings_batch(feats[np.newaxis, ...])[0]
+                yield start, end, segment_embedding, time.time() - segment_start_time
+            except Exception as e:
+                logger.warning(f"Failed to process segment {start:.2f}s-{end:.2f}s: {str(e)}")
+                yield start, end, None, 0.0
+
+    def _embed_windows_batched(self, windows: Iterable[Tuple[float, float, np.ndarray]], sr: int, log_mel=None):
+        # Windows are bucketed by frame count so that every ONNX batch holds
+        # equal-length inputs; padding would change the pooled statistics and
+        # break parity with the per-window path. Only the trailing partial
+        # windows end up in their own (small) buckets.
+        results = []
+        pending = {}
+
+        def flush(n_frames):
+            items = pending.pop(n_frames)
+            batch = np.stack([feats for _, feats in items])
+            try:
+                batch_start_time = time.time()
+                embeddings = self.audio_processor.extract_embeddings_batch(batch)
+                per_window_time = (time.time() - batch_start_time) / len(items)
+                for (idx, _), embedding in zip(items, embeddings):
+                    results[idx][2:] = [embedding, per_window_time]
+            except Exception as e:
+                for idx, _ in items:
+                    logger.warning(f"Failed to process segment {results[idx][0]:.2f}s-{results[idx][1]:.2f}s: {str(e)}")
+
+        for start, end, segment_audio in windows:
+            results.append([start, end, None, 0.0])
+            try:
+                feats = self._window_features(segment_audio, start, sr, log_mel)
+            except Exception as e:
+                logger.warning(f"Failed to process segment {start:.2f}s-{end:.2f}s: {str(e)}")
+                continue
+            if feats is None:
+                continue
+            bucket = pending.setdefault(feats.shape[0], [])
+            bucket.append((len(results) - 1, feats))
+            if len(bucket) >= self.batch_size:
+                flush(feats.shape[0])
+        for n_frames in list(pending):
+            flush(n_frames)
+        return [tuple(r) for r in results]
+
+    def _score_windows(self, embedded_windows, enrollment_embedding: np.ndarray,
+                       counters: Dict[str, Any]) -> Iterator[Tuple[float, float, float]]:
+        for start, end, segment_embedding, segment_inference_time in embedded_windows:
+            counters['total_segments'] += 1
+            if segment_embedding is None:
+                continue
+            self._mark_first_window()
+            counters['total_inference_time'] += segment_inference_time
+            similarity = self.compute_similarity(segment_embedding, enrollment_embedding)
+            logger.debug(f"Segment {start:.2f}s-{end:.2f}s | Similarity: {similarity:.3f} | Time: {segment_inference_time*1000:.1f}ms")
+            yield start, end, similarity
+
+    def _match_windows(self, embedded_windows, enrollment_embedding: np.ndarray,
+                       speaker_name: str, threshold: float, counters: Dict[str, Any]) -> Iterator[Tuple[float, float]]:
+        for start, end, similarity in self._score_windows(embedded_windows, enrollment_embedding, counters):
+            if similarity >= threshold:
+                counters['matched_segments'] += 1
+                logger.info(f"  -> Matched {speaker_name} (Similarity: {similarity:.3f})")
+                yield start, end
+
+    def _build_turns(self, scored_windows, speaker_name: str, threshold: float,
+                     counters: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        for turn in build_speaker_turns(scored_windows, threshold, threshold - self.turn_hysteresis,
+                                        self.min_turn_duration, self.max_turn_gap):
+            counters['matched_segments'] += turn['windows']
+            logger.info(f"  -> {speaker_name} turn {turn['start']:.2f}s-{turn['end']:.2f}s "
+                        f"({turn['windows']} windows, mean similarity: {turn['similarity']:.3f})")
+            turn['speaker'] = speaker_name
+            yield turn
+
+    def _mark_first_window(self) -> None:
+        # Wall-clock time the first window was scored, for start-up latency reporting
+        if self.performance_stats['first_window_time'] is None:
+            self.performance_stats['first_window_time'] = time.time()
+
+    def _record_run(self, counters: Dict[str, Any], start_time: float, duration: float) -> None:
+        diarization_time = time.time() - start_time
+        total_segments = counters['total_segments']
+        total_inference_time = counters['total_inference_time']
+        self.performance_stats['diarization_time'] = diarization_time
+        self.performance_stats['total_inference_time'] = total_inference_time
+        self.performance_stats['total_segments_processed'] = total_segments
+        avg_inference_time = total_inference_time / total_segments if total_segments > 0 else 0
+        real_time_factor = diarization_time / duration if duration > 0 else 0
+        logger.info(f"[SUCCESS] Diarization completed: {counters['matched_segments']}/{total_segments} segments matched")
+        if self.vad_enabled:
+            logger.info(f"[SUCCESS] VAD: {self.performance_stats['vad_processed_windows']} windows embedded, "
+                        f"{self.performance_stats['vad_skipped_windows']} skipped as non-speech")
+        logger.info(f"[SUCCESS] Processing time: {diarization_time:.2f}s (RTF: {real_time_factor:.2f}x)")
+        logger.info(f"[SUCCESS] Average inference time per segment: {avg_inference_time*1000:.1f}ms")
+
+    def _embed_meeting(self, audio: np.ndarray, sr: int, duration: float, label_windows=None, threshold: float = 0.0):
+        log_mel = self._meeting_log_mel(audio, sr)
+        windows = self._iter_windows(audio, sr, duration)
+        if self.batch_size > 1:
+            logger.info(f"Batched inference enabled (batch size: {self.batch_size})")
+            embedded_windows = self._embed_windows_batched(windows, sr, log_mel)
+        else:
+            embedded_windows = self._embed_windows(windows, sr, log_mel)
+        if self.coarse_to_fine and label_windows is not None:
+            return self._refine_windows(list(embedded_windows), audio, sr, duration, log_mel, label_windows, threshold)
+        return embedded_windows
+
+    def _refine_windows(self, coarse_windows, audio: np.ndarray, sr: int, duration: float, log_mel,
+                        label_windows, threshold: float):
+        # Coarse-to-fine search: the segment_step scan above is re-scored with
+        # fine_step windows only where the label changes between neighbouring
+        # coarse windows (a boundary lies in between) or where a window's score
+        # is within refine_margin of the threshold.
+        embedded = [i for i, window in enumerate(coarse_windows) if window[2] is not None]
+        labels = np.full(len(coarse_windows), -2)
+        uncertain = np.zeros(len(coarse_windows), dtype=bool)
+        if embedded:
+            window_labels, window_scores = label_windows(np.stack([coarse_windows[i][2] for i in embedded]))
+            labels[embedded] = window_labels
+            uncertain[embedded] = np.abs(window_scores - threshold) < self.refine_margin
+        coarse_starts = {round(float(window[0]), 6) for window in coarse_windows}
+        fine_starts = set()
+
+        def add_range(low, high):
+            for k in range(int(np.ceil(max(low, 0.0) / self.fine_step - 1e-9)), int(np.floor(high / self.fine_step + 1e-9)) + 1):
+                start = round(k * self.fine_step, 6)
+                if start < duration and start not in coarse_starts:
+                    fine_starts.add(start)
+
+        for i, window in enumerate(coarse_windows):
+            if uncertain[i]:
+                add_range(window[0] - self.segment_step, window[0] + self.segment_step)
+            if i + 1 < len(coarse_windows) and labels[i] != labels[i + 1]:
+                add_range(window[0], coarse_windows[i + 1][0])
+        if not fine_starts:
+            return coarse_windows
+        windows = self._iter_windows(audio, sr, duration, sorted(fine_starts))
+        if self.batch_size > 1:
+            fine_windows = self._embed_windows_batched(windows, sr, log_mel)
+        else:
+            fine_windows = list(self._embed_windows(windows, sr, log_mel))
+        self._add_stat('refined_windows', len(fine_windows))
+        logger.info(f"Coarse-to-fine: {len(coarse_windows)} coarse windows, {len(fine_windows)} refined at {self.fine_step}s step")
+        return sorted(coarse_windows + list(fine_windows), key=lambda window: window[0])
+
+    def _speaker_labeler(self, enrollment_embedding: np.ndarray, threshold: float):
+        def label_windows(embeddings):
+            scores = self.compute_similarity_matrix(embeddings, enrollment_embedding[np.newaxis, :])[:, 0]
+            return (scores >= threshold).astype(int), scores
+        return label_windows
+
+    def _multi_speaker_labeler(self, speaker_index: SpeakerEmbeddingIndex, threshold: float):
+        def label_windows(embeddings):
+            best, scores = speaker_index.search(embeddings, k=1)
+            return np.where(scores[:, 0] >= threshold, best[:, 0], -1), scores[:, 0]
+        return label_windows
+
+    def _embed_meeting_stream(self, meeting_path: str, block_duration: float, stream_info: Dict[str, Any]):
+        sr = self.audio_processor.sample_rate
+        blocks = self.audio_processor.stream_audio(meeting_path, block_duration)
+        if self.whole_file_features and not getattr(self.audio_processor, 'waveform_input', False):
+            windows = self._iter_stream_frame_windows(blocks, sr, stream_info)
+        else:
+            windows = self._iter_stream_windows(blocks, sr, stream_info)
+        return self._embed_windows(windows, sr)
+
     def diarize_meeting(self, meeting_path: str, enrollment_embedding: np.ndarray, 
                        speaker_name: str, threshold: float) -> List[Tuple[float, float]]:
         try:
@@ -45,77 +475,225 @@ class DynamicQuantizedDiarizationEngine:
             audio, sr = self.audio_processor.load_audio(meeting_path)
             duration = len(audio) / sr
             logger.info(f"Meeting duration: {duration:.2f}s")
-            segments = []
-            total_segments = 0
-            matched_segments = 0
-            total_inference_time = 0.0
-            for start in np.arange(0, duration, self.segment_step):
-                end = min(start + self.segment_length, duration)
-                segment_audio = audio[int(start*sr):int(end*sr)]
-                if len(segment_audio) < int(self.segment_length * sr * self.min_segment_ratio):
-                    continue
-                total_segments += 1
-                try:
-                    segment_start_time = time.time()
-                    segment_embedding = self.audio_processor.extract_embedding(segment_audio, sr)
-                    segment_inference_time = time.time() - segment_start_time
-                    total_inference_time += segment_inference_time
-                    similarity = self.compute_similarity(segment_embedding, enrollment_embedding)
-                    logger.debug(f"Segment {start:.2f}s-{end:.2f}s | Similarity: {similarity:.3f} | Time: {segment_inference_time*1000:.1f}ms")
-                    if similarity >= threshold:
-                        segments.append((start, end))
-                        matched_segments += 1
-                        logger.info(f"  -> Matched {speaker_name} (Similarity: {similarity:.3f})")
-                except Exception as e:
-                    logger.warning(f"Failed to process segment {start:.2f}s-{end:.2f}s: {str(e)}")
-                    continue
-            diarization_time = time.time() - start_time
-            self.performance_stats['diarization_time'] = diarization_time
-            self.performance_stats['total_inference_time'] = total_inference_time
-            self.performance_stats['total_segments_processed'] = total_segments
-            avg_inference_time = total_inference_time / total_segments if total_segments > 0 else 0
-            real_time_factor = diarization_time / duration if duration > 0 else 0
-            logger.info(f"[SUCCESS] Diarization completed: {matched_segments}/{total_segments} segments matched")
-            logger.info(f"[SUCCESS] Processing time: {diarization_time:.2f}s (RTF: {real_time_factor:.2f}x)")
-            logger.info(f"[SUCCESS] Average inference time per segment: {avg_inference_time*1000:.1f}ms")
+            counters = {'total_segments': 0, 'matched_segments': 0, 'total_inference_time': 0.0}
+            self._reset_run_stats()
+            embedded_windows = self._embed_meeting(audio, sr, duration,
+                                                   self._speaker_labeler(enrollment_embedding, threshold), threshold)
+            segments = list(self._match_windows(embedded_windows, enrollment_embedding, speaker_name, threshold, counters))
+            self._record_run(counters, start_time, duration)
             return segments
         except Exception as e:
             raise DynamicQuantizedDiarizationError(f"Meeting diarization failed: {str(e)}")
 
+    def diarize_meeting_turns(self, meeting_path: str, enrollment_embedding: np.ndarray,
+                              speaker_name: str, threshold: float, stream: bool = False,
+                              block_duration: float = 10.0) -> List[Dict[str, Any]]:
+        try:
+            logger.info(f"Diarizing meeting audio into speaker turns: {meeting_path}")
+            start_time = time.time()
+            counters = {'total_segments': 0, 'matched_segments': 0, 'total_inference_time': 0.0}
+            self._reset_run_stats()
+            sr = self.audio_processor.sample_rate
+            stream_info = {'samples_read': 0}
+            if stream:
+                embedded_windows = self._embed_meeting_stream(meeting_path, block_duration, stream_info)
+            else:
+                audio, sr = self.audio_processor.load_audio(meeting_path)
+                stream_info['samples_read'] = len(audio)
+                embedded_windows = self._embed_meeting(audio, sr, len(audio) / sr,
+                                                       self._speaker_labeler(enrollment_embedding, threshold), threshold)
+            scored_windows = self._score_windows(embedded_windows, enrollment_embedding, counters)
+            turns = list(self._build_turns(scored_windows, speaker_name, threshold, counters))
+            duration = stream_info['samples_read'] / sr
+            logger.info(f"Meeting duration: {duration:.2f}s, {len(turns)} speaker turns")
+            self._record_run(counters, start_time, duration)
+            return turns
+        except Exception as e:
+            raise DynamicQuantizedDiarizationError(f"Meeting diarization failed: {str(e)}")
+
+    def diarize_meeting_multi(self, meeting_path: str,
+                              enrollment_embeddings: Union[Dict[str, np.ndarray], SpeakerEmbeddingIndex],
+                              threshold: float) -> List[Dict[str, Any]]:
+        try:
+            if not len(enrollment_embeddings):
+                raise DynamicQuantizedDiarizationError("No enrolled speakers given")
+            logger.info(f"Diarizing meeting audio for {len(enrollment_embeddings)} speakers: {meeting_path}")
+            start_time = time.time()
+            audio, sr = self.audio_processor.load_audio(meeting_path)
+            duration = len(audio) / sr
+            logger.info(f"Meeting duration: {duration:.2f}s")
+            counters = {'total_segments': 0, 'matched_segments': 0, 'total_inference_time': 0.0}
+            self._reset_run_stats()
+            speaker_index = enrollment_embeddings
+            if not isinstance(speaker_index, SpeakerEmbeddingIndex):
+                speaker_index = SpeakerEmbeddingIndex.from_embeddings(enrollment_embeddings)
+            spans = []
+            window_embeddings = []
+            label_windows = self._multi_speaker_labeler(speaker_index, threshold)
+            for start, end, segment_embedding, segment_inference_time in self._embed_meeting(audio, sr, duration,
+                                                                                             label_windows, threshold):
+                counters['total_segments'] += 1
+                if segment_embedding is None:
+                    continue
+                self._mark_first_window()
+                counters['total_inference_time'] += segment_inference_time
+                spans.append((start, end))
+                window_embeddings.append(segment_embedding)
+            timeline = self.assign_speakers(spans, window_embeddings, speaker_index, threshold, counters)
+            self._record_run(counters, start_time, duration)
+            return timeline
+        except Exception as e:
+            raise DynamicQuantizedDiarizationError(f"Multi-speaker meeting diarization failed: {str(e)}")
+
+    def window_features(self, audio: np.ndarray, sr: int) -> List[Tuple[float, float, Optional[np.ndarray]]]:
+        # Normalized features per window (None for non-speech or failed
+        # windows), for callers that run the model themselves
+        log_mel = self._meeting_log_mel(audio, sr)
+        windows = []
+        for start, end, segment_audio in self._iter_windows(audio, sr, len(audio) / sr):
+            try:
+                windows.append((start, end, self._window_features(segment_audio, start, sr, log_mel)))
+            except Exception as e:
+                logger.warning(f"Failed to process segment {start:.2f}s-{end:.2f}s: {str(e)}")
+                windows.append((start, end, None))
+        return windows
+
+    def assign_speakers(self, spans: List[Tuple[float, float]], window_embeddings: List[np.ndarray],
+                        speaker_index: SpeakerEmbeddingIndex, threshold: float,
+                        counters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        counters = counters if counters is not None else {'matched_segments': 0}
+        speaker_names = speaker_index.names
+        timeline = []
+        if not spans:
+            return timeline
+        # One GEMM of all windows against the speaker index
+        best_speakers, best_scores = speaker_index.search(np.stack(window_embeddings), k=1)
+        best_speakers = best_speakers[:, 0]
+        best_scores = np.clip(best_scores[:, 0], -1.0, 1.0)
+        if self.speaker_turns:
+            # A window only counts towards the speaker it scores best for
+            for i in np.unique(best_speakers):
+                scored_windows = [(start, end, float(score) if best == i else -1.0)
+                                  for (start, end), best, score in zip(spans, best_speakers, best_scores)]
+                timeline.extend(self._build_turns(scored_windows, speaker_names[i], threshold, counters))
+            timeline.sort(key=lambda turn: turn['start'])
+            return timeline
+        for (start, end), best, similarity in zip(spans, best_speakers, best_scores):
+            similarity = float(similarity)
+            logger.debug(f"Segment {start:.2f}s-{end:.2f}s | Best: {speaker_names[best]} ({similarity:.3f})")
+            if similarity >= threshold:
+                timeline.append({
+                    'start': float(start),
+                    'end': float(end),
+                    'speaker': speaker_names[best],
+                    'similarity': similarity
+                })
+                counters['matched_segments'] += 1
+                logger.info(f"  -> Matched {speaker_names[best]} (Similarity: {similarity:.3f})")
+        return timeline
+
+    def diarize_meeting_stream(self, meeting_path: str, enrollment_embedding: np.ndarray,
+                               speaker_name: str, threshold: float,
+                               block_duration: float = 10.0) -> Iterator[Tuple[float, float]]:
+        try:
+            logger.info(f"Diarizing meeting audio (streaming): {meeting_path}")
+            start_time = time.time()
+            sr = self.audio_processor.sample_rate
+            counters = {'total_segments': 0, 'matched_segments': 0, 'total_inference_time': 0.0}
+            self._reset_run_stats()
+            stream_info = {'samples_read': 0}
+            embedded_windows = self._embed_meeting_stream(meeting_path, block_duration, stream_info)
+            for start, end in self._match_windows(embedded_windows, enrollment_embedding, speaker_name, threshold, counters):
+                yield start, end
+            duration = stream_info['samples_read'] / sr
+            logger.info(f"Meeting duration: {duration:.2f}s")
+            self._record_run(counters, start_time, duration)
+        except Exception as e:
+            raise DynamicQuantizedDiarizationError(f"Streaming meeting diarization failed: {str(e)}")
+
     def extract_segments(self, meeting_path: str, segments: List[Tuple[float, float]], 
                         output_path: str) -> bool:
         try:
             if not segments:
                 logger.warning("No segments to extract")
                 return False
-            audio, sr = self.audio_processor.load_audio(meeting_path)
-            segment_audio_list = []
-            total_duration = 0
-            for start, end in segments:
-                start_sample = int(start * sr)
-                end_sample = int(end * sr)
-                segment_audio = audio[start_sample:end_sample]
-                segment_audio_list.append(segment_audio)
-                total_duration += (end - start)
-            output_audio = np.concatenate(segment_audio_list)
-            sf.write(output_path, output_audio, sr, subtype='PCM_16')
-            logger.info(f"[SUCCESS] Extracted {len(segments)} segments ({total_duration:.1f}s total)")
+            if not os.path.exists(meeting_path):
+                raise DynamicQuantizedDiarizationError(f"Audio file not found: {meeting_path}")
+            spans = merge_segments(segments)
+            sr = self.audio_processor.sample_rate
+            block_size = max(1, int(self.stream_block_duration * sr))
+            samples_written = 0
+            with sf.SoundFile(output_path, 'w', samplerate=sr, channels=1, subtype='PCM_16') as output:
+                for block in self._iter_span_audio(meeting_path, spans, sr, block_size):
+                    output.write(block)
+                    samples_written += len(block)
+            total_duration = samples_written / sr
+            logger.info(f"[SUCCESS] Extracted {len(segments)} segments as {len(spans)} spans ({total_duration:.1f}s total)")
             logger.info(f"[SUCCESS] Saved to: {output_path}")
             return True
         except Exception as e:
             raise DynamicQuantizedDiarizationError(f"Failed to extract segments: {str(e)}")
 
+    def _iter_span_audio(self, meeting_path: str, spans: List[Tuple[float, float]], sr: int,
+                         block_size: int) -> Iterator[np.ndarray]:
+        sample_spans = [(int(start * sr), int(end * sr)) for start, end in spans]
+        audio_cache = getattr(self.audio_processor, 'audio_cache', None)
+        cached = audio_cache.get(audio_cache.make_key(meeting_path, sr)) if audio_cache is not None else None
+        if cached is not None:
+            # Diarization already decoded the meeting; write views of it
+            audio = cached[0]
+            for start, end in sample_spans:
+                for offset in range(start, min(end, len(audio)), block_size):
+                    yield audio[offset:min(offset + block_size, end)]
+            return
+        if sf.info(meeting_path).samplerate == sr:
+            # Already at the model rate: seek to each span and read it block by block
+            with sf.SoundFile(meeting_path) as source:
+                for start, end in sample_spans:
+                    if start >= source.frames:
+                        break
+                    source.seek(start)
+                    remaining = min(end, source.frames) - start
+                    while remaining > 0:
+                        block = source.read(min(block_size, remaining), dtype='float32', always_2d=True)
+                        if not len(block):
+                            break
+                        remaining -= len(block)
+                        yield block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+            return
+        # Needs resampling: walk the resampled stream once, keeping only the samples inside spans
+        position = 0
+        span_index = 0
+        for block in self.audio_processor.stream_audio(meeting_path, block_size / sr):
+            block_end = position + len(block)
+            while span_index < len(sample_spans) and sample_spans[span_index][0] < block_end:
+                start, end = sample_spans[span_index]
+                if min(end, block_end) > max(start, position):
+                    yield block[max(start, position) - position:min(end, block_end) - position]
+                if end > block_end:
+                    break
+                span_index += 1
+            position = block_end
+            if span_index >= len(sample_spans):
+                break
+
     def get_performance_summary(self) -> Dict[str, Any]:
         return {
             'enrollment_time': self.performance_stats['enrollment_time'],
             'diarization_time': self.performance_stats['diarization_time'],
             'total_inference_time': self.performance_stats['total_inference_time'],
             'total_segments_processed': self.performance_stats['total_segments_processed'],
+            'feature_extraction_time': self.performance_stats['feature_extraction_time'],
+            'vad_skipped_windows': self.performance_stats['vad_skipped_windows'],
+            'vad_processed_windows': self.performance_stats['vad_processed_windows'],
+            'refined_windows': self.performance_stats['refined_windows'],
+            'first_window_time': self.performance_stats['first_window_time'],
             'avg_inference_time_per_segment': (
                 self.performance_stats['total_inference_time'] / 
                 self.performance_stats['total_segments_processed']
                 if self.performance_stats['total_segments_processed'] > 0 else 0
             ),
-            'model_benchmark': getattr(self.audio_processor, 'benchmark_results', None)
+            'model_benchmark': getattr(self.audio_processor, 'benchmark_results', None),
+            'audio_cache': self.audio_processor.audio_cache.stats() if hasattr(self.audio_processor, 'audio_cache') else None
         } 
  
\ No newline at end of file
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Long-lived asyncio diarization service with a warm ECAPA session.
+
+    python diarization_service.py serve --port 8765
+    python diarization_service.py serve --unix-socket /tmp/amica.sock
+    python diarization_service.py load --port 8765 --endpoint verify --concurrency 16 --requests 200 \\
+        --name sami --audio test_data/sami_speaker_enrollment.wav
+
+Endpoints (JSON over HTTP/1.1; audio is a local "audio_path" or base64 WAV
+bytes in "audio_base64"):
+
+    POST /enroll   {"name", audio}                -> {"name", "embedding_dim"}
+    POST /verify   {"name", audio, "threshold"?}  -> {"name", "similarity", "accepted"}
+    POST /diarize  {audio, "speakers"?, "threshold"?} -> {"timeline", "windows", ...}
+    GET  /health, GET /stats
+
+Feature extraction runs in a thread pool. Every request's window features go
+through one MicroBatcher, which coalesces them into shared ONNX batches
+(equal frame counts only, as in the batched diarization path). A batch is
+dispatched once it is full (max_batch_size items or max_batch_frames total
+frames, which bounds activation memory for long clips) or its oldest item
+has waited max_wait_ms. Dispatched batches run in an inference thread pool
+while the batcher keeps collecting; at most max_inflight_batches run at
+once. When a batch fails, its items are retried one at a time, so only
+the request whose input broke it fails.
+"""
+import io
+import json
+import time
+import base64
+import asyncio
+import logging
+import argparse
+import numpy as np
+import soundfile as sf
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+from run_dynamic_quantized_diarization import load_config
+from enrollment_dynamic_quantize import (
+    get_audio_processor, session_options_from_config, resample_audio, DynamicQuantizedDiarizationError
+)
+from diarization_dynamic_quantize import DynamicQuantizedDiarizationEngine
+from speaker_index import SpeakerEmbeddingIndex
+from speaker_store import SpeakerEmbeddingStore, file_hash
+
+logger = logging.getLogger(__name__)
+
+class ServiceRequestError(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+class MicroBatcher:
+    def __init__(self, processor, max_batch_size: int = 32, max_wait_ms: float = 5.0, max_batch_frames: int = 6400,
+                 max_inflight_batches: int = 2):
+        self.processor = processor
+        self.max_batch_size = max_batch_size if processor.supports_batching else 1
+        self.max_batch_frames = max_batch_frames
+        self.max_wait = max_wait_ms / 1000.0
+        # Batches run in the executor while the next ones are collected; at
+        # most max_inflight_batches at once, further batches wait for a slot
+        # (and keep growing in the queue meanwhile)
+        self.max_inflight_batches = max(1, max_inflight_batches)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_inflight_batches, thread_name_prefix='onnx')
+        self.queue: Optional[asyncio.Queue] = None
+        self.stats = {'batches': 0, 'items': 0, 'max_batch': 0, 'inference_time': 0.0, 'failed_batches': 0,
+                      'failed_items': 0}
+        self._task = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._dispatches = set()
+
+    def start(self) -> None:
+        self.queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_inflight_batches)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def embed(self, features: np.ndarray) -> np.ndarray:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((features, future))
+        return await future
+
+    async def _run(self) -> None:
+        # Must never die: every request future waits on this loop
+        loop = asyncio.get_running_loop()
+        pending: Dict[Tuple, List[Tuple[np.ndarray, asyncio.Future]]] = {}
+        deadlines: Dict[Tuple, float] = {}
+        while True:
+            timeout = max(0.0, min(deadlines.values()) - loop.time()) if deadlines else None
+            try:
+                features, future = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                now = loop.time()
+                ready = [key for key, deadline in deadlines.items() if deadline <= now]
+            else:
+                try:
+                    # Bucketed by full shape so every batch stacks
+                    key = tuple(features.shape)
+                    bucket_frames = self.processor.input_frames(features)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(DynamicQuantizedDiarizationError(f"Invalid model input: {str(e)}"))
+                    continue
+                bucket = pending.setdefault(key, [])
+                bucket.append((features, future))
+                deadlines.setdefault(key, loop.time() + self.max_wait)
+                if len(bucket) < self.max_batch_size and (len(bucket) + 1) * bucket_frames <= self.max_batch_frames:
+                    continue
+                ready = [key]
+            for key in ready:
+                items = pending.pop(key)
+                deadlines.pop(key)
+                await self._slots.acquire()
+                task = loop.create_task(self._dispatch(items))
+                self._dispatches.add(task)
+                task.add_done_callback(self._dispatches.discard)
+
+    async def _infer(self, items: List[Tuple[np.ndarray, asyncio.Future]]) -> np.ndarray:
+        batch = np.stack([features for features, _ in items])
+        embeddings = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.processor.extract_embeddings_batch, batch)
+        if len(embeddings) != len(items):
+            raise DynamicQuantizedDiarizationError(f"Batch of {len(items)} returned {len(embeddings)} embeddings")
+        return embeddings
+
+    def _complete(self, items: List[Tuple[np.ndarray, asyncio.Future]], embeddings: np.ndarray,
+                  start_time: float) -> None:
+        self.stats['batches'] += 1
+        self.stats['items'] += len(items)
+        self.stats['max_batch'] = max(self.stats['max_batch'], len(items))
+        self.stats['inference_time'] += time.perf_counter() - start_time
+        for (_, future), embedding in zip(items, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+    async def _dispatch(self, items: List[Tuple[np.ndarray, asyncio.Future]]) -> None:
+        try:
+            start_time = time.perf_counter()
+            try:
+                self._complete(items, await self._infer(items), start_time)
+                return
+            except Exception as e:
+                self.stats['failed_batches'] += 1
+                logger.warning(f"Batch of {len(items)} failed: {str(e)}")
+                if len(items) == 1:
+                    self.stats['failed_items'] += 1
+                    if not items[0][1].done():
+                        items[0][1].set_exception(e)
+                    return
+            # One bad input must not fail the other requests it was batched
+            # with: run the items one at a time so only the offending one fails
+            for item in items:
+                start_time = time.perf_counter()
+                try:
+                    self._complete([item], await self._infer([item]), start_time)
+                except Exception as e:
+                    self.stats['failed_items'] += 1
+                    if not item[1].done():
+                        item[1].set_exception(e)
+        finally:
+            self._slots.release()
+
+class DiarizationService:
+    def __init__(self, config: Dict[str, Any], max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 feature_workers: int = 4, max_batch_frames: int = 6400, max_inflight_batches: int = 2):
+        self.config = config
+        self.processor = get_audio_processor(config['model_path'], config['sample_rate'],
+                                             session_options=session_options_from_config(config),
+                                             frontend=config['frontend'])
+        self.batcher = MicroBatcher(self.processor, max_batch_size, max_wait_ms, max_batch_frames,
+                                    max_inflight_batches)
+        self.engine = DynamicQuantizedDiarizationEngine(config['model_path'], config, self.processor)
+        self.feature_executor = ThreadPoolExecutor(max_workers=feature_workers, thread_name_prefix='features')
+        self.store = SpeakerEmbeddingStore(config['speaker_store_dir']) if config.get('speaker_store_dir') else None
+        self.speakers: Dict[str, np.ndarray] = {}
+        self._index: Optional[SpeakerEmbeddingIndex] = None
+        if self.store is not None:
+            model_hash = file_hash(config['model_path'])
+            for name, entry in self.store.index.items():
+                if entry['model_hash'] == model_hash:
+                    self.speakers[name] = np.array(self.store.embeddings[entry['row']], dtype=np.float32)
+        self.request_count = 0
+        self.start_time = time.time()
+
+    @property
+    def speaker_index(self) -> SpeakerEmbeddingIndex:
+        if self._index is None:
+            self._index = SpeakerEmbeddingIndex.from_embeddings(self.speakers)
+        return self._index
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.feature_executor, func, *args)
+
+    def _read_audio(self, body: Dict[str, Any]) -> Tuple[np.ndarray, int]:
+        if body.get('audio_path'):
+            return self.processor.load_audio(body['audio_path'])
+        if body.get('audio_base64'):
+            audio, sr = sf.read(io.BytesIO(base64.b64decode(body['audio_base64'])), dtype='float32', always_2d=True)
+            audio = audio.mean(axis=1) if audio.shape[1] > 1 else np.ascontiguousarray(audio[:, 0])
+            return resample_audio(audio, sr, self.processor.sample_rate), self.processor.sample_rate
+        raise ServiceRequestError("Request needs 'audio_path' or 'audio_base64'")
+
+    def _clip_features(self, body: Dict[str, Any]) -> np.ndarray:
+        audio, sr = self._read_audio(body)
+        return self.processor.model_input(audio, sr)
+
+    async def enroll(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        name = body.get('name')
+        if not name:
+            raise ServiceRequestError("'name' is required")
+        embedding = await self.batcher.embed(await self._run(self._clip_features, body))
+        self.speakers[name] = np.asarray(embedding, dtype=np.float32)
+        self._index = None
+        if self.store is not None and body.get('audio_path'):
+            await self._run(self.store.put, name, self.speakers[name], body['audio_path'], self.config['model_path'])
+        return {'name': name, 'embedding_dim': int(self.speakers[name].shape[0]), 'enrolled_speakers': len(self.speakers)}
+
+    async def verify(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        name = body.get('name')
+        if name not in self.speakers:
+            raise ServiceRequestError(f"Speaker '{name}' is not enrolled", 404)
+        threshold = float(body.get('threshold', self.config['default_threshold']))
+        embedding = await self.batcher.embed(await self._run(self._clip_features, body))
+        reference = self.speakers[name]
+        similarity = float(np.dot(embedding, reference) /
+                           (np.linalg.norm(embedding) * np.linalg.norm(reference) + 1e-8))
+        return {'name': name, 'similarity': similarity, 'accepted': similarity >= threshold}
+
+    async def diarize(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        start_time = time.perf_counter()
+        threshold = float(body.get('threshold', self.config['default_threshold']))
+        names = body.get('speakers') or list(self.speakers)
+        missing = [name for name in names if name not in self.speakers]
+        if missing or not names:
+            raise ServiceRequestError(f"Speakers not enrolled: {missing or 'none'}", 404)
+        speaker_index = (self.speaker_index if set(names) == set(self.speakers)
+                         else SpeakerEmbeddingIndex.from_embeddings({name: self.speakers[name] for name in names}))
+        audio, sr = await self._run(self._read_audio, body)
+        windows = await self._run(self.engine.window_features, audio, sr)
+        speech = [(start, end, feats) for start, end, feats in windows if feats is not None]
+        embeddings = await asyncio.gather(*[self.batcher.embed(feats) for _, _, feats in speech])
+        timeline = self.engine.assign_speakers([(start, end) for start, end, _ in speech], list(embeddings),
+                                          speaker_index, threshold)
+        return {
+            'timeline': timeline,
+            'duration': len(audio) / sr,
+            'windows': len(windows),
+            'embedded_windows': len(speech),
+            'processing_time': time.perf_counter() - start_time
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        batcher_stats = dict(self.batcher.stats)
+        batcher_stats['mean_batch'] = batcher_stats['items'] / batcher_stats['batches'] if batcher_stats['batches'] else 0.0
+        return {'uptime': time.time() - self.start_time, 'requests': self.request_count,
+                'enrolled_speakers': len(self.speakers), 'batcher': batcher_stats,
+                'audio_cache': self.processor.audio_cache.stats()}
+
+    async def handle(self, method: str, path: str, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        routes = {('POST', '/enroll'): self.enroll, ('POST', '/verify'): self.verify, ('POST', '/diarize'): self.diarize}
+        if method == 'GET' and path == '/health':
+            return 200, {'status': 'ok'}
+        if method == 'GET' and path == '/stats':
+            return 200, self.stats()
+        handler = routes.get((method, path))
+        if handler is None:
+            return 404, {'error': f"No route for {method} {path}"}
+        self.request_count += 1
+        try:
+            return 200, await handler(body)
+        except ServiceRequestError as e:
+            return e.status, {'error': str(e)}
+        except DynamicQuantizedDiarizationError as e:
+            return 422, {'error': str(e)}
+        except Exception as e:
+            logger.exception(f"{method} {path} failed")
+            return 500, {'error': str(e)}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                raw_body = await reader.readexactly(int(headers.get('content-length', 0)))
+                try:
+                    body = json.loads(raw_body) if raw_body else {}
+                    status, response = await self.handle(method, path, body)
+                except json.JSONDecodeError as e:
+                    status, response = 400, {'error': f"Invalid JSON: {str(e)}"}
+                payload = json.dumps(response, default=float).encode()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8765, unix_socket: Optional[str] = None) -> None:
+        self.batcher.start()
+        if unix_socket:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+            logger.info(f"[SUCCESS] Diarization service listening on {unix_socket}")
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            logger.info(f"[SUCCESS] Diarization service listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+async def _request(host: str, port: int, unix_socket: Optional[str], method: str, path: str,
+                   body: Optional[Dict[str, Any]] = None) -> Tuple[int, Dict[str, Any]]:
+    if unix_socket:
+        reader, writer = await asyncio.open_unix_connection(unix_socket)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    payload = json.dumps(body or {}).encode()
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        writer.close()
+        raise ConnectionError(f"Service closed the connection during {method} {path}")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    response = json.loads(await reader.readexactly(int(headers.get('content-length', 0))) or b'{}')
+    writer.close()
+    return int(status_line.split()[1]), response
+
+async def run_load(args) -> Dict[str, Any]:
+    host, port, unix_socket = args.host, args.port, args.unix_socket
+    body = {'audio_path': args.audio, 'name': args.name}
+    if args.endpoint != 'enroll':
+        status, response = await _request(host, port, unix_socket, 'POST', '/enroll',
+                                           {'name': args.name, 'audio_path': args.enroll or args.audio})
+        if status != 200:
+            raise ServiceRequestError(f"Enrollment failed: {response}")
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(args.requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start_time = time.perf_counter()
+            try:
+                status, _ = await _request(host, port, unix_socket, 'POST', f'/{args.endpoint}', body)
+            except OSError:
+                status = None
+            latencies.append(time.perf_counter() - start_time)
+            errors += status != 200
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - start_time
+    _, stats = await _request(host, port, unix_socket, 'GET', '/stats')
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'endpoint': args.endpoint,
+        'concurrency': args.concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': {
+            'mean': float(np.mean(latencies_ms)),
+            'p50': float(np.percentile(latencies_ms, 50)),
+            'p95': float(np.percentile(latencies_ms, 95)),
+            'p99': float(np.percentile(latencies_ms, 99))
+        },
+        'server': stats
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Asyncio diarization service and load generator")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve = subparsers.add_parser('serve', help='Run the service')
+    serve.add_argument('--model', help='Dynamic quantized ECAPA ONNX model path')
+    serve.add_argument('--config', help='Configuration JSON file')
+    serve.add_argument('--speaker-store', help='Persistent speaker store to load and save enrollments')
+    serve.add_argument('--max-batch-size', type=int, default=32, help='Largest coalesced ONNX batch')
+    serve.add_argument('--max-wait-ms', type=float, default=5.0, help='Longest a window waits for its batch to fill')
+    serve.add_argument('--max-batch-frames', type=int, default=6400, help='Largest coalesced batch in total feature frames')
+    serve.add_argument('--max-inflight-batches', type=int, default=2,
+                       help='ONNX batches running at once while the next ones are collected')
+    serve.add_argument('--feature-workers', type=int, default=4, help='Threads for decoding and feature extraction')
+    load = subparsers.add_parser('load', help='Generate load against a running service')
+    load.add_argument('--endpoint', choices=['enroll', 'verify', 'diarize'], default='verify')
+    load.add_argument('--audio', required=True, help='Audio file sent with every request (path on the server host)')
+    load.add_argument('--enroll', help='Enrollment audio for --name (default: --audio)')
+    load.add_argument('--name', default='load_test', help='Speaker name to enroll / verify')
+    load.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+    load.add_argument('--requests', type=int, default=100, help='Total requests')
+    load.add_argument('--output', help='Write the load test report to this JSON file')
+    for sub in (serve, load):
+        sub.add_argument('--host', default='127.0.0.1')
+        sub.add_argument('--port', type=int, default=8765)
+        sub.add_argument('--unix-socket', help='Listen on / connect to a Unix socket instead of TCP')
+        sub.add_argument('--verbose', '-v', action='store_true', help='Enable verbose logging')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    try:
+        if args.command == 'serve':
+            config = load_config(args.config)
+            if args.model:
+                config['model_path'] = args.model
+            if args.speaker_store:
+                config['speaker_store_dir'] = args.speaker_store
+            service = DiarizationService(config, args.max_batch_size, args.max_wait_ms, args.feature_workers,
+                                         args.max_batch_frames, args.max_inflight_batches)
+            asyncio.run(service.serve(args.host, args.port, args.unix_socket))
+        else:
+            report = asyncio.run(run_load(args))
+            print(json.dumps(report, indent=2))
+            if args.output:
+                with open(args.output, 'w') as f:
+                    json.dump(report, f, indent=2)
+    except (ServiceRequestError, DynamicQuantizedDiarizationError) as e:
+        print(f"[ERROR] {str(e)}")
+    except KeyboardInterrupt:
+        print("Diarization service stopped")
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,13 @@ Supports both dynamic and static quantization methods.
 """
 import os
 import sys
+import glob
+import json
+import time
 import logging
+import argparse
 import numpy as np
+import soundfile as sf
 from pathlib import Path
 import onnx
 import onnxruntime as ort
@@ -15,11 +20,14 @@ from onnxruntime.quantization import (
     quantize_static,
     QuantType,
     QuantFormat,
-    CalibrationDataReader
+    CalibrationDataReader,
+    CalibrationMethod
 )
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, Union
 import torch
 
+from enrollment_dynamic_quantize import compute_log_mel, decode_audio, DynamicQuantizedAudioProcessor
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -37,16 +45,105 @@ class ECAPACalibrationDataReader(CalibrationDataReader):
     def __init__(self, calibration_data: List[np.ndarray], input_name: str = "input"):
         self.calibration_data = calibration_data
         self.input_name = input_name
+        self.start_index = 0
+        self.end_index = len(calibration_data)
         self.index = 0
     
+    def __len__(self) -> int:
+        return len(self.calibration_data)
+    
     def get_next(self) -> Optional[Dict[str, np.ndarray]]:
-        if self.index >= len(self.calibration_data):
+        if self.start_index + self.index >= self.end_index:
             return None
         
-        data = {self.input_name: self.calibration_data[self.index]}
+        data = {self.input_name: self.calibration_data[self.start_index + self.index]}
         self.index += 1
         return data
     
+    def set_range(self, start_index: int, end_index: int):
+        self.start_index = start_index
+        self.end_index = min(end_index, len(self.calibration_data))
+        self.index = 0
+    
+    def rewind(self):
+        self.index = 0
+
+class AudioCalibrationDataReader(CalibrationDataReader):
+    """
+    Calibration data reader streaming real ECAPA features from audio files.
+
+    Clips are cut evenly from every file (files take turns until num_samples
+    clips are planned) and each one is run through the same front-end as
+    extract_embedding: compute_log_mel followed by per-clip mean
+    normalization. Features are computed on demand in get_next(), so only
+    the current file's samples are held in memory. set_range() and __len__
+    let quantize_static calibrate in strides (CalibStridedMinMax), which
+    bounds the intermediate activations it keeps.
+    """
+
+    def __init__(
+        self,
+        audio_paths: List[str],
+        num_samples: int = 100,
+        clip_duration: float = 2.0,
+        sample_rate: int = 16000,
+        input_name: str = "input"
+    ):
+        self.sample_rate = sample_rate
+        self.clip_duration = clip_duration
+        self.input_name = input_name
+        self.clips = self._plan_clips(sorted(audio_paths), num_samples)
+        self.start_index = 0
+        self.end_index = len(self.clips)
+        self.index = 0
+        self._decoded_path = None
+        self._decoded_audio = None
+        if not self.clips:
+            raise ValueError(f"No calibration clips of {clip_duration}s found in {len(audio_paths)} audio files")
+        logger.info(f"Planned {len(self.clips)} calibration clips of {clip_duration}s from {len(audio_paths)} files")
+
+    def _plan_clips(self, audio_paths: List[str], num_samples: int) -> List[Tuple[str, float]]:
+        durations = {path: sf.info(path).duration for path in audio_paths}
+        capacity = {path: int(durations[path] // self.clip_duration) for path in audio_paths}
+        counts = dict.fromkeys(audio_paths, 0)
+        planned = 0
+        while planned < num_samples and any(counts[path] < capacity[path] for path in audio_paths):
+            for path in audio_paths:
+                if planned < num_samples and counts[path] < capacity[path]:
+                    counts[path] += 1
+                    planned += 1
+        clips = []
+        for path in audio_paths:
+            if counts[path]:
+                offsets = np.linspace(0.0, durations[path] - self.clip_duration, counts[path])
+                clips.extend((path, float(offset)) for offset in offsets)
+        return clips
+
+    def __len__(self) -> int:
+        return len(self.clips)
+
+    def features(self, index: int) -> np.ndarray:
+        path, offset = self.clips[index]
+        if path != self._decoded_path:
+            self._decoded_audio, _ = decode_audio(path, self.sample_rate)
+            self._decoded_path = path
+        first = int(offset * self.sample_rate)
+        clip = self._decoded_audio[first:first + int(self.clip_duration * self.sample_rate)]
+        log_mel = compute_log_mel(clip, self.sample_rate)
+        return DynamicQuantizedAudioProcessor.normalize_features(log_mel)[np.newaxis, ...]
+
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        if self.start_index + self.index >= self.end_index:
+            return None
+        data = {self.input_name: self.features(self.start_index + self.index)}
+        self.index += 1
+        return data
+
+    def set_range(self, start_index: int, end_index: int):
+        self.start_index = start_index
+        self.end_index = min(end_index, len(self.clips))
+        self.index = 0
+
     def rewind(self):
         self.index = 0
 
@@ -118,7 +215,9 @@ def get_model_info(model_path: str) -> Dict:
 def quantize_dynamic_ecapa(
     input_model_path: str,
     output_model_path: str,
-    weight_type: QuantType = QuantType.QUInt8
+    weight_type: QuantType = QuantType.QUInt8,
+    nodes_to_quantize: Optional[List[str]] = None,
+    nodes_to_exclude: Optional[List[str]] = None
 ) -> bool:
     """
     Perform dynamic quantization on ECAPA-TDNN model.
@@ -127,7 +226,8 @@ def quantize_dynamic_ecapa(
         input_model_path: Path to input ONNX model
         output_model_path: Path to save quantized model
         weight_type: Quantization type for weights
-        optimize_model: Whether to optimize model before quantization
+        nodes_to_quantize: Quantize only these nodes (default: every supported node)
+        nodes_to_exclude: Keep these nodes in fp32
     
     Returns:
         True if successful, False otherwise
@@ -143,6 +243,8 @@ def quantize_dynamic_ecapa(
             model_input=input_model_path,
             model_output=output_model_path,
             weight_type=weight_type,
+            nodes_to_quantize=nodes_to_quantize,
+            nodes_to_exclude=nodes_to_exclude,
             extra_options={
                 "DisableShapeInference": True,
                 "ForceQuantizeNoInputCheck": True,
@@ -160,9 +262,16 @@ def quantize_dynamic_ecapa(
 def quantize_static_ecapa(
     input_model_path: str,
     output_model_path: str,
-    calibration_data: List[np.ndarray],
+    calibration_data: Optional[Union[List[np.ndarray], CalibrationDataReader]],
     weight_type: QuantType = QuantType.QUInt8,
-    activation_type: QuantType = QuantType.QUInt8
+    activation_type: QuantType = QuantType.QUInt8,
+    calibrate_method: CalibrationMethod = CalibrationMethod.MinMax,
+    percentile: float = 99.999,
+    calibration_stride: Optional[int] = None,
+    op_types_to_quantize: Optional[List[str]] = None,
+    nodes_to_quantize: Optional[List[str]] = None,
+    nodes_to_exclude: Optional[List[str]] = None,
+    calibration_cache_path: Optional[str] = None
 ) -> bool:
     """
     Perform static quantization on ECAPA-TDNN model.
@@ -170,22 +279,50 @@ def quantize_static_ecapa(
     Args:
         input_model_path: Path to input ONNX model
         output_model_path: Path to save quantized model
-        calibration_data: List of calibration data samples
+        calibration_data: List of calibration data samples, or a reader such as AudioCalibrationDataReader
+            (may be None when calibration_cache_path already exists)
         weight_type: Quantization type for weights
         activation_type: Quantization type for activations
-        optimize_model: Whether to optimize model before quantization
+        calibrate_method: MinMax, Entropy or Percentile activation range calibration
+        percentile: Percentile of absolute activations kept by Percentile calibration
+        calibration_stride: Collect ranges over this many samples at a time (the reader must
+            implement __len__ and set_range, as both readers here do)
+        op_types_to_quantize: Operator types to quantize (default: every type ONNX Runtime supports)
+        nodes_to_quantize: Quantize only these nodes (default: every node of op_types_to_quantize)
+        nodes_to_exclude: Keep these nodes in fp32
+        calibration_cache_path: JSON file of activation ranges; written on the first call and
+            reused by later calls instead of re-running calibration
     
     Returns:
         True if successful, False otherwise
     """
     try:
-        logger.info("Starting static quantization...")
+        logger.info(f"Starting static quantization ({calibrate_method.name} calibration)...")
         
         # Create output directory
         Path(output_model_path).parent.mkdir(parents=True, exist_ok=True)
         
         # Create calibration data reader
-        calibration_reader = ECAPACalibrationDataReader(calibration_data)
+        if isinstance(calibration_data, CalibrationDataReader) or calibration_data is None:
+            calibration_reader = calibration_data
+        else:
+            calibration_reader = ECAPACalibrationDataReader(calibration_data)
+        
+        extra_options = {
+            "DisableShapeInference": True,
+            "ForceQuantizeNoInputCheck": True,
+            "MatMulConstBOnly": True
+        }
+        if calibrate_method == CalibrationMethod.Percentile:
+            extra_options["CalibPercentile"] = percentile
+        if calibration_cache_path and os.path.isfile(calibration_cache_path):
+            calibration_reader = None
+        elif calibration_stride and calibration_reader is not None:
+            # ONNX Runtime needs the sample count to be a multiple of the stride
+            total = len(calibration_reader)
+            extra_options["CalibStridedMinMax"] = max(
+                d for d in range(1, min(calibration_stride, total) + 1) if total % d == 0
+            )
         
         # Perform static quantization
         quantize_static(
@@ -194,11 +331,12 @@ def quantize_static_ecapa(
             calibration_data_reader=calibration_reader,
             weight_type=weight_type,
             activation_type=activation_type,
-            extra_options={
-                "DisableShapeInference": True,
-                "ForceQuantizeNoInputCheck": True,
-                "MatMulConstBOnly": True
-            }
+            calibrate_method=calibrate_method,
+            op_types_to_quantize=op_types_to_quantize,
+            nodes_to_quantize=nodes_to_quantize,
+            nodes_to_exclude=nodes_to_exclude,
+            calibration_cache_path=calibration_cache_path,
+            extra_options=extra_options
         )
         
         logger.info(f"Static quantization completed: {output_model_path}")
@@ -315,16 +453,122 @@ def benchmark_model_performance(model_path: str, num_runs: int = 100) -> Dict:
         logger.error(f"Benchmark failed: {e}")
         return {"error": str(e)}
 
+def compare_models_on_speakers(
+    model_paths: Dict[str, str],
+    audio_paths: List[str],
+    enrollment_paths: Optional[List[str]] = None,
+    reference: str = "fp32",
+    segment_length: float = 2.0,
+    sample_rate: int = 16000
+) -> Dict[str, Dict]:
+    """
+    Compare models against a reference model on real speech.
+    
+    Every audio file is cut into segment_length windows, embedded one at a
+    time as the diarization path does. Files named
+    <speaker>_speaker_enrollment.* in enrollment_paths give that speaker's
+    enrollment embedding (whole file); they are only used as references for
+    the nearest-speaker agreement, not scored as windows.
+    
+    Args:
+        model_paths: Model name -> ONNX path, including the reference
+        audio_paths: Test audio files
+        enrollment_paths: Enrollment audio files for the speaker references
+        reference: Name of the reference model in model_paths
+        segment_length: Window length in seconds
+        sample_rate: Feature sample rate
+    
+    Returns:
+        Per model: cosine similarity of window embeddings to the reference
+        model's (mean / p5 / min), agreement of the nearest enrolled speaker
+        with the reference's, mean per-window latency and size
+    """
+    window_samples = int(segment_length * sample_rate)
+    windows = []
+    enrollments = {}
+    for path in sorted(audio_paths):
+        audio, sr = decode_audio(path, sample_rate)
+        for start in range(0, len(audio) - window_samples + 1, window_samples):
+            log_mel = compute_log_mel(audio[start:start + window_samples], sr)
+            windows.append(DynamicQuantizedAudioProcessor.normalize_features(log_mel)[np.newaxis, ...])
+    for path in sorted(enrollment_paths or []):
+        name = Path(path).stem
+        if name.endswith("_speaker_enrollment"):
+            audio, sr = decode_audio(path, sample_rate)
+            log_mel = compute_log_mel(audio, sr)
+            enrollments[name[:-len("_speaker_enrollment")]] = DynamicQuantizedAudioProcessor.normalize_features(log_mel)[np.newaxis, ...]
+    logger.info(f"Evaluating on {len(windows)} windows, {len(enrollments)} enrolled speakers")
+    
+    def normalize(embeddings):
+        return embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-8)
+    
+    embeddings = {}
+    nearest = {}
+    latencies = {}
+    for name, model_path in model_paths.items():
+        session = ort.InferenceSession(model_path)
+        session.run(None, {'input': windows[0]})
+        times = []
+        outputs = []
+        for feats in windows:
+            start_time = time.perf_counter()
+            outputs.append(session.run(None, {'input': feats})[0].reshape(-1))
+            times.append((time.perf_counter() - start_time) * 1000)
+        embeddings[name] = normalize(np.stack(outputs))
+        latencies[name] = float(np.mean(times))
+        if enrollments:
+            speakers = normalize(np.stack([session.run(None, {'input': feats})[0].reshape(-1)
+                                           for feats in enrollments.values()]))
+            nearest[name] = np.argmax(embeddings[name] @ speakers.T, axis=1)
+    
+    results = {}
+    for name, model_path in model_paths.items():
+        cosine = np.sum(embeddings[name] * embeddings[reference], axis=1)
+        results[name] = {
+            "size_mb": os.path.getsize(model_path) / (1024 * 1024),
+            "window_latency_ms": latencies[name],
+            "cosine_mean": float(cosine.mean()),
+            "cosine_p5": float(np.percentile(cosine, 5)),
+            "cosine_min": float(cosine.min()),
+            "speaker_agreement": float(np.mean(nearest[name] == nearest[reference])) if enrollments else None
+        }
+    return results
+
 def main():
     """Main function to quantize ECAPA-TDNN model."""
+    parser = argparse.ArgumentParser(description="Quantize the ECAPA-TDNN ONNX model (dynamic and static)")
+    parser.add_argument("--input-model", default="models/onnx/ecapa_model.onnx", help="fp32 ONNX model")
+    parser.add_argument("--output-dir", default="models/onnx", help="Directory for the quantized models")
+    parser.add_argument("--calibration-audio", nargs="+", default=["test_data/*_speaker_enrollment.wav"],
+                        help="Audio files or glob patterns used for static calibration")
+    parser.add_argument("--calibration-samples", type=int, default=100, help="Number of calibration clips")
+    parser.add_argument("--clip-duration", type=float, default=2.0, help="Calibration clip length in seconds")
+    parser.add_argument("--calibration-method", choices=["minmax", "entropy", "percentile"], default="minmax",
+                        help="Activation range calibration")
+    parser.add_argument("--percentile", type=float, default=99.999, help="Percentile for --calibration-method percentile")
+    parser.add_argument("--calibration-stride", type=int, default=10,
+                        help="Collect activation ranges over this many clips at a time (bounds memory)")
+    parser.add_argument("--static-op-types", nargs="*", default=["Conv"],
+                        help="Operator types quantized statically; pass no values for every supported type "
+                             "(quantizing pooling / softmax tensors costs most of the speaker accuracy)")
+    parser.add_argument("--synthetic-calibration", action="store_true",
+                        help="Calibrate on random features instead of audio (previous behaviour)")
+    parser.add_argument("--eval-audio", nargs="+", default=["test_data/*_meeting_audio.wav"],
+                        help="Audio files or glob patterns for the fp32 / dynamic / static comparison "
+                             "(calibration files are left out)")
+    parser.add_argument("--enrollment-audio", nargs="+", default=["test_data/*_speaker_enrollment.wav"],
+                        help="<speaker>_speaker_enrollment files giving the speakers for the agreement column")
+    parser.add_argument("--output", help="Write the comparison to this JSON file")
+    args = parser.parse_args()
+    
     logger.info("=" * 70)
     logger.info("AMICA - ECAPA-TDNN ONNX Model Quantization")
     logger.info("=" * 70)
     
     # Paths
-    input_model_path = "models/onnx/ecapa_model.onnx"
-    dynamic_output_path = "models/onnx/ecapa_model_dynamic_quantized.onnx"
-    static_output_path = "models/onnx/ecapa_model_static_quantized.onnx"
+    input_model_path = args.input_model
+    dynamic_output_path = os.path.join(args.output_dir, "ecapa_model_dynamic_quantized.onnx")
+    static_output_path = os.path.join(args.output_dir, "ecapa_model_static_quantized.onnx")
     
     # Check if input model exists
     if not os.path.exists(input_model_path):
@@ -385,13 +629,26 @@ def main():
     logger.info("2. STATIC QUANTIZATION")
     logger.info("="*50)
     
-    # Generate calibration data
-    calibration_data = generate_calibration_data(num_samples=100)
+    # Calibration data: real features from audio unless asked otherwise
+    calibration_paths = sorted({path for pattern in args.calibration_audio for path in glob.glob(pattern)})
+    if args.synthetic_calibration or not calibration_paths:
+        if not args.synthetic_calibration:
+            logger.warning("No calibration audio found; falling back to synthetic calibration data")
+        calibration_data = generate_calibration_data(num_samples=args.calibration_samples)
+    else:
+        calibration_data = AudioCalibrationDataReader(
+            calibration_paths, num_samples=args.calibration_samples, clip_duration=args.clip_duration
+        )
     
     success = quantize_static_ecapa(
         input_model_path, 
         static_output_path, 
-        calibration_data
+        calibration_data,
+        calibrate_method={"minmax": CalibrationMethod.MinMax, "entropy": CalibrationMethod.Entropy,
+                          "percentile": CalibrationMethod.Percentile}[args.calibration_method],
+        percentile=args.percentile,
+        calibration_stride=args.calibration_stride,
+        op_types_to_quantize=args.static_op_types or None
     )
     
     if success:
@@ -425,6 +682,42 @@ def main():
         static_size = os.path.getsize(static_output_path) / (1024 * 1024)
         logger.info(f"✓ Static quantized model: {static_size:.1f} MB")
     
+    # Accuracy / latency on real speech
+    # Scored on held-out audio: windows the static ranges were calibrated on
+    # would flatter the static model
+    eval_paths = sorted({path for pattern in args.eval_audio for path in glob.glob(pattern)})
+    calibrated_on = set() if args.synthetic_calibration else set(calibration_paths)
+    held_out = [path for path in eval_paths if path not in calibrated_on]
+    if len(held_out) < len(eval_paths):
+        logger.info(f"Leaving {len(eval_paths) - len(held_out)} calibration files out of the comparison")
+    eval_paths = held_out
+    enrollment_paths = sorted({path for pattern in args.enrollment_audio for path in glob.glob(pattern)})
+    model_paths = {"fp32": input_model_path}
+    for name, path in (("dynamic", dynamic_output_path), ("static", static_output_path)):
+        if os.path.exists(path):
+            model_paths[name] = path
+    if eval_paths and len(model_paths) > 1:
+        comparison = compare_models_on_speakers(model_paths, eval_paths, enrollment_paths)
+        logger.info("\n" + "="*70)
+        logger.info("COMPARISON ON TEST SPEAKERS (reference: fp32)")
+        logger.info("="*70)
+        logger.info(f"Windows from {len(eval_paths)} files not used for calibration: "
+                    f"{', '.join(Path(path).name for path in eval_paths)}")
+        if calibrated_on & set(enrollment_paths):
+            logger.info("Speaker references for 'spk agree' are enrollment files that were also calibration audio")
+        logger.info(f"{'model':<10}{'size MB':>9}{'ms/window':>11}{'cos mean':>10}{'cos p5':>9}{'cos min':>9}{'spk agree':>11}")
+        for name, row in comparison.items():
+            agreement = f"{row['speaker_agreement']:.3f}" if row['speaker_agreement'] is not None else "-"
+            logger.info(f"{name:<10}{row['size_mb']:>9.1f}{row['window_latency_ms']:>11.2f}{row['cosine_mean']:>10.4f}"
+                        f"{row['cosine_p5']:>9.4f}{row['cosine_min']:>9.4f}{agreement:>11}")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"calibration_method": args.calibration_method,
+                           "calibration_samples": len(calibration_data),
+                           "calibration_audio": sorted(calibrated_on) if calibrated_on else "synthetic",
+                           "eval_audio": eval_paths, "enrollment_audio": enrollment_paths,
+                           "models": comparison}, f, indent=2)
+    
     logger.info("\nQuantized models are ready for deployment!")
     logger.info("Use the quantized models for improved performance and reduced memory usage.")
 
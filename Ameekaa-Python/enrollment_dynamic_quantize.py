@@ -1,41 +1,468 @@
 import os
 import numpy as np
-import torch
-import librosa
+import soundfile as sf
 import logging
+import threading
 import time
-from typing import Tuple, Dict, Any
-from speechbrain_ecapa_preprocessing import extract_log_mel_filterbank_features_simple, PreprocessingError
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Tuple, Dict, Any, Iterator, Optional
 
 logger = logging.getLogger(__name__)
 
 class DynamicQuantizedDiarizationError(Exception):
     pass
 
+# Process-wide registries so enrollment, diarization and any other caller in
+# the same process share one InferenceSession per model.
+_session_registry: Dict[Tuple, Any] = {}
+_processor_registry: Dict[Tuple, 'DynamicQuantizedAudioProcessor'] = {}
+_registry_lock = threading.RLock()
+
+# ONNX Runtime session settings accepted in the JSON config / session_options
+DEFAULT_SESSION_OPTIONS = {
+    'intra_op_num_threads': 0,            # 0 = let ONNX Runtime decide
+    'inter_op_num_threads': 0,
+    'graph_optimization_level': 'all',    # disable | basic | extended | all
+    'execution_mode': 'sequential',       # sequential | parallel
+    'enable_cpu_mem_arena': True,
+    'optimized_model_path': None,         # save / reload the optimized graph here
+}
+
+# Decoded meetings kept per processor so diarization and segment extraction
+# decode / resample a file only once
+DEFAULT_AUDIO_CACHE_BYTES = 512 * 1024 * 1024
+
+class DecodedAudioCache:
+    def __init__(self, max_bytes: int = DEFAULT_AUDIO_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[Tuple, Tuple[np.ndarray, int]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(audio_path: str, sample_rate: int) -> Tuple:
+        stat = os.stat(audio_path)
+        return (os.path.abspath(audio_path), stat.st_mtime_ns, stat.st_size, sample_rate)
+
+    def get(self, key: Tuple) -> Optional[Tuple[np.ndarray, int]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Tuple, audio: np.ndarray, sr: int) -> None:
+        if audio.nbytes > self.max_bytes:
+            return
+        # Shared between callers, so hand out read-only views
+        audio.setflags(write=False)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[0].nbytes
+            self._entries[key] = (audio, sr)
+            self.current_bytes += audio.nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+
+    def resize(self, max_bytes: int) -> None:
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self._entries and self.current_bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {'entries': len(self._entries), 'bytes': self.current_bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses}
+
+def resample_audio(audio: np.ndarray, orig_sr: int, target_sr: int) -> np.ndarray:
+    if orig_sr == target_sr:
+        return audio
+    # soxr 'HQ' polyphase filter, as librosa.load uses by default; same output length ceil(n * ratio)
+    import soxr
+    target_len = int(np.ceil(len(audio) * target_sr / orig_sr))
+    resampled = soxr.resample(audio, orig_sr, target_sr, quality='HQ')
+    if len(resampled) < target_len:
+        resampled = np.pad(resampled, (0, target_len - len(resampled)))
+    return np.asarray(resampled[:target_len], dtype=np.float32)
+
+def decode_audio(audio_path: str, sample_rate: int) -> Tuple[np.ndarray, int]:
+    # Mono float32 at sample_rate, without the processor's cache or checks
+    try:
+        audio, native_sr = sf.read(audio_path, dtype='float32', always_2d=True)
+        audio = audio.mean(axis=1) if audio.shape[1] > 1 else np.ascontiguousarray(audio[:, 0])
+        return resample_audio(audio, native_sr, sample_rate), sample_rate
+    except sf.SoundFileRuntimeError:
+        # Formats libsndfile cannot read; librosa falls back to audioread
+        import librosa
+        audio, sr = librosa.load(audio_path, sr=sample_rate, mono=True)
+        return audio, int(sr)
+
+# Log-mel front-ends: 'torch' is the SpeechBrain-compatible reference in
+# speechbrain_ecapa_preprocessing; 'numpy' computes the same features with
+# np.fft.rfft and never imports torch (faster cold start, lower RSS)
+FRONTENDS = ('torch', 'numpy')
+
+def _check_frontend(frontend: str) -> None:
+    if frontend not in FRONTENDS:
+        raise DynamicQuantizedDiarizationError(f"Unknown log-mel front-end: {frontend} (expected one of {FRONTENDS})")
+
+@lru_cache(maxsize=16)
+def numpy_hann_window(n_fft: int) -> np.ndarray:
+    # Periodic Hann window, as torch.hann_window; shared, read-only
+    window = (0.5 - 0.5 * np.cos(2.0 * np.pi * np.arange(n_fft) / n_fft)).astype(np.float32)
+    window.setflags(write=False)
+    return window
+
+@lru_cache(maxsize=16)
+def numpy_mel_filterbank(n_mels: int, n_fft: int, sample_rate: int) -> np.ndarray:
+    # create_filterbank_matrix(norm='slaney', mel_scale='htk', f_min=0,
+    # f_max=sr // 2) in float32, so the FFT bin edges come out identical;
+    # returned transposed, [n_fft // 2 + 1, n_mels], shared and read-only
+    mel_max = np.float32(2595.0) * np.log10(np.float32(1.0) + np.float32(sample_rate // 2) / np.float32(700.0))
+    mel_freqs = np.linspace(0.0, mel_max, n_mels + 2, dtype=np.float32)
+    hz_freqs = np.float32(700.0) * (np.float32(10.0) ** (mel_freqs / np.float32(2595.0)) - np.float32(1.0))
+    bins = np.clip(np.floor((n_fft + 1) * hz_freqs / sample_rate).astype(np.int64), 0, n_fft)
+    fft_bins = np.arange(n_fft // 2 + 1)[np.newaxis, :]
+    left_bin = bins[:n_mels, np.newaxis]
+    center_bin = bins[1:n_mels + 1, np.newaxis]
+    right_bin = bins[2:n_mels + 2, np.newaxis]
+    rising = (fft_bins - left_bin) / (center_bin - left_bin + 1e-8)
+    rising_mask = (left_bin < center_bin) & (fft_bins >= left_bin) & (fft_bins <= center_bin)
+    falling = (right_bin - fft_bins) / (right_bin - center_bin + 1e-8)
+    falling_mask = (center_bin < right_bin) & (fft_bins >= center_bin) & (fft_bins <= right_bin)
+    filterbank = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    filterbank = np.where(rising_mask, rising, filterbank)
+    filterbank = np.where(falling_mask, falling, filterbank)
+    enorm = 2.0 / (hz_freqs[2:n_mels + 2] - hz_freqs[:n_mels])
+    filterbank = np.ascontiguousarray((filterbank * enorm[:, np.newaxis]).T, dtype=np.float32)
+    filterbank.setflags(write=False)
+    return filterbank
+
+def numpy_log_mel_frames(padded: np.ndarray, n_fft: int = 400, hop_length: int = 160, n_mels: int = 80,
+                         sample_rate: int = 16000) -> np.ndarray:
+    # [frames, n_mels] log-mel of an already padded signal (torch.stft center=False)
+    frames = np.lib.stride_tricks.sliding_window_view(padded, n_fft)[::hop_length]
+    spectrum = np.fft.rfft(frames * numpy_hann_window(n_fft), axis=1)
+    power = spectrum.real ** 2 + spectrum.imag ** 2
+    return np.log(power @ numpy_mel_filterbank(n_mels, n_fft, sample_rate) + np.float32(1e-8))
+
+def _torch_log_mel(audio: np.ndarray, sr: int, hop_length: int) -> np.ndarray:
+    import torch
+    from speechbrain_ecapa_preprocessing import extract_log_mel_filterbank_features_simple
+    waveform = torch.tensor(audio, dtype=torch.float32)
+    features = extract_log_mel_filterbank_features_simple(
+        waveform=waveform,
+        sample_rate=sr,
+        n_mels=80,
+        n_fft=400,
+        hop_length=hop_length,
+        win_length=400,
+        window="hann",
+        center=True,
+        pad_mode="reflect",
+        power=2.0,
+        norm="slaney",
+        mel_scale="htk",
+        f_min=0.0,
+        f_max=None,
+        top_db=80.0,
+        log_mel=True,
+    )
+    features = features.squeeze(0)
+    feats = features.cpu().numpy().astype(np.float32)
+    return np.transpose(feats, (1, 0))
+
+def _numpy_log_mel(audio: np.ndarray, sr: int, hop_length: int) -> np.ndarray:
+    audio = np.asarray(audio, dtype=np.float32)
+    if audio.ndim != 1 or len(audio) == 0:
+        raise DynamicQuantizedDiarizationError(f"Expected non-empty mono audio, got shape {audio.shape}")
+    if not np.isfinite(audio).all():
+        raise DynamicQuantizedDiarizationError("Audio contains NaN or infinite values")
+    padded = np.pad(audio, 400 // 2, mode='reflect')
+    return numpy_log_mel_frames(padded, n_fft=400, hop_length=hop_length, n_mels=80, sample_rate=sr)
+
+def compute_log_mel(audio: np.ndarray, sr: int, hop_length: int = 160, frontend: str = 'torch') -> np.ndarray:
+    # ECAPA front-end: [frames, 80] natural-log mel frames of a centred STFT.
+    # The numpy front-end matches the torch one to float32 rounding (max abs
+    # log-mel difference ~1e-3 in near-silent bins, embeddings cosine > 0.99999)
+    _check_frontend(frontend)
+    if len(audio.shape) > 1:
+        audio = np.mean(audio, axis=1)
+    if frontend == 'numpy':
+        return _numpy_log_mel(audio, sr, hop_length)
+    return _torch_log_mel(audio, sr, hop_length)
+
+class IncrementalLogMelExtractor:
+    # Log-mel frames of a growing signal, computed once each. Frame t is the
+    # centred STFT frame at sample t * hop_length, exactly as
+    # extract_log_mel on the whole signal computes it: the start is reflect
+    # padded on the first push, the end by finish(), and frame t is computed
+    # as soon as n_fft // 2 samples past its centre have arrived. Frames live
+    # in a mirrored ring buffer (each row written at i % capacity and
+    # i % capacity + capacity), so any run of up to `capacity` frames is a
+    # contiguous view. Against extract_log_mel on the whole signal, frames
+    # agree to float32 rounding (max abs log-mel difference ~2e-6). Against
+    # extract_log_mel on a single window, only the first and last two
+    # frames of the window differ: they see the real neighbouring audio
+    # instead of the window's own reflect padding.
+
+    def __init__(self, sample_rate: int = 16000, n_fft: int = 400, hop_length: int = 160, n_mels: int = 80,
+                 capacity: int = 512, frontend: str = 'torch'):
+        _check_frontend(frontend)
+        self.sample_rate = sample_rate
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.n_mels = n_mels
+        self.frontend = frontend
+        if frontend == 'torch':
+            from speechbrain_ecapa_preprocessing import get_filterbank_matrix, get_hann_window
+            self.window = get_hann_window(n_fft)
+            self.filterbank = get_filterbank_matrix(n_mels, n_fft, sample_rate, 0.0, None, 'slaney', 'htk')
+        self._buffer = np.zeros((2 * capacity, n_mels), dtype=np.float32)
+        self.reset()
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buffer) // 2
+
+    def reset(self) -> None:
+        # Samples are held in padded coordinates (raw index + n_fft // 2), so
+        # frame t spans padded[t * hop : t * hop + n_fft]; only the samples
+        # the next frames need are kept
+        self._samples = np.zeros(0, dtype=np.float32)
+        self._samples_offset = 0
+        self._padded = False
+        self.finished = False
+        self.samples_received = 0
+        self.frames_computed = 0
+        self.frames_released = 0
+
+    def _log_mel_frames(self, padded: np.ndarray) -> np.ndarray:
+        # Same STFT / power / slaney mel / log as extract_log_mel, without the
+        # centre padding (already applied to the stream)
+        if self.frontend == 'numpy':
+            return numpy_log_mel_frames(padded, self.n_fft, self.hop_length, self.n_mels, self.sample_rate)
+        import torch
+        stft = torch.stft(torch.from_numpy(padded), n_fft=self.n_fft, hop_length=self.hop_length,
+                          win_length=self.n_fft, window=self.window, center=False, return_complex=True)
+        mel_spec = torch.log(torch.matmul(self.filterbank, torch.abs(stft) ** 2.0) + 1e-8)
+        return mel_spec.numpy().T
+
+    def _grow(self, needed: int) -> None:
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        live = self.frames(self.frames_released, self.frames_computed - self.frames_released).copy()
+        self._buffer = np.zeros((2 * capacity, self.n_mels), dtype=np.float32)
+        self._write(self.frames_released, live)
+
+    def _write(self, first_frame: int, frames: np.ndarray) -> None:
+        # Every row goes to both halves; len(frames) <= capacity
+        capacity = self.capacity
+        position = first_frame % capacity
+        head = min(len(frames), capacity - position)
+        tail = len(frames) - head
+        self._buffer[position:position + head] = frames[:head]
+        self._buffer[capacity + position:capacity + position + head] = frames[:head]
+        self._buffer[:tail] = frames[head:]
+        self._buffer[capacity:capacity + tail] = frames[head:]
+
+    def _compute_frames(self) -> int:
+        available = self._samples_offset + len(self._samples)
+        n_new = (available - self.n_fft) // self.hop_length + 1 - self.frames_computed
+        if n_new <= 0:
+            return 0
+        if self.frames_computed + n_new - self.frames_released > self.capacity:
+            self._grow(self.frames_computed + n_new - self.frames_released)
+        first = self.frames_computed * self.hop_length - self._samples_offset
+        padded = np.ascontiguousarray(self._samples[first:first + (n_new - 1) * self.hop_length + self.n_fft])
+        self._write(self.frames_computed, self._log_mel_frames(padded))
+        self.frames_computed += n_new
+        # Keep what the next frame needs, and at least n_fft samples for the end padding
+        keep = min(self.frames_computed * self.hop_length, available - self.n_fft)
+        if keep > self._samples_offset:
+            self._samples = self._samples[keep - self._samples_offset:]
+            self._samples_offset = keep
+        return n_new
+
+    def push(self, samples: np.ndarray) -> int:
+        if self.finished:
+            raise DynamicQuantizedDiarizationError("Cannot push samples after finish()")
+        samples = np.asarray(samples, dtype=np.float32)
+        self.samples_received += len(samples)
+        self._samples = np.concatenate([self._samples, samples]) if len(self._samples) else samples
+        if not self._padded:
+            half = self.n_fft // 2
+            if len(self._samples) <= half:
+                return 0
+            self._samples = np.concatenate([self._samples[1:half + 1][::-1], self._samples])
+            self._padded = True
+        return self._compute_frames()
+
+    def finish(self) -> int:
+        # Reflect-pad the end of the signal and compute the remaining frames
+        half = self.n_fft // 2
+        if self.finished or not self._padded or len(self._samples) <= half:
+            self.finished = True
+            return 0
+        self._samples = np.concatenate([self._samples, self._samples[-half - 1:-1][::-1]])
+        n_new = self._compute_frames()
+        self.finished = True
+        self._samples = np.zeros(0, dtype=np.float32)
+        return n_new
+
+    def frames(self, first_frame: int, n_frames: int) -> np.ndarray:
+        # Read-only view of frames [first_frame, first_frame + n_frames)
+        if first_frame < self.frames_released or first_frame + n_frames > self.frames_computed:
+            raise DynamicQuantizedDiarizationError(
+                f"Frames {first_frame}-{first_frame + n_frames} not available "
+                f"(held: {self.frames_released}-{self.frames_computed})")
+        position = first_frame % self.capacity
+        view = self._buffer[position:position + n_frames]
+        view.flags.writeable = False
+        return view
+
+    def release(self, before_frame: int) -> None:
+        # Frames before this index will not be read again and may be overwritten
+        self.frames_released = max(self.frames_released, min(before_frame, self.frames_computed))
+
+def session_options_from_config(config: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: config.get(key, default) for key, default in DEFAULT_SESSION_OPTIONS.items()}
+
+def _session_options_key(session_options: Optional[Dict[str, Any]]) -> Tuple:
+    options = dict(DEFAULT_SESSION_OPTIONS)
+    options.update(session_options or {})
+    return tuple(sorted(options.items()))
+
+def build_session_options(session_options: Optional[Dict[str, Any]] = None):
+    import onnxruntime as ort
+    options = dict(DEFAULT_SESSION_OPTIONS)
+    options.update(session_options or {})
+    optimization_levels = {
+        'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    execution_modes = {
+        'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+        'parallel': ort.ExecutionMode.ORT_PARALLEL,
+    }
+    if options['graph_optimization_level'] not in optimization_levels:
+        raise DynamicQuantizedDiarizationError(f"Unknown graph_optimization_level: {options['graph_optimization_level']}")
+    if options['execution_mode'] not in execution_modes:
+        raise DynamicQuantizedDiarizationError(f"Unknown execution_mode: {options['execution_mode']}")
+    sess_options = ort.SessionOptions()
+    sess_options.intra_op_num_threads = int(options['intra_op_num_threads'])
+    sess_options.inter_op_num_threads = int(options['inter_op_num_threads'])
+    sess_options.graph_optimization_level = optimization_levels[options['graph_optimization_level']]
+    sess_options.execution_mode = execution_modes[options['execution_mode']]
+    sess_options.enable_cpu_mem_arena = bool(options['enable_cpu_mem_arena'])
+    return sess_options, options
+
+def get_inference_session(model_path: str, session_options: Optional[Dict[str, Any]] = None):
+    key = (os.path.abspath(model_path), _session_options_key(session_options))
+    with _registry_lock:
+        session = _session_registry.get(key)
+        if session is None:
+            import onnxruntime as ort
+            start_time = time.time()
+            sess_options, options = build_session_options(session_options)
+            load_path = model_path
+            optimized_path = options['optimized_model_path']
+            if optimized_path:
+                if os.path.exists(optimized_path) and os.path.getmtime(optimized_path) >= os.path.getmtime(model_path):
+                    # Graph was optimized by an earlier run; skip optimization this time
+                    load_path = optimized_path
+                    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+                    logger.info(f"Loading pre-optimized ONNX graph: {optimized_path}")
+                else:
+                    os.makedirs(os.path.dirname(os.path.abspath(optimized_path)), exist_ok=True)
+                    sess_options.optimized_model_filepath = optimized_path
+                    logger.info(f"Saving optimized ONNX graph to: {optimized_path}")
+            session = ort.InferenceSession(load_path, sess_options)
+            _session_registry[key] = session
+            logger.info(f"[SUCCESS] Created ONNX session in {(time.time() - start_time)*1000:.0f}ms: {load_path}")
+        return session
+
+def get_audio_processor(model_path: str = "models/onnx/ecapa_model_dynamic_quantized.onnx", sample_rate: int = 16000,
+                        run_benchmark: bool = False,
+                        session_options: Optional[Dict[str, Any]] = None,
+                        audio_cache_bytes: Optional[int] = None,
+                        frontend: str = 'torch') -> 'DynamicQuantizedAudioProcessor':
+    key = (os.path.abspath(model_path), sample_rate, _session_options_key(session_options), frontend)
+    with _registry_lock:
+        processor = _processor_registry.get(key)
+        if processor is None:
+            processor = DynamicQuantizedAudioProcessor(model_path, sample_rate, run_benchmark=run_benchmark,
+                                                       session_options=session_options, frontend=frontend)
+            _processor_registry[key] = processor
+        elif run_benchmark and not processor.benchmark_results:
+            processor.run_benchmark()
+        if audio_cache_bytes is not None:
+            processor.audio_cache.resize(audio_cache_bytes)
+        return processor
+
+def clear_registry() -> None:
+    with _registry_lock:
+        _processor_registry.clear()
+        _session_registry.clear()
+
 class DynamicQuantizedAudioProcessor:
-    def __init__(self, model_path: str = "models/onnx/ecapa_model_dynamic_quantized.onnx", sample_rate: int = 16000):
+    def __init__(self, model_path: str = "models/onnx/ecapa_model_dynamic_quantized.onnx", sample_rate: int = 16000,
+                 run_benchmark: bool = False, session_options: Optional[Dict[str, Any]] = None,
+                 audio_cache_bytes: int = DEFAULT_AUDIO_CACHE_BYTES, frontend: str = 'torch'):
+        _check_frontend(frontend)
         try:
-            import onnxruntime as ort
             self.sample_rate = sample_rate
-            self.session = ort.InferenceSession(model_path)
+            self.hop_length = 160
+            self.frontend = frontend
+            self.audio_cache = DecodedAudioCache(audio_cache_bytes)
+            self.session = get_inference_session(model_path, session_options)
+            self.input_name = self.session.get_inputs()[0].name
+            # Models exported with --fused-frontend take the 16 kHz waveform
+            # [batch, samples] and compute the log-mel features in the graph
+            self.waveform_input = self.input_name == 'waveform'
             model_size = os.path.getsize(model_path) / (1024 * 1024)
             logger.info(f"[SUCCESS] Loaded dynamic quantized ONNX model: {model_path}")
             logger.info(f"[SUCCESS] Model size: {model_size:.1f} MB")
-            self.benchmark_results = self._benchmark_model()
-            if self.benchmark_results:
-                logger.info(f"[SUCCESS] Model performance: {self.benchmark_results['avg_inference_time_ms']:.2f}ms ± {self.benchmark_results['std_inference_time_ms']:.2f}ms")
+            self.benchmark_results = {}
+            if run_benchmark:
+                self.run_benchmark()
         except Exception as e:
             raise DynamicQuantizedDiarizationError(f"Failed to load dynamic quantized ONNX model: {str(e)}")
 
+    def run_benchmark(self) -> Dict[str, float]:
+        self.benchmark_results = self._benchmark_model()
+        if self.benchmark_results:
+            logger.info(f"[SUCCESS] Model performance: {self.benchmark_results['avg_inference_time_ms']:.2f}ms ± {self.benchmark_results['std_inference_time_ms']:.2f}ms")
+        return self.benchmark_results
+
     def _benchmark_model(self) -> Dict[str, float]:
         try:
-            test_input = np.random.randn(1, 200, 80).astype(np.float32)
+            if self.waveform_input:
+                test_input = np.random.randn(1, 199 * self.hop_length).astype(np.float32)
+            else:
+                test_input = np.random.randn(1, 200, 80).astype(np.float32)
             for _ in range(3):
-                self.session.run(None, {'input': test_input})
+                self.session.run(None, {self.input_name: test_input})
             times = []
             for _ in range(5):
                 start_time = time.time()
-                self.session.run(None, {'input': test_input})
+                self.session.run(None, {self.input_name: test_input})
                 end_time = time.time()
                 times.append((end_time - start_time) * 1000)
             return {
@@ -50,47 +477,117 @@ class DynamicQuantizedAudioProcessor:
         try:
             if not os.path.exists(audio_path):
                 raise DynamicQuantizedDiarizationError(f"Audio file not found: {audio_path}")
-            audio, sr = librosa.load(audio_path, sr=self.sample_rate, mono=True)
+            cache_key = self.audio_cache.make_key(audio_path, self.sample_rate)
+            cached = self.audio_cache.get(cache_key)
+            if cached is not None:
+                logger.debug(f"Loaded audio from cache: {audio_path}")
+                return cached
+            audio, sr = decode_audio(audio_path, self.sample_rate)
             if len(audio) == 0:
                 raise DynamicQuantizedDiarizationError(f"Audio file is empty: {audio_path}")
             duration = len(audio) / sr
             if duration < 0.5:
                 raise DynamicQuantizedDiarizationError(f"Audio too short: {duration:.2f}s (minimum 0.5s)")
             logger.debug(f"Loaded audio: {audio_path}, duration: {duration:.2f}s, shape: {audio.shape}")
+            self.audio_cache.put(cache_key, audio, int(sr))
             return audio, int(sr)
         except Exception as e:
             raise DynamicQuantizedDiarizationError(f"Failed to load audio {audio_path}: {str(e)}")
 
+    def stream_audio(self, audio_path: str, block_duration: float = 10.0) -> Iterator[np.ndarray]:
+        try:
+            if not os.path.exists(audio_path):
+                raise DynamicQuantizedDiarizationError(f"Audio file not found: {audio_path}")
+            info = sf.info(audio_path)
+            block_size = max(1, int(block_duration * info.samplerate))
+            resampler = None
+            if info.samplerate != self.sample_rate:
+                # Same soxr 'HQ' filter librosa.load uses, but stateful across blocks
+                import soxr
+                resampler = soxr.ResampleStream(info.samplerate, self.sample_rate, 1, dtype='float32', quality='HQ')
+            logger.debug(f"Streaming audio: {audio_path}, {info.samplerate} Hz, block: {block_size} samples")
+            samples_out = 0
+            for block in sf.blocks(audio_path, blocksize=block_size, dtype='float32', always_2d=True):
+                block = block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+                if resampler is not None:
+                    block = resampler.resample_chunk(block, last=False)
+                if len(block):
+                    samples_out += len(block)
+                    yield block
+            if resampler is not None:
+                # librosa.load fixes the resampled length to ceil(n * ratio)
+                target_len = int(np.ceil(info.frames * self.sample_rate / info.samplerate))
+                block = resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+                block = block[:max(target_len - samples_out, 0)]
+                if len(block) < target_len - samples_out:
+                    block = np.pad(block, (0, target_len - samples_out - len(block)))
+                if len(block):
+                    yield block
+        except DynamicQuantizedDiarizationError:
+            raise
+        except Exception as e:
+            raise DynamicQuantizedDiarizationError(f"Failed to stream audio {audio_path}: {str(e)}")
+
+    @property
+    def supports_batching(self) -> bool:
+        batch_dim = self.session.get_inputs()[0].shape[0]
+        return not isinstance(batch_dim, int) or batch_dim != 1
+
+    def extract_log_mel(self, audio: np.ndarray, sr: int) -> np.ndarray:
+        try:
+            return compute_log_mel(audio, sr, self.hop_length, self.frontend)
+        except Exception as e:
+            raise DynamicQuantizedDiarizationError(f"Failed to extract log-mel features: {str(e)}")
+
+    def incremental_log_mel(self, capacity: int = 512) -> IncrementalLogMelExtractor:
+        # Same front-end settings as extract_log_mel
+        return IncrementalLogMelExtractor(self.sample_rate, n_fft=400, hop_length=self.hop_length, n_mels=80,
+                                          capacity=capacity, frontend=self.frontend)
+
+    def model_input(self, audio: np.ndarray, sr: int) -> np.ndarray:
+        # What the ONNX model consumes for one clip: normalized features, or
+        # the samples themselves for a waveform-input model
+        if not self.waveform_input:
+            return self.extract_features(audio, sr)
+        if sr != self.sample_rate:
+            raise DynamicQuantizedDiarizationError(f"Waveform-input model expects {self.sample_rate} Hz audio, got {sr} Hz")
+        return np.ascontiguousarray(np.mean(audio, axis=1) if audio.ndim > 1 else audio, dtype=np.float32)
+
+    def input_frames(self, model_input: np.ndarray) -> int:
+        # STFT frames covered by one model input
+        return model_input.shape[0] // self.hop_length + 1 if self.waveform_input else model_input.shape[0]
+
+    def extract_features(self, audio: np.ndarray, sr: int) -> np.ndarray:
+        try:
+            return self.normalize_features(self.extract_log_mel(audio, sr))
+        except Exception as e:
+            raise DynamicQuantizedDiarizationError(f"Failed to extract features: {str(e)}")
+
+    @staticmethod
+    def normalize_features(log_mel: np.ndarray) -> np.ndarray:
+        # Per-utterance mean normalization over frames
+        return log_mel - log_mel.mean(axis=0, keepdims=True)
+
+    def extract_embeddings_batch(self, features: np.ndarray) -> np.ndarray:
+        try:
+            if self.waveform_input and features.ndim != 2:
+                raise DynamicQuantizedDiarizationError(f"Expected [batch, samples] waveforms, got shape {features.shape}")
+            if not self.waveform_input and features.ndim != 3:
+                raise DynamicQuantizedDiarizationError(f"Expected [batch, frames, 80] features, got shape {features.shape}")
+            start_time = time.time()
+            output = self.session.run(None, {self.input_name: np.ascontiguousarray(features, dtype=np.float32)})[0]
+            inference_time = (time.time() - start_time) * 1000
+            embeddings = output.reshape(features.shape[0], -1)
+            logger.debug(f"Extracted {embeddings.shape[0]} embeddings, inference time: {inference_time:.2f}ms")
+            return embeddings
+        except Exception as e:
+            raise DynamicQuantizedDiarizationError(f"Failed to extract batched embeddings: {str(e)}")
+
     def extract_embedding(self, audio: np.ndarray, sr: int) -> np.ndarray:
         try:
-            if len(audio.shape) > 1:
-                audio = np.mean(audio, axis=1)
-            waveform = torch.tensor(audio, dtype=torch.float32)
-            features = extract_log_mel_filterbank_features_simple(
-                waveform=waveform,
-                sample_rate=sr,
-                n_mels=80,
-                n_fft=400,
-                hop_length=160,
-                win_length=400,
-                window="hann",
-                center=True,
-                pad_mode="reflect",
-                power=2.0,
-                norm="slaney",
-                mel_scale="htk",
-                f_min=0.0,
-                f_max=None,
-                top_db=80.0,
-                log_mel=True,
-            )
-            features = features.squeeze(0)
-            mean = features.mean(dim=1, keepdim=True)
-            features = features - mean
-            feats = features.cpu().numpy().astype(np.float32)
-            feats = np.transpose(feats, (1, 0))[np.newaxis, ...]
+            feats = self.model_input(audio, sr)[np.newaxis, ...]
             start_time = time.time()
-            output = self.session.run(None, {'input': feats})[0]
+            output = self.session.run(None, {self.input_name: feats})[0]
             inference_time = (time.time() - start_time) * 1000
             embedding = np.squeeze(output)
             logger.debug(f"Extracted embedding shape: {embedding.shape}, inference time: {inference_time:.2f}ms")
@@ -98,8 +595,9 @@ class DynamicQuantizedAudioProcessor:
         except Exception as e:
             raise DynamicQuantizedDiarizationError(f"Failed to extract embedding: {str(e)}")
 
-def enroll_speaker(enrollment_path: str, speaker_name: str, model_path: str, sample_rate: int = 16000) -> np.ndarray:
-    processor = DynamicQuantizedAudioProcessor(model_path, sample_rate)
+def enroll_speaker(enrollment_path: str, speaker_name: str, model_path: str, sample_rate: int = 16000,
+                   session_options: Optional[Dict[str, Any]] = None, frontend: str = 'torch') -> np.ndarray:
+    processor = get_audio_processor(model_path, sample_rate, session_options=session_options, frontend=frontend)
     logger.info(f"Enrolling speaker '{speaker_name}' from {enrollment_path}")
     audio, sr = processor.load_audio(enrollment_path)
     embedding = processor.extract_embedding(audio, sr)
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Evaluate fp32 and quantized ECAPA models on speaker verification trials.
+
+Labelled trials come only from single-speaker enrollment audio
+(<speaker>_speaker_enrollment.*): each file is split into two halves, each
+half is an enrollment, and every speech window of one half is scored
+against the other half's enrollment of every speaker (a target trial for its
+own speaker, non-target for the rest), so no window is scored against
+audio that contains it. EER and minDCF use these trials only.
+
+Meeting audio (any other file) has several speakers and no annotation, so
+its windows are never labelled: they are scored against the whole-file
+enrollments and only count towards agreement with the reference model.
+Features are computed once and shared by all models, so the models only
+differ in their ONNX graph.
+
+Per model the table reports size, per-window latency, EER, minDCF and how
+close it stays to the reference (fp32) model over all windows: embedding
+cosine per window, score change and decision agreement per (window,
+speaker) pair at the diarization threshold, and per window on the label
+diarization would give it (best enrolled speaker above the threshold, or
+none). The fastest model within --max-eer-increase / --min-agreement of the
+reference is recommended.
+"""
+import os
+import glob
+import json
+import time
+import logging
+import argparse
+import numpy as np
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from run_dynamic_quantized_diarization import load_config
+from enrollment_dynamic_quantize import (
+    DynamicQuantizedAudioProcessor, DynamicQuantizedDiarizationError, compute_log_mel, decode_audio,
+    get_inference_session, session_options_from_config
+)
+from diarization_dynamic_quantize import is_speech
+
+logger = logging.getLogger(__name__)
+
+ENROLLMENT_SUFFIX = '_speaker_enrollment'
+
+DEFAULT_MODELS = {
+    'fp32': 'models/onnx/ecapa_model.onnx',
+    'dynamic': 'models/onnx/ecapa_model_dynamic_quantized.onnx',
+    'static': 'models/onnx/ecapa_model_static_quantized.onnx'
+}
+
+def speaker_from_path(path: str) -> Optional[str]:
+    # Speaker of a single-speaker enrollment file, None for meeting audio
+    stem = Path(path).stem
+    return stem[:-len(ENROLLMENT_SUFFIX)] if stem.endswith(ENROLLMENT_SUFFIX) else None
+
+def build_trials(audio_paths: List[str], config: Dict[str, Any]) -> Dict[str, Any]:
+    # Normalized features for every enrollment (whole file and per half) and
+    # speech window, plus the labelled (window, speaker) verification trials.
+    # Each window records which enrollments it is scored against:
+    # 'enrollment_set' -1 for the whole-file enrollments (meeting windows),
+    # else the other half of the enrollment files (0 or 1).
+    sample_rate = config['sample_rate']
+    window_samples = int(config['segment_length'] * sample_rate)
+    step_samples = int(config['segment_step'] * sample_rate)
+    speakers = []
+    enrollment_features = []
+    half_enrollment_features = ([], [])
+    windows = []
+    window_features = []
+    skipped = 0
+
+    def add_windows(audio, offset, path, speaker, enrollment_set):
+        nonlocal skipped
+        for start in range(0, len(audio) - window_samples + 1, step_samples):
+            log_mel = compute_log_mel(audio[start:start + window_samples], sample_rate)
+            # Trials are speech windows whatever vad_enabled says for diarization
+            if not is_speech(
+                log_mel, config['vad_energy_threshold'], config['vad_min_active_ratio'],
+                config['vad_min_energy_range'], config['vad_min_flux']
+            ):
+                skipped += 1
+                continue
+            windows.append({'path': path, 'speaker': speaker, 'enrollment_set': enrollment_set,
+                            'start': (offset + start) / sample_rate, 'end': (offset + start + window_samples) / sample_rate})
+            window_features.append(DynamicQuantizedAudioProcessor.normalize_features(log_mel))
+
+    for path in sorted(audio_paths):
+        speaker = speaker_from_path(path)
+        audio, sr = decode_audio(path, sample_rate)
+        if speaker is None:
+            add_windows(audio, 0, path, None, -1)
+            continue
+        middle = len(audio) // 2
+        if middle < window_samples:
+            logger.warning(f"Skipping {path}: too short to split into two {config['segment_length']:g}s halves")
+            continue
+        speakers.append(speaker)
+        enrollment_features.append(DynamicQuantizedAudioProcessor.normalize_features(compute_log_mel(audio, sr)))
+        for half, (offset, half_audio) in enumerate(((0, audio[:middle]), (middle, audio[middle:]))):
+            half_enrollment_features[half].append(
+                DynamicQuantizedAudioProcessor.normalize_features(compute_log_mel(half_audio, sr)))
+            add_windows(half_audio, offset, path, speaker, 1 - half)
+    if len(speakers) < 2:
+        raise DynamicQuantizedDiarizationError("Need <speaker>_speaker_enrollment files of at least two speakers")
+    if not windows:
+        raise DynamicQuantizedDiarizationError("No speech windows in the evaluation audio")
+
+    trials = []
+    labels = []
+    for window_index, window in enumerate(windows):
+        if window['speaker'] is None:
+            continue
+        for speaker_index, speaker in enumerate(speakers):
+            trials.append((window_index, speaker_index))
+            labels.append(speaker == window['speaker'])
+    labels = np.asarray(labels, dtype=bool)
+    meeting_windows = sum(window['speaker'] is None for window in windows)
+    logger.info(f"{len(windows) - meeting_windows} enrollment and {meeting_windows} meeting speech windows "
+                f"({skipped} skipped by VAD), {len(speakers)} enrolled speakers, "
+                f"{len(labels)} trials ({int(labels.sum())} target)")
+    if labels.all() or not labels.any():
+        raise DynamicQuantizedDiarizationError("Trials need both target and non-target pairs")
+    return {
+        'speakers': speakers,
+        'enrollment_features': enrollment_features,
+        'half_enrollment_features': half_enrollment_features,
+        'windows': windows,
+        'window_features': window_features,
+        'trials': np.asarray(trials, dtype=np.int64),
+        'labels': labels,
+        'vad_skipped_windows': skipped
+    }
+
+def _error_rates(scores: np.ndarray, labels: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Miss and false-alarm rates when accepting every score >= each threshold,
+    # thresholds taken at the sorted scores (plus one above the maximum).
+    order = np.argsort(-scores, kind='mergesort')
+    sorted_labels = labels[order]
+    accepted_targets = np.concatenate([[0], np.cumsum(sorted_labels)])
+    accepted_nontargets = np.concatenate([[0], np.cumsum(~sorted_labels)])
+    miss = 1.0 - accepted_targets / sorted_labels.sum()
+    false_alarm = accepted_nontargets / (~sorted_labels).sum()
+    thresholds = np.concatenate([[np.inf], scores[order]])
+    return miss, false_alarm, thresholds
+
+def compute_eer(scores: np.ndarray, labels: np.ndarray) -> Tuple[float, float]:
+    miss, false_alarm, thresholds = _error_rates(scores, labels)
+    index = int(np.argmin(np.abs(miss - false_alarm)))
+    return float((miss[index] + false_alarm[index]) / 2), float(thresholds[index])
+
+def compute_min_dcf(scores: np.ndarray, labels: np.ndarray, p_target: float = 0.01,
+                    c_miss: float = 1.0, c_fa: float = 1.0) -> Tuple[float, float]:
+    # Normalized minimum detection cost (NIST SRE / VoxSRC convention).
+    miss, false_alarm, thresholds = _error_rates(scores, labels)
+    cost = c_miss * p_target * miss + c_fa * (1.0 - p_target) * false_alarm
+    index = int(np.argmin(cost))
+    return float(cost[index] / min(c_miss * p_target, c_fa * (1.0 - p_target))), float(thresholds[index])
+
+def embed_features(model_path: str, features: List[np.ndarray],
+                   session_options: Optional[Dict[str, Any]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    # L2-normalized embeddings and per-window latency in ms, one window per
+    # run as in the default diarization path.
+    session = get_inference_session(model_path, session_options)
+    input_name = session.get_inputs()[0].name
+    session.run(None, {input_name: features[0][np.newaxis, ...]})
+    embeddings = []
+    latencies = []
+    for feats in features:
+        start_time = time.perf_counter()
+        embeddings.append(session.run(None, {input_name: feats[np.newaxis, ...]})[0].reshape(-1))
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    embeddings = np.stack(embeddings).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-8
+    return embeddings, np.asarray(latencies)
+
+def score_model(model_path: str, trial_set: Dict[str, Any],
+                session_options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    # similarities: every window against the enrollments of its enrollment_set
+    enrollment_sets = [embed_features(model_path, features, session_options)[0]
+                       for features in trial_set['half_enrollment_features']]
+    enrollment_sets.append(embed_features(model_path, trial_set['enrollment_features'], session_options)[0])
+    window_embeddings, latencies = embed_features(model_path, trial_set['window_features'], session_options)
+    similarities = np.stack([window_embeddings[i] @ enrollment_sets[window['enrollment_set']].T
+                             for i, window in enumerate(trial_set['windows'])])
+    trials = trial_set['trials']
+    return {
+        'embeddings': window_embeddings,
+        'similarities': similarities,
+        'scores': similarities[trials[:, 0], trials[:, 1]],
+        'latencies': latencies
+    }
+
+def window_labels(similarities: np.ndarray, threshold: float) -> np.ndarray:
+    # Diarization label per window: best enrolled speaker above threshold, -1 for none
+    best = np.argmax(similarities, axis=1)
+    return np.where(similarities[np.arange(len(best)), best] >= threshold, best, -1)
+
+def evaluate_models(model_paths: Dict[str, str], trial_set: Dict[str, Any], reference: str = 'fp32',
+                    threshold: float = 0.6, p_target: float = 0.01,
+                    session_options: Optional[Dict[str, Any]] = None,
+                    scored: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Dict[str, Any]]:
+    # scored caches score_model() output by model name across calls, so a
+    # search over candidate models embeds the reference only once
+    if reference not in model_paths:
+        raise DynamicQuantizedDiarizationError(f"Reference model '{reference}' is not among the evaluated models")
+    labels = trial_set['labels']
+    scored = {} if scored is None else scored
+    for name, model_path in model_paths.items():
+        if name not in scored:
+            logger.info(f"Scoring {name}: {model_path}")
+            scored[name] = score_model(model_path, trial_set, session_options)
+
+    reference_similarities = scored[reference]['similarities']
+    reference_decisions = reference_similarities >= threshold
+    reference_labels = window_labels(scored[reference]['similarities'], threshold)
+    results = {}
+    for name, model_path in model_paths.items():
+        scores = scored[name]['scores']
+        latencies = scored[name]['latencies']
+        eer, eer_threshold = compute_eer(scores, labels)
+        min_dcf, min_dcf_threshold = compute_min_dcf(scores, labels, p_target)
+        similarities = scored[name]['similarities']
+        cosine = np.sum(scored[name]['embeddings'] * scored[reference]['embeddings'], axis=1)
+        results[name] = {
+            'model_path': model_path,
+            'size_mb': os.path.getsize(model_path) / (1024 * 1024),
+            'latency_p50_ms': float(np.percentile(latencies, 50)),
+            'latency_p95_ms': float(np.percentile(latencies, 95)),
+            'eer': eer,
+            'eer_threshold': eer_threshold,
+            'min_dcf': min_dcf,
+            'min_dcf_threshold': min_dcf_threshold,
+            'error_rate_at_threshold': float(np.mean((scores >= threshold) != labels)),
+            'decision_agreement': float(np.mean((similarities >= threshold) == reference_decisions)),
+            'segment_agreement': float(np.mean(window_labels(similarities, threshold) == reference_labels)),
+            'mean_abs_score_delta': float(np.mean(np.abs(similarities - reference_similarities))),
+            'cosine_mean': float(cosine.mean()),
+            'cosine_min': float(cosine.min())
+        }
+    return results
+
+def select_fastest(results: Dict[str, Dict[str, Any]], reference: str = 'fp32', max_eer_increase: float = 0.01,
+                   min_agreement: float = 0.98) -> Optional[str]:
+    # Marks each model within_budget and returns the fastest (p50) one
+    reference_eer = results[reference]['eer']
+    for name, result in results.items():
+        result['within_budget'] = (
+            name == reference or
+            (result['eer'] - reference_eer <= max_eer_increase and result['segment_agreement'] >= min_agreement)
+        )
+    candidates = [name for name, result in results.items() if result['within_budget']]
+    return min(candidates, key=lambda name: results[name]['latency_p50_ms']) if candidates else None
+
+def format_table(results: Dict[str, Dict[str, Any]], reference: str = 'fp32') -> str:
+    header = (f"{'model':<24} {'size MB':>8} {'p50 ms':>8} {'p95 ms':>8} {'EER %':>7} {'dEER':>7} {'minDCF':>7} "
+              f"{'pair agr':>9} {'seg agr':>8} {'|dscore|':>8} {'cos min':>7}  budget")
+    lines = [header, '-' * len(header)]
+    reference_eer = results[reference]['eer']
+    for name, result in results.items():
+        lines.append(
+            f"{name:<24} {result['size_mb']:>8.1f} {result['latency_p50_ms']:>8.1f} {result['latency_p95_ms']:>8.1f} "
+            f"{result['eer'] * 100:>7.2f} {(result['eer'] - reference_eer) * 100:>+7.2f} {result['min_dcf']:>7.3f} "
+            f"{result['decision_agreement'] * 100:>8.1f}% {result['segment_agreement'] * 100:>7.1f}% "
+            f"{result['mean_abs_score_delta']:>8.4f} {result['cosine_min']:>7.4f}  {'ok' if result.get('within_budget') else '-'}"
+        )
+    return '\n'.join(lines)
+
+def parse_models(values: Optional[List[str]]) -> Dict[str, str]:
+    if not values:
+        return {name: path for name, path in DEFAULT_MODELS.items() if os.path.exists(path)}
+    models = {}
+    for value in values:
+        name, sep, path = value.partition('=')
+        if not sep:
+            name, path = Path(value).stem, value
+        models[name] = path
+    return models
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fp32 and quantized ECAPA models on speaker verification trials")
+    parser.add_argument('--audio', nargs='+', default=['test_data/*_speaker_enrollment.*', 'test_data/*_meeting_audio.*'],
+                        help='Audio files or glob patterns: single-speaker <speaker>_speaker_enrollment files give '
+                             'the labelled trials, any other (meeting) audio only counts towards agreement')
+    parser.add_argument('--model', action='append',
+                        help='name=path of a model to evaluate (repeatable; default: fp32, dynamic and static '
+                             'under models/onnx when present)')
+    parser.add_argument('--reference', default='fp32', help='Name of the reference model')
+    parser.add_argument('--config', help='Configuration JSON file')
+    parser.add_argument('--threshold', type=float, help='Decision threshold (default: config default_threshold)')
+    parser.add_argument('--p-target', type=float, default=0.01, help='Target prior for minDCF')
+    parser.add_argument('--max-eer-increase', type=float, default=0.01,
+                        help='Accuracy budget: allowed absolute EER increase over the reference')
+    parser.add_argument('--min-agreement', type=float, default=0.98,
+                        help='Accuracy budget: minimum segment-level agreement with the reference')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = load_config(args.config)
+    threshold = args.threshold if args.threshold is not None else config['default_threshold']
+    model_paths = parse_models(args.model)
+    missing = [path for path in model_paths.values() if not os.path.exists(path)]
+    if missing:
+        raise DynamicQuantizedDiarizationError(f"Model not found: {', '.join(missing)}")
+    audio_paths = sorted({path for pattern in args.audio for path in glob.glob(pattern)})
+
+    trial_set = build_trials(audio_paths, config)
+    results = evaluate_models(model_paths, trial_set, args.reference, threshold, args.p_target,
+                              session_options_from_config(config))
+    fastest = select_fastest(results, args.reference, args.max_eer_increase, args.min_agreement)
+
+    print(format_table(results, args.reference))
+    print(f"Fastest model within budget (EER +{args.max_eer_increase * 100:.2f} points, "
+          f"segment agreement >= {args.min_agreement * 100:.1f}%): {fastest}")
+    if args.output:
+        output_path = Path(args.output)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'w') as f:
+            json.dump({
+                'reference': args.reference,
+                'threshold': threshold,
+                'p_target': args.p_target,
+                'budget': {'max_eer_increase': args.max_eer_increase, 'min_agreement': args.min_agreement},
+                'speakers': trial_set['speakers'],
+                'windows': len(trial_set['windows']),
+                'meeting_windows': sum(window['speaker'] is None for window in trial_set['windows']),
+                'trials': int(len(trial_set['labels'])),
+                'target_trials': int(trial_set['labels'].sum()),
+                'vad_skipped_windows': trial_set['vad_skipped_windows'],
+                'fastest_within_budget': fastest,
+                'models': results
+            }, f, indent=2)
+        print(f"[SUCCESS] Saved quantization evaluation to {output_path}")
+
+if __name__ == "__main__":
+    main()
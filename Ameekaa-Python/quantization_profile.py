@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Profile ECAPA quantization per node and emit a mixed-precision model.
+
+1. Latency: ONNX Runtime profiling of the fp32 model and of the fully
+   quantized model over speech windows gives every quantizable node's kernel
+   time. In the quantized model the node's Quantize/Dequantize and rescaling
+   nodes are charged to it, so gain_ms is what quantizing the node saves.
+2. Error: every node is quantized on its own and the window and enrollment
+   embeddings are compared with fp32 (cosine, and mean |score change| over all
+   window x speaker pairs).
+3. Mixed precision: nodes whose quantized kernel is not faster are kept in
+   fp32 first, the rest in order of score error per ms saved. The number of
+   fp32 nodes is bisected until the model meets the accuracy budget
+   (--min-cosine, --max-eer-increase, --min-agreement on the quantization_eval
+   speaker trials), and that model is written by quantizing the remaining
+   nodes (nodes_to_quantize).
+4. Latency objective (--max-latency-ms): every fp32 node added costs time,
+   so the fewest fp32 nodes within the accuracy budget is also the fastest
+   candidate. If even the fully quantized model misses the objective the
+   search stops there; if the chosen model misses it, no model meets both.
+   Either way the report has latency_objective_met false, no model is written
+   in the first case, and the script exits with status 1.
+
+Results are grouped by ECAPA layer (blocks.N/res2net_block, blocks.N/se_block,
+mfa, asp, fc) in the report.
+"""
+import os
+import sys
+import glob
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+import numpy as np
+from pathlib import Path
+from collections import defaultdict
+from typing import Dict, Any, List, Optional, Tuple
+
+import onnx
+from onnxruntime.quantization import CalibrationMethod
+
+from run_dynamic_quantized_diarization import load_config
+from enrollment_dynamic_quantize import (
+    DynamicQuantizedDiarizationError, build_session_options, clear_registry, session_options_from_config
+)
+from ecapa_onnx_quantization import AudioCalibrationDataReader, quantize_dynamic_ecapa, quantize_static_ecapa
+from quantization_eval import build_trials, embed_features, evaluate_models, format_table
+
+logger = logging.getLogger(__name__)
+
+QDQ_SUFFIXES = ('_QuantizeLinear', '_DequantizeLinear')
+
+def quantizable_nodes(model_path: str, op_types: List[str]) -> List[Dict[str, Any]]:
+    model = onnx.load(model_path, load_external_data=False)
+    return [{'name': node.name, 'op_type': node.op_type, 'inputs': list(node.input)}
+            for node in model.graph.node if node.op_type in op_types]
+
+def layer_of(node_name: str) -> str:
+    # '/blocks.2/res2net_block/blocks.4/conv/conv/Conv' -> 'blocks.2/res2net_block'
+    parts = node_name.strip('/').split('/')[:-1] or [node_name]
+    return '/'.join(parts[:2]) if parts[0].startswith('blocks.') and len(parts) > 2 else parts[0]
+
+class QuantizationRunner:
+    """Writes ECAPA models with a chosen set of nodes quantized (static reuses one calibration)."""
+
+    def __init__(self, input_model: str, mode: str, work_dir: str, op_types: List[str],
+                 calibration_reader: Optional[AudioCalibrationDataReader] = None,
+                 calibrate_method: CalibrationMethod = CalibrationMethod.MinMax,
+                 percentile: float = 99.999, calibration_stride: Optional[int] = None):
+        self.input_model = input_model
+        self.mode = mode
+        self.work_dir = work_dir
+        self.op_types = op_types
+        self.calibration_reader = calibration_reader
+        self.calibrate_method = calibrate_method
+        self.percentile = percentile
+        self.calibration_stride = calibration_stride
+        self.calibration_cache = os.path.join(work_dir, 'calibration_cache.json')
+
+    def quantize(self, output_path: str, nodes: List[str]) -> str:
+        if not nodes:
+            # An empty nodes_to_quantize means every node to ONNX Runtime
+            shutil.copyfile(self.input_model, output_path)
+            return output_path
+        if self.mode == 'static':
+            success = quantize_static_ecapa(
+                self.input_model, output_path, self.calibration_reader,
+                calibrate_method=self.calibrate_method, percentile=self.percentile,
+                calibration_stride=self.calibration_stride, op_types_to_quantize=self.op_types,
+                nodes_to_quantize=nodes, calibration_cache_path=self.calibration_cache
+            )
+        else:
+            success = quantize_dynamic_ecapa(self.input_model, output_path, nodes_to_quantize=nodes)
+        if not success:
+            raise DynamicQuantizedDiarizationError(f"Quantization failed for {output_path}")
+        return output_path
+
+def profile_node_times(model_path: str, features: List[np.ndarray], targets: List[Dict[str, Any]],
+                       session_options: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, float], float]:
+    # Per target node ms per window from an ONNX Runtime profile, and the total
+    import onnxruntime as ort
+    consumers = defaultdict(list)
+    for node in targets:
+        for tensor in node['inputs']:
+            consumers[tensor].append(node['name'])
+    names = sorted((node['name'] for node in targets), key=len, reverse=True)
+
+    def owners(event_name: str) -> List[str]:
+        for name in names:
+            if event_name == name or event_name.startswith(name + '_'):
+                return [name]
+        for suffix in QDQ_SUFFIXES:
+            if event_name.endswith(suffix):
+                return consumers.get(event_name[:-len(suffix)], [])
+        return []
+
+    with tempfile.TemporaryDirectory(prefix='ecapa_profile_') as profile_dir:
+        sess_options, _ = build_session_options(session_options)
+        sess_options.enable_profiling = True
+        sess_options.profile_file_prefix = os.path.join(profile_dir, 'profile')
+        session = ort.InferenceSession(model_path, sess_options)
+        input_name = session.get_inputs()[0].name
+        for feats in features:
+            session.run(None, {input_name: feats[np.newaxis, ...]})
+        with open(session.end_profiling()) as f:
+            events = json.load(f)
+
+    node_times = defaultdict(float)
+    total = 0.0
+    for event in events:
+        if event.get('cat') != 'Node' or not event['name'].endswith('_kernel_time'):
+            continue
+        duration = event['dur'] / 1000 / len(features)
+        total += duration
+        owned_by = owners(event['name'][:-len('_kernel_time')])
+        for name in owned_by:
+            node_times[name] += duration / len(owned_by)
+    return dict(node_times), total
+
+def node_sensitivity(runner: QuantizationRunner, targets: List[Dict[str, Any]], reference: Dict[str, np.ndarray],
+                     window_features: List[np.ndarray], enrollment_features: List[np.ndarray],
+                     session_options: Optional[Dict[str, Any]] = None) -> Dict[str, Dict[str, float]]:
+    # Quantize one node at a time and compare embeddings and scores with fp32
+    results = {}
+    for index, node in enumerate(targets):
+        model_path = runner.quantize(os.path.join(runner.work_dir, f'node_{index}.onnx'), [node['name']])
+        windows, _ = embed_features(model_path, window_features, session_options)
+        speakers, _ = embed_features(model_path, enrollment_features, session_options)
+        clear_registry()
+        os.remove(model_path)
+        cosine = np.sum(windows * reference['windows'], axis=1)
+        score_delta = np.abs(windows @ speakers.T - reference['scores'])
+        results[node['name']] = {
+            'cosine_mean': float(cosine.mean()),
+            'cosine_min': float(cosine.min()),
+            'score_error': float(score_delta.mean()),
+            'score_error_max': float(score_delta.max())
+        }
+        logger.info(f"[{index + 1}/{len(targets)}] {node['name']}: score error {results[node['name']]['score_error']:.2e}, "
+                    f"cosine min {results[node['name']]['cosine_min']:.5f}")
+    return results
+
+def exclusion_order(nodes: List[Dict[str, Any]]) -> List[str]:
+    # Nodes that quantization does not speed up go first, then the highest
+    # score error per ms saved
+    slow = sorted((node for node in nodes if node['gain_ms'] <= 0), key=lambda node: -node['score_error'])
+    fast = sorted((node for node in nodes if node['gain_ms'] > 0), key=lambda node: -node['score_error'] / node['gain_ms'])
+    return [node['name'] for node in slow + fast]
+
+def within_budget(result: Dict[str, Any], reference: Dict[str, Any], min_cosine: float,
+                  max_eer_increase: float, min_agreement: float) -> bool:
+    return (result['cosine_mean'] >= min_cosine and result['eer'] - reference['eer'] <= max_eer_increase and
+            result['segment_agreement'] >= min_agreement)
+
+def search_mixed_precision(runner: QuantizationRunner, order: List[str], all_nodes: List[str], trial_set: Dict[str, Any],
+                           budget: Dict[str, float], threshold: float, p_target: float,
+                           session_options: Optional[Dict[str, Any]] = None,
+                           max_latency_ms: Optional[float] = None) -> Tuple[Optional[int], Dict[int, Dict[str, Any]]]:
+    # Smallest number of leading nodes of order kept in fp32 that meets the
+    # budget, by bisection (keeping every node in fp32 is the fp32 model).
+    # None when the fully quantized model already misses max_latency_ms:
+    # keeping nodes in fp32 only adds latency, so nothing can meet it.
+    scored = {}
+    evaluated = {}
+
+    def evaluate(n_excluded: int) -> bool:
+        if n_excluded not in evaluated:
+            excluded = set(order[:n_excluded])
+            name = f'exclude_{n_excluded}'
+            model_path = runner.quantize(os.path.join(runner.work_dir, f'{name}.onnx'),
+                                         [node for node in all_nodes if node not in excluded])
+            results = evaluate_models({'fp32': runner.input_model, name: model_path}, trial_set, 'fp32', threshold,
+                                      p_target, session_options, scored)
+            clear_registry()
+            result = results[name]
+            result['within_budget'] = within_budget(result, results['fp32'], **budget)
+            result['meets_latency'] = max_latency_ms is None or result['latency_p50_ms'] <= max_latency_ms
+            result['excluded_nodes'] = order[:n_excluded]
+            evaluated[n_excluded] = result
+            logger.info(f"{n_excluded} nodes in fp32: cosine {result['cosine_mean']:.5f}, "
+                        f"EER {result['eer'] * 100:.2f}% (fp32 {results['fp32']['eer'] * 100:.2f}%), "
+                        f"segment agreement {result['segment_agreement'] * 100:.1f}%, "
+                        f"p50 {result['latency_p50_ms']:.1f} ms -> {'ok' if result['within_budget'] else 'over budget'}")
+        return evaluated[n_excluded]['within_budget']
+
+    low, high = 0, len(order)
+    if evaluate(low):
+        return low, evaluated
+    if not evaluated[low]['meets_latency']:
+        logger.warning(f"Fully quantized model p50 {evaluated[low]['latency_p50_ms']:.1f} ms already misses the "
+                       f"{max_latency_ms:g} ms latency objective; stopping the search")
+        return None, evaluated
+    while high - low > 1:
+        middle = (low + high) // 2
+        if evaluate(middle):
+            high = middle
+        else:
+            low = middle
+    evaluate(high)
+    return high, evaluated
+
+def format_node_table(nodes: List[Dict[str, Any]]) -> str:
+    header = (f"{'node':<52} {'fp32 ms':>8} {'quant ms':>8} {'gain ms':>8} {'score err':>9} {'cos min':>8}  fp32")
+    lines = [header, '-' * len(header)]
+    for node in sorted(nodes, key=lambda node: -node['score_error']):
+        lines.append(f"{node['name']:<52} {node['fp32_ms']:>8.2f} {node['quantized_ms']:>8.2f} {node['gain_ms']:>+8.2f} "
+                     f"{node['score_error']:>9.2e} {node['cosine_min']:>8.5f}  {'yes' if node['excluded'] else ''}")
+    return '\n'.join(lines)
+
+def summarize_layers(nodes: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    layers = {}
+    for node in nodes:
+        layer = layers.setdefault(node['layer'], {'nodes': 0, 'fp32_ms': 0.0, 'quantized_ms': 0.0, 'gain_ms': 0.0,
+                                                  'score_error': 0.0, 'excluded': 0})
+        layer['nodes'] += 1
+        layer['excluded'] += int(node['excluded'])
+        for key in ('fp32_ms', 'quantized_ms', 'gain_ms', 'score_error'):
+            layer[key] += node[key]
+    return layers
+
+def format_layer_table(layers: Dict[str, Dict[str, float]]) -> str:
+    header = f"{'layer':<24} {'nodes':>5} {'fp32 ms':>8} {'quant ms':>8} {'gain ms':>8} {'score err':>9} {'in fp32':>7}"
+    lines = [header, '-' * len(header)]
+    for name, layer in layers.items():
+        lines.append(f"{name:<24} {layer['nodes']:>5} {layer['fp32_ms']:>8.2f} {layer['quantized_ms']:>8.2f} "
+                     f"{layer['gain_ms']:>+8.2f} {layer['score_error']:>9.2e} {layer['excluded']:>7}")
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile ECAPA quantization per node and emit a mixed-precision model")
+    parser.add_argument('--input-model', default='models/onnx/ecapa_model.onnx', help='fp32 ONNX model')
+    parser.add_argument('--mode', choices=['static', 'dynamic'], default='static', help='Quantization to profile')
+    parser.add_argument('--output-model', help='Mixed-precision model (default: models/onnx/ecapa_model_<mode>_mixed.onnx)')
+    parser.add_argument('--report', default='quantization_profile.json', help='Per-node / per-layer report JSON')
+    parser.add_argument('--audio', nargs='+', default=['test_data/*_speaker_enrollment.*', 'test_data/*_meeting_audio.*'],
+                        help='Speaker trial audio (see quantization_eval.py)')
+    parser.add_argument('--op-types', nargs='+', default=['Conv'], help='Operator types considered for quantization')
+    parser.add_argument('--sensitivity-windows', type=int, default=24,
+                        help='Speech windows used for per-node profiling and error')
+    parser.add_argument('--calibration-audio', nargs='+', default=['test_data/*_speaker_enrollment.wav'],
+                        help='Static calibration audio files or glob patterns')
+    parser.add_argument('--calibration-samples', type=int, default=100, help='Number of calibration clips')
+    parser.add_argument('--clip-duration', type=float, default=2.0, help='Calibration clip length in seconds')
+    parser.add_argument('--calibration-method', choices=['minmax', 'entropy', 'percentile'], default='minmax',
+                        help='Activation range calibration')
+    parser.add_argument('--percentile', type=float, default=99.999, help='Percentile for --calibration-method percentile')
+    parser.add_argument('--calibration-stride', type=int, default=10, help='Calibration clips per range update')
+    parser.add_argument('--min-cosine', type=float, default=0.999,
+                        help='Accuracy budget: minimum mean window-embedding cosine to fp32')
+    parser.add_argument('--max-eer-increase', type=float, default=0.01,
+                        help='Accuracy budget: allowed absolute EER increase over fp32')
+    parser.add_argument('--min-agreement', type=float, default=0.98,
+                        help='Accuracy budget: minimum segment-level agreement with fp32')
+    parser.add_argument('--max-latency-ms', type=float,
+                        help='p50 latency objective for the mixed model (exit 1 if not met)')
+    parser.add_argument('--config', help='Configuration JSON file')
+    parser.add_argument('--threshold', type=float, help='Decision threshold (default: config default_threshold)')
+    parser.add_argument('--p-target', type=float, default=0.01, help='Target prior for minDCF')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = load_config(args.config)
+    threshold = args.threshold if args.threshold is not None else config['default_threshold']
+    session_options = session_options_from_config(config)
+    output_model = args.output_model or f'models/onnx/ecapa_model_{args.mode}_mixed.onnx'
+    if not os.path.exists(args.input_model):
+        raise DynamicQuantizedDiarizationError(f"Input model not found: {args.input_model}")
+
+    trial_set = build_trials(sorted({path for pattern in args.audio for path in glob.glob(pattern)}), config)
+    window_count = len(trial_set['window_features'])
+    picked = np.linspace(0, window_count - 1, min(args.sensitivity_windows, window_count)).astype(int)
+    window_features = [trial_set['window_features'][index] for index in picked]
+    targets = quantizable_nodes(args.input_model, args.op_types)
+    if not targets:
+        raise DynamicQuantizedDiarizationError(f"No {', '.join(args.op_types)} nodes in {args.input_model}")
+    all_nodes = [node['name'] for node in targets]
+
+    calibration_reader = None
+    if args.mode == 'static':
+        calibration_paths = sorted({path for pattern in args.calibration_audio for path in glob.glob(pattern)})
+        if not calibration_paths:
+            raise DynamicQuantizedDiarizationError("No calibration audio found")
+        calibration_reader = AudioCalibrationDataReader(calibration_paths, num_samples=args.calibration_samples,
+                                                        clip_duration=args.clip_duration)
+
+    with tempfile.TemporaryDirectory(prefix='ecapa_mixed_') as work_dir:
+        runner = QuantizationRunner(
+            args.input_model, args.mode, work_dir, args.op_types, calibration_reader,
+            calibrate_method={'minmax': CalibrationMethod.MinMax, 'entropy': CalibrationMethod.Entropy,
+                              'percentile': CalibrationMethod.Percentile}[args.calibration_method],
+            percentile=args.percentile, calibration_stride=args.calibration_stride
+        )
+        # Fully quantized model (also fills the static calibration cache)
+        full_model = runner.quantize(os.path.join(work_dir, 'full.onnx'), all_nodes)
+
+        logger.info(f"Profiling {len(targets)} {'/'.join(args.op_types)} nodes on {len(window_features)} windows")
+        fp32_times, fp32_total = profile_node_times(args.input_model, window_features, targets, session_options)
+        quantized_times, quantized_total = profile_node_times(full_model, window_features, targets, session_options)
+        logger.info(f"Profiled model time per window: fp32 {fp32_total:.1f} ms, {args.mode} {quantized_total:.1f} ms")
+
+        reference_windows, _ = embed_features(args.input_model, window_features, session_options)
+        reference_speakers, _ = embed_features(args.input_model, trial_set['enrollment_features'], session_options)
+        sensitivity = node_sensitivity(runner, targets, {
+            'windows': reference_windows, 'scores': reference_windows @ reference_speakers.T
+        }, window_features, trial_set['enrollment_features'], session_options)
+
+        nodes = []
+        for node in targets:
+            nodes.append({
+                'name': node['name'],
+                'op_type': node['op_type'],
+                'layer': layer_of(node['name']),
+                'fp32_ms': fp32_times.get(node['name'], 0.0),
+                'quantized_ms': quantized_times.get(node['name'], 0.0),
+                'gain_ms': fp32_times.get(node['name'], 0.0) - quantized_times.get(node['name'], 0.0),
+                **sensitivity[node['name']]
+            })
+        order = exclusion_order(nodes)
+        budget = {'min_cosine': args.min_cosine, 'max_eer_increase': args.max_eer_increase,
+                  'min_agreement': args.min_agreement}
+        n_excluded, evaluated = search_mixed_precision(runner, order, all_nodes, trial_set, budget, threshold,
+                                                       args.p_target, session_options, args.max_latency_ms)
+        excluded = set(order[:n_excluded]) if n_excluded is not None else set()
+        for node in nodes:
+            node['excluded'] = node['name'] in excluded
+
+        models = {'fp32': args.input_model, f'{args.mode}_full': full_model}
+        if n_excluded is not None:
+            Path(output_model).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(os.path.join(work_dir, f'exclude_{n_excluded}.onnx'), output_model)
+            models[f'{args.mode}_mixed'] = output_model
+        comparison = evaluate_models(models, trial_set, 'fp32', threshold, args.p_target, session_options)
+        clear_registry()
+    for name, result in comparison.items():
+        result['within_budget'] = within_budget(result, comparison['fp32'], **budget)
+    mixed = comparison.get(f'{args.mode}_mixed')
+    if mixed is None:
+        latency_met = False
+    else:
+        latency_met = args.max_latency_ms is None or mixed['latency_p50_ms'] <= args.max_latency_ms
+
+    layers = summarize_layers(nodes)
+    print(format_node_table(nodes))
+    print()
+    print(format_layer_table(layers))
+    print()
+    print(format_table(comparison, 'fp32'))
+    if n_excluded is not None:
+        print(f"{n_excluded} of {len(nodes)} nodes kept in fp32; mixed-precision model saved to {output_model}")
+    if not latency_met:
+        p50 = (mixed or comparison[f'{args.mode}_full'])['latency_p50_ms']
+        print(f"[ERROR] Latency objective not met: {'mixed' if mixed else 'fully quantized'} model p50 {p50:.1f} ms "
+              f"> {args.max_latency_ms:g} ms"
+              + ("" if mixed else "; no mixed-precision model written"))
+
+    report_path = Path(args.report)
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump({
+            'input_model': args.input_model,
+            'mode': args.mode,
+            'op_types': args.op_types,
+            'budget': budget,
+            'max_latency_ms': args.max_latency_ms,
+            'latency_objective_met': latency_met,
+            'profiled_ms_per_window': {'fp32': fp32_total, args.mode: quantized_total},
+            'nodes': nodes,
+            'layers': layers,
+            'exclusion_order': order,
+            'search': {str(n): {key: value for key, value in result.items() if key != 'model_path'}
+                       for n, result in sorted(evaluated.items())},
+            'output_model': output_model if n_excluded is not None else None,
+            'comparison': comparison
+        }, f, indent=2)
+    print(f"[SUCCESS] Saved quantization profile to {report_path}")
+    if not latency_met:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
+import time
+# Captured before the heavy imports below so start-up latency includes them
+PROCESS_START_TIME = time.time()
+
 import argparse
 import logging
 import json
 from datetime import datetime
 from pathlib import Path
 
-from enrollment_dynamic_quantize import enroll_speaker, DynamicQuantizedAudioProcessor, DynamicQuantizedDiarizationError
+from enrollment_dynamic_quantize import (
+    get_audio_processor, session_options_from_config, DEFAULT_SESSION_OPTIONS, DynamicQuantizedDiarizationError
+)
 from diarization_dynamic_quantize import DynamicQuantizedDiarizationEngine
+from speaker_store import SpeakerEmbeddingStore, load_or_enroll_speaker
 
 def load_config(config_path=None):
     default_config = {
@@ -14,8 +21,29 @@ def load_config(config_path=None):
         'segment_step': 2.0,
         'min_segment_ratio': 0.5,
         'default_threshold': 0.6,
+        'batch_size': 1,
+        'whole_file_features': False,
+        'stream_block_duration': 10.0,
+        'stream_latency_budget_ms': 500.0,
+        'audio_cache_mb': 512,
+        'vad_enabled': False,
+        'vad_energy_threshold': -45.0,
+        'vad_min_active_ratio': 0.1,
+        'vad_min_energy_range': 3.0,
+        'vad_min_flux': 0.05,
+        'coarse_to_fine': False,
+        'fine_step': 0.5,
+        'refine_margin': 0.1,
+        'speaker_turns': False,
+        'turn_hysteresis': 0.05,
+        'min_turn_duration': 0.0,
+        'max_turn_gap': 0.0,
+        'speaker_store_dir': None,
+        'benchmark_model': False,
+        'frontend': 'torch',                  # log-mel front-end: torch | numpy
         'model_path': 'models/onnx/ecapa_model_dynamic_quantized.onnx'
     }
+    default_config.update(DEFAULT_SESSION_OPTIONS)
     if config_path:
         try:
             with open(config_path, 'r') as f:
@@ -36,21 +64,183 @@ def save_results(results, output_dir, speaker_name):
     except Exception as e:
         print(f"Warning: Failed to save results: {str(e)}")
 
+def open_speaker_store(config):
+    if not config.get('speaker_store_dir'):
+        return None
+    return SpeakerEmbeddingStore(config['speaker_store_dir'])
+
+def audio_cache_bytes(config):
+    return int(config['audio_cache_mb'] * 1024 * 1024)
+
+def get_performance_with_startup(engine):
+    performance = engine.get_performance_summary()
+    first_window_time = performance.pop('first_window_time', None)
+    performance['cold_start_to_first_segment'] = (
+        first_window_time - PROCESS_START_TIME if first_window_time is not None else 0.0
+    )
+    return performance
+
+def run_single_speaker(args, config):
+    enroll_path = args.enroll[0]
+    speaker_name = args.name[0]
+    # Enrollment
+    enrollment_embedding = load_or_enroll_speaker(
+        open_speaker_store(config), speaker_name, enroll_path, config['model_path'], config['sample_rate'],
+        session_options_from_config(config), config['frontend']
+    )
+    # Diarization
+    audio_processor = get_audio_processor(config['model_path'], config['sample_rate'], config['benchmark_model'],
+                                          session_options_from_config(config), audio_cache_bytes(config),
+                                          config['frontend'])
+    engine = DynamicQuantizedDiarizationEngine(config['model_path'], config, audio_processor)
+    turns = None
+    if config['speaker_turns']:
+        turns = engine.diarize_meeting_turns(
+            args.meeting,
+            enrollment_embedding,
+            speaker_name,
+            config['default_threshold'],
+            stream=args.stream,
+            block_duration=config['stream_block_duration']
+        )
+        segments = [(turn['start'], turn['end']) for turn in turns]
+    elif args.stream:
+        segments = list(engine.diarize_meeting_stream(
+            args.meeting,
+            enrollment_embedding,
+            speaker_name,
+            config['default_threshold'],
+            config['stream_block_duration']
+        ))
+    else:
+        segments = engine.diarize_meeting(
+            args.meeting,
+            enrollment_embedding,
+            speaker_name,
+            config['default_threshold']
+        )
+    # Extract segments
+    success = engine.extract_segments(args.meeting, segments, args.output)
+    if success:
+        performance = get_performance_with_startup(engine)
+        results = {
+            'speaker_name': speaker_name,
+            'enrollment_file': enroll_path,
+            'meeting_file': args.meeting,
+            'output_file': args.output,
+            'threshold': config['default_threshold'],
+            'model_type': 'dynamic_quantized',
+            'model_path': config['model_path'],
+            'segments': segments,
+            'turns': turns,
+            'total_segments': len(segments),
+            'total_duration': sum(end - start for start, end in segments),
+            'performance': performance,
+            'timestamp': datetime.now().isoformat(),
+            'config': config
+        }
+        save_results(results, args.results_dir, speaker_name)
+        print("=" * 70)
+        print(f"[SUCCESS] Extracted {len(segments)} segments for speaker: {speaker_name}")
+        print(f"[SUCCESS] Total processing time: {performance['enrollment_time'] + performance['diarization_time']:.2f}s")
+        print(f"[SUCCESS] Average inference time: {performance['avg_inference_time_per_segment']*1000:.1f}ms")
+        print(f"[SUCCESS] Cold start to first segment: {performance['cold_start_to_first_segment']:.2f}s")
+        print("=" * 70)
+    else:
+        print("No segments were extracted.")
+
+def run_multi_speaker(args, config):
+    if args.stream:
+        print("Warning: --stream is not supported with several speakers; loading the meeting into memory")
+    # Enrollment
+    store = open_speaker_store(config)
+    enrollment_embeddings = {
+        speaker_name: load_or_enroll_speaker(store, speaker_name, enroll_path, config['model_path'], config['sample_rate'],
+                                             session_options_from_config(config), config['frontend'])
+        for enroll_path, speaker_name in zip(args.enroll, args.name)
+    }
+    # Diarization: one embedding pass over the meeting, scored against every speaker
+    audio_processor = get_audio_processor(config['model_path'], config['sample_rate'], config['benchmark_model'],
+                                          session_options_from_config(config), audio_cache_bytes(config),
+                                          config['frontend'])
+    engine = DynamicQuantizedDiarizationEngine(config['model_path'], config, audio_processor)
+    timeline = engine.diarize_meeting_multi(
+        args.meeting,
+        enrollment_embeddings,
+        config['default_threshold']
+    )
+    # Extract segments per speaker
+    output_dir = Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    speakers = {}
+    for enroll_path, speaker_name in zip(args.enroll, args.name):
+        segments = [(turn['start'], turn['end']) for turn in timeline if turn['speaker'] == speaker_name]
+        output_file = output_dir / f"{speaker_name}_dynamic_segments.wav"
+        success = engine.extract_segments(args.meeting, segments, str(output_file)) if segments else False
+        speakers[speaker_name] = {
+            'enrollment_file': enroll_path,
+            'output_file': str(output_file) if success else None,
+            'segments': segments,
+            'total_segments': len(segments),
+            'total_duration': sum(end - start for start, end in segments)
+        }
+        print(f"[SUCCESS] {speaker_name}: {len(segments)} segments" if success else f"No segments were extracted for {speaker_name}.")
+    performance = get_performance_with_startup(engine)
+    results = {
+        'speaker_names': args.name,
+        'meeting_file': args.meeting,
+        'output_dir': str(output_dir),
+        'threshold': config['default_threshold'],
+        'model_type': 'dynamic_quantized',
+        'model_path': config['model_path'],
+        'timeline': timeline,
+        'speakers': speakers,
+        'total_segments': len(timeline),
+        'performance': performance,
+        'timestamp': datetime.now().isoformat(),
+        'config': config
+    }
+    save_results(results, args.results_dir, 'multi_speaker')
+    print("=" * 70)
+    print(f"[SUCCESS] Assigned {len(timeline)} segments across {len(args.name)} speakers")
+    print(f"[SUCCESS] Total processing time: {performance['enrollment_time'] + performance['diarization_time']:.2f}s")
+    print(f"[SUCCESS] Average inference time: {performance['avg_inference_time_per_segment']*1000:.1f}ms")
+    print(f"[SUCCESS] Cold start to first segment: {performance['cold_start_to_first_segment']:.2f}s")
+    print("=" * 70)
+
 def main():
     parser = argparse.ArgumentParser(
         description="Run Dynamic Quantized ECAPA Speaker Enrollment and Diarization",
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
-    parser.add_argument('--enroll', required=True, help='Enrollment audio file (WAV)')
+    parser.add_argument('--enroll', action='append', help='Enrollment audio file (WAV); repeat with --name for multi-speaker diarization. Optional for speakers already in --speaker-store')
     parser.add_argument('--meeting', required=True, help='Meeting audio file (WAV)')
-    parser.add_argument('--output', required=True, help='Output WAV file for extracted segments')
-    parser.add_argument('--name', required=True, help='Speaker name (for labeling)')
+    parser.add_argument('--output', required=True, help='Output WAV file for extracted segments (output directory with several speakers)')
+    parser.add_argument('--name', required=True, action='append', help='Speaker name (for labeling); one per --enroll')
     parser.add_argument('--model', help='Dynamic quantized ECAPA ONNX model path')
     parser.add_argument('--threshold', type=float, help='Similarity threshold (0.0-1.0)')
+    parser.add_argument('--batch-size', type=int, help='Number of windows per ONNX batch (1 = per-window inference)')
+    parser.add_argument('--whole-file-features', action='store_true', help='Compute log-mel features once per meeting and slice windows from it')
+    parser.add_argument('--stream', action='store_true', help='Read the meeting block by block instead of loading it into memory')
+    parser.add_argument('--vad', action='store_true', help='Skip non-speech windows before embedding (energy / flux VAD)')
+    parser.add_argument('--speaker-turns', action='store_true', help='Merge matched windows into speaker turns with hysteresis')
+    parser.add_argument('--speaker-store', help='Directory of the persistent speaker embedding store (look up / save enrollments by name)')
+    parser.add_argument('--frontend', choices=['torch', 'numpy'], help='Log-mel front-end (numpy avoids importing torch)')
+    parser.add_argument('--benchmark', action='store_true', help='Benchmark the ONNX model at start-up (8 dummy inferences)')
+    parser.add_argument('--intra-op-threads', type=int, help='ONNX Runtime intra-op thread count (0 = automatic)')
+    parser.add_argument('--inter-op-threads', type=int, help='ONNX Runtime inter-op thread count (0 = automatic)')
+    parser.add_argument('--graph-optimization', choices=['disable', 'basic', 'extended', 'all'], help='ONNX Runtime graph optimization level')
+    parser.add_argument('--execution-mode', choices=['sequential', 'parallel'], help='ONNX Runtime execution mode')
+    parser.add_argument('--disable-mem-arena', action='store_true', help='Disable the ONNX Runtime CPU memory arena')
+    parser.add_argument('--optimized-model', help='Save the optimized ONNX graph here and reuse it on later runs')
     parser.add_argument('--config', help='Configuration JSON file')
     parser.add_argument('--results-dir', default='diarization_output', help='Directory for results')
     parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose logging')
     args = parser.parse_args()
+    if args.enroll and len(args.enroll) != len(args.name):
+        parser.error('--enroll and --name must be given the same number of times')
+    if len(set(args.name)) != len(args.name):
+        parser.error('speaker names must be unique')
 
     if args.verbose:
         logging.basicConfig(level=logging.DEBUG)
@@ -66,46 +256,39 @@ def main():
             config['model_path'] = args.model
         if args.threshold:
             config['default_threshold'] = args.threshold
-        # Enrollment
-        enrollment_embedding = enroll_speaker(
-            args.enroll, args.name, config['model_path'], config['sample_rate']
-        )
-        # Diarization
-        audio_processor = DynamicQuantizedAudioProcessor(config['model_path'], config['sample_rate'])
-        engine = DynamicQuantizedDiarizationEngine(config['model_path'], config, audio_processor)
-        segments = engine.diarize_meeting(
-            args.meeting,
-            enrollment_embedding,
-            args.name,
-            config['default_threshold']
-        )
-        # Extract segments
-        success = engine.extract_segments(args.meeting, segments, args.output)
-        if success:
-            performance = engine.get_performance_summary()
-            results = {
-                'speaker_name': args.name,
-                'enrollment_file': args.enroll,
-                'meeting_file': args.meeting,
-                'output_file': args.output,
-                'threshold': config['default_threshold'],
-                'model_type': 'dynamic_quantized',
-                'model_path': config['model_path'],
-                'segments': segments,
-                'total_segments': len(segments),
-                'total_duration': sum(end - start for start, end in segments),
-                'performance': performance,
-                'timestamp': datetime.now().isoformat(),
-                'config': config
-            }
-            save_results(results, args.results_dir, args.name)
-            print("=" * 70)
-            print(f"[SUCCESS] Extracted {len(segments)} segments for speaker: {args.name}")
-            print(f"[SUCCESS] Total processing time: {performance['enrollment_time'] + performance['diarization_time']:.2f}s")
-            print(f"[SUCCESS] Average inference time: {performance['avg_inference_time_per_segment']*1000:.1f}ms")
-            print("=" * 70)
+        if args.batch_size:
+            config['batch_size'] = args.batch_size
+        if args.whole_file_features:
+            config['whole_file_features'] = True
+        if args.intra_op_threads is not None:
+            config['intra_op_num_threads'] = args.intra_op_threads
+        if args.inter_op_threads is not None:
+            config['inter_op_num_threads'] = args.inter_op_threads
+        if args.graph_optimization:
+            config['graph_optimization_level'] = args.graph_optimization
+        if args.execution_mode:
+            config['execution_mode'] = args.execution_mode
+        if args.disable_mem_arena:
+            config['enable_cpu_mem_arena'] = False
+        if args.optimized_model:
+            config['optimized_model_path'] = args.optimized_model
+        if args.frontend:
+            config['frontend'] = args.frontend
+        if args.benchmark:
+            config['benchmark_model'] = True
+        if args.speaker_store:
+            config['speaker_store_dir'] = args.speaker_store
+        if args.vad:
+            config['vad_enabled'] = True
+        if args.speaker_turns:
+            config['speaker_turns'] = True
+        if not args.enroll and not config['speaker_store_dir']:
+            parser.error('--enroll is required unless --speaker-store is given')
+        args.enroll = args.enroll or [None] * len(args.name)
+        if len(args.name) > 1:
+            run_multi_speaker(args, config)
         else:
-            print("No segments were extracted.")
+            run_single_speaker(args, config)
     except DynamicQuantizedDiarizationError as e:
         print(f"[ERROR] Dynamic quantized diarization failed: {str(e)}")
     except KeyboardInterrupt:
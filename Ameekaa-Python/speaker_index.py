@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+In-memory index of enrolled speaker embeddings for window-to-speaker search.
+
+Enrollments are L2-normalized once into a contiguous float32 matrix (or int8
+codes with a per-row scale, a quarter of the memory), so scoring a batch of
+windows against every speaker is a single GEMM followed by a top-k
+selection. For large galleries an optional IVF index (spherical k-means
+coarse quantizer, pure NumPy) restricts each query to the n_probe closest
+clusters.
+"""
+import logging
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+from enrollment_dynamic_quantize import DynamicQuantizedDiarizationError
+
+logger = logging.getLogger(__name__)
+
+class SpeakerIndexError(DynamicQuantizedDiarizationError):
+    pass
+
+def l2_normalize(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return embeddings / (np.linalg.norm(embeddings, axis=-1, keepdims=True) + 1e-8)
+
+def _top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        indices = np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+    top_scores = np.take_along_axis(scores, indices, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+class SpeakerEmbeddingIndex:
+    # Rows scored per GEMM; bounds the temporary score matrix for huge galleries
+    CHUNK_ROWS = 65536
+    # int8 rows dequantized at a time, so scoring never materializes the
+    # float32 matrix the int8 mode exists to avoid
+    DEQUANTIZE_ROWS = 4096
+
+    def __init__(self, names: List[str], embeddings: np.ndarray, dtype: str = 'float32'):
+        if dtype not in ('float32', 'int8'):
+            raise SpeakerIndexError(f"Unsupported index dtype: {dtype}")
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(names), -1)
+        if len(set(names)) != len(names):
+            raise SpeakerIndexError("Speaker names must be unique")
+        self.names = list(names)
+        self.dtype = dtype
+        self.dim = embeddings.shape[1]
+        normalized = l2_normalize(embeddings)
+        if dtype == 'int8':
+            self.scales = np.maximum(np.abs(normalized).max(axis=1), 1e-8).astype(np.float32) / 127.0
+            self.matrix = np.ascontiguousarray(np.round(normalized / self.scales[:, np.newaxis]).astype(np.int8))
+        else:
+            self.scales = None
+            self.matrix = np.ascontiguousarray(normalized)
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+
+    @classmethod
+    def from_embeddings(cls, embeddings: Dict[str, np.ndarray], dtype: str = 'float32') -> 'SpeakerEmbeddingIndex':
+        names = list(embeddings)
+        if not names:
+            raise SpeakerIndexError("No speaker embeddings given")
+        return cls(names, np.stack([np.asarray(embeddings[name]).reshape(-1) for name in names]), dtype)
+
+    @classmethod
+    def from_store(cls, store, model_path: str, dtype: str = 'float32') -> 'SpeakerEmbeddingIndex':
+        from speaker_store import file_hash
+        model_hash = file_hash(model_path)
+        entries = [entry for entry in store.index.values() if entry['model_hash'] == model_hash]
+        if not entries:
+            raise SpeakerIndexError(f"No speakers enrolled with {model_path} in {store.store_dir}")
+        rows = np.array([entry['row'] for entry in entries])
+        return cls([entry['name'] for entry in entries], np.asarray(store.embeddings[rows]), dtype)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def _vectors(self, rows) -> np.ndarray:
+        # Float32 (dequantized) embeddings of the given rows (slice or indices)
+        if self.dtype == 'int8':
+            return self.matrix[rows].astype(np.float32) * self.scales[rows, np.newaxis]
+        return self.matrix[rows]
+
+    def _scores(self, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        if self.dtype != 'int8':
+            return queries @ (self.matrix if rows is None else self.matrix[rows]).T
+        n_rows = len(self) if rows is None else len(rows)
+        scores = np.empty((len(queries), n_rows), dtype=np.float32)
+        for offset in range(0, n_rows, self.DEQUANTIZE_ROWS):
+            chunk = slice(offset, min(offset + self.DEQUANTIZE_ROWS, n_rows))
+            chunk_rows = chunk if rows is None else rows[chunk]
+            scores[:, chunk] = (queries @ self.matrix[chunk_rows].T.astype(np.float32)) * self.scales[chunk_rows]
+        return scores
+
+    def search_exact(self, queries: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        queries = l2_normalize(np.atleast_2d(queries))
+        if len(self) <= self.CHUNK_ROWS:
+            return _top_k(self._scores(queries), k)
+        best_indices = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for offset in range(0, len(self), self.CHUNK_ROWS):
+            rows = np.arange(offset, min(offset + self.CHUNK_ROWS, len(self)))
+            chunk_indices, chunk_scores = _top_k(self._scores(queries, rows), k)
+            merged_indices, merged_scores = _top_k(np.hstack([best_scores, chunk_scores]), k)
+            best_indices = np.take_along_axis(np.hstack([best_indices, rows[chunk_indices]]), merged_indices, axis=1)
+            best_scores = merged_scores
+        return best_indices, best_scores
+
+    def build_ivf(self, n_lists: Optional[int] = None, n_iter: int = 10, sample_size: int = 50000,
+                  seed: int = 0) -> None:
+        n_lists = n_lists or max(1, int(np.sqrt(len(self))))
+        rng = np.random.default_rng(seed)
+        sample = self._vectors(rng.choice(len(self), min(sample_size, len(self)), replace=False))
+        centroids = sample[rng.choice(len(sample), min(n_lists, len(sample)), replace=False)]
+        for _ in range(n_iter):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(len(centroids)):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            centroids = l2_normalize(centroids)
+        assignment = np.concatenate([np.argmax(self._vectors(slice(i, i + self.CHUNK_ROWS)) @ centroids.T, axis=1)
+                                     for i in range(0, len(self), self.CHUNK_ROWS)])
+        self.centroids = centroids
+        self.lists = [np.flatnonzero(assignment == c) for c in range(len(centroids))]
+        logger.info(f"[SUCCESS] Built IVF index: {len(centroids)} lists over {len(self)} speakers")
+
+    def search_ivf(self, queries: np.ndarray, k: int = 1, n_probe: int = 8) -> Tuple[np.ndarray, np.ndarray]:
+        if self.centroids is None:
+            raise SpeakerIndexError("IVF index not built; call build_ivf() first")
+        queries = l2_normalize(np.atleast_2d(queries))
+        probes, _ = _top_k(queries @ self.centroids.T, n_probe)
+        best_indices = np.full((len(queries), k), -1, dtype=np.int64)
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        # One GEMM per probed list, over the queries that probe it
+        for c in np.unique(probes):
+            query_rows = np.flatnonzero((probes == c).any(axis=1))
+            rows = self.lists[c]
+            if not len(rows):
+                continue
+            list_indices, list_scores = _top_k(self._scores(queries[query_rows], rows), k)
+            merged_indices, merged_scores = _top_k(np.hstack([best_scores[query_rows], list_scores]), k)
+            candidates = np.hstack([best_indices[query_rows], rows[list_indices]])
+            pad = k - merged_indices.shape[1]
+            best_indices[query_rows] = np.pad(np.take_along_axis(candidates, merged_indices, axis=1), ((0, 0), (0, pad)), constant_values=-1)
+            best_scores[query_rows] = np.pad(merged_scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+        return best_indices, best_scores
+
+    def search(self, queries: np.ndarray, k: int = 1, n_probe: int = 8) -> Tuple[np.ndarray, np.ndarray]:
+        # Uses the approximate index once one has been built
+        if self.centroids is not None:
+            return self.search_ivf(queries, k, n_probe)
+        return self.search_exact(queries, k)
+
+    def top_k(self, queries: np.ndarray, k: int = 1, n_probe: int = 8) -> List[List[Tuple[str, float]]]:
+        indices, scores = self.search(queries, k, n_probe)
+        return [[(self.names[i], float(score)) for i, score in zip(row_indices, row_scores) if i >= 0]
+                for row_indices, row_scores in zip(indices, scores)]
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Persistent on-disk store of speaker enrollment embeddings.
+
+Embeddings live in a float32 matrix (embeddings.npy, memory-mapped on read)
+next to a JSON index with one entry per speaker: name, row, enrollment file
+hash, model hash and enrollment date. An entry is only returned while both the
+ONNX model and the enrollment audio it was computed from are unchanged.
+"""
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from enrollment_dynamic_quantize import enroll_speaker, DynamicQuantizedDiarizationError
+
+logger = logging.getLogger(__name__)
+
+class SpeakerStoreError(DynamicQuantizedDiarizationError):
+    pass
+
+_hash_cache: Dict[str, Any] = {}
+
+def file_hash(path: str) -> str:
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    cached = _hash_cache.get(key)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    _hash_cache[key] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+    return digest.hexdigest()
+
+class SpeakerEmbeddingStore:
+    EMBEDDINGS_FILE = 'embeddings.npy'
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, store_dir: str):
+        self.store_dir = Path(store_dir)
+        self.embeddings_path = self.store_dir / self.EMBEDDINGS_FILE
+        self.index_path = self.store_dir / self.INDEX_FILE
+        self._embeddings = None
+        self.index: Dict[str, Dict[str, Any]] = {}
+        try:
+            if self.index_path.exists():
+                with open(self.index_path, 'r') as f:
+                    self.index = json.load(f)
+            logger.info(f"[SUCCESS] Loaded speaker store: {self.store_dir} ({len(self.index)} speakers)")
+        except Exception as e:
+            raise SpeakerStoreError(f"Failed to load speaker store {self.store_dir}: {str(e)}")
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        if self._embeddings is None:
+            if self.embeddings_path.exists():
+                self._embeddings = np.load(self.embeddings_path, mmap_mode='r')
+            else:
+                self._embeddings = np.zeros((0, 0), dtype=np.float32)
+        return self._embeddings
+
+    def names(self) -> List[str]:
+        return list(self.index)
+
+    def is_valid(self, name: str, model_path: str, enrollment_path: Optional[str] = None) -> bool:
+        entry = self.index.get(name)
+        if entry is None:
+            return False
+        if entry['model_hash'] != file_hash(model_path):
+            logger.info(f"Speaker '{name}' was enrolled with a different model; re-enrollment required")
+            return False
+        source = enrollment_path or entry['source_file']
+        if not os.path.exists(source):
+            # The original recording may have been moved; the model check still holds
+            return enrollment_path is None
+        if entry['source_hash'] != file_hash(source):
+            logger.info(f"Enrollment audio for '{name}' changed; re-enrollment required")
+            return False
+        return True
+
+    def get(self, name: str, model_path: str, enrollment_path: Optional[str] = None) -> Optional[np.ndarray]:
+        try:
+            if not self.is_valid(name, model_path, enrollment_path):
+                return None
+            return np.array(self.embeddings[self.index[name]['row']], dtype=np.float32)
+        except Exception as e:
+            raise SpeakerStoreError(f"Failed to read speaker '{name}' from store: {str(e)}")
+
+    def put(self, name: str, embedding: np.ndarray, enrollment_path: str, model_path: str) -> None:
+        try:
+            embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+            matrix = np.array(self.embeddings, dtype=np.float32)
+            if matrix.size and matrix.shape[1] != embedding.shape[0]:
+                raise SpeakerStoreError(f"Embedding size {embedding.shape[0]} does not match store ({matrix.shape[1]})")
+            if name in self.index:
+                row = self.index[name]['row']
+                matrix[row] = embedding
+            else:
+                row = matrix.shape[0]
+                matrix = np.vstack([matrix.reshape(-1, embedding.shape[0]), embedding[np.newaxis, :]])
+            self.index[name] = {
+                'name': name,
+                'row': row,
+                'source_file': str(enrollment_path),
+                'source_hash': file_hash(enrollment_path),
+                'model_path': str(model_path),
+                'model_hash': file_hash(model_path),
+                'enrolled_at': datetime.now().isoformat()
+            }
+            self._write(matrix)
+            logger.info(f"[SUCCESS] Stored speaker '{name}' in {self.store_dir}")
+        except SpeakerStoreError:
+            raise
+        except Exception as e:
+            raise SpeakerStoreError(f"Failed to store speaker '{name}': {str(e)}")
+
+    def remove(self, name: str) -> None:
+        try:
+            if name not in self.index:
+                return
+            removed_row = self.index.pop(name)['row']
+            matrix = np.delete(np.array(self.embeddings, dtype=np.float32), removed_row, axis=0)
+            for entry in self.index.values():
+                if entry['row'] > removed_row:
+                    entry['row'] -= 1
+            self._write(matrix)
+        except Exception as e:
+            raise SpeakerStoreError(f"Failed to remove speaker '{name}': {str(e)}")
+
+    def _write(self, matrix: np.ndarray) -> None:
+        # Drop the memory map before replacing the file (required on Windows)
+        self._embeddings = None
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        tmp_embeddings = self.embeddings_path.with_suffix('.tmp.npy')
+        tmp_index = self.index_path.with_suffix('.tmp.json')
+        np.save(tmp_embeddings, np.ascontiguousarray(matrix, dtype=np.float32))
+        with open(tmp_index, 'w') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_embeddings, self.embeddings_path)
+        os.replace(tmp_index, self.index_path)
+
+def load_or_enroll_speaker(store: Optional[SpeakerEmbeddingStore], speaker_name: str,
+                           enrollment_path: Optional[str], model_path: str,
+                           sample_rate: int = 16000,
+                           session_options: Optional[Dict[str, Any]] = None,
+                           frontend: str = 'torch') -> np.ndarray:
+    if store is not None:
+        embedding = store.get(speaker_name, model_path, enrollment_path)
+        if embedding is not None:
+            logger.info(f"[SUCCESS] Loaded speaker '{speaker_name}' from store - embedding shape: {embedding.shape}")
+            return embedding
+        if enrollment_path is None and speaker_name in store.index:
+            # Stale entry: re-enroll from the recording it was created from
+            recorded_source = store.index[speaker_name]['source_file']
+            if os.path.exists(recorded_source):
+                enrollment_path = recorded_source
+    if enrollment_path is None:
+        raise SpeakerStoreError(f"Speaker '{speaker_name}' has no valid entry in the speaker store; pass --enroll")
+    embedding = enroll_speaker(enrollment_path, speaker_name, model_path, sample_rate, session_options, frontend)
+    if store is not None:
+        store.put(speaker_name, embedding, enrollment_path, model_path)
+    return embedding
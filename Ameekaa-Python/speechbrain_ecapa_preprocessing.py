@@ -12,6 +12,7 @@ import torch.nn.functional as F
 import torchaudio
 import numpy as np
 import logging
+from functools import lru_cache
 from typing import Optional, Tuple, Union
 from pathlib import Path
 
@@ -96,26 +97,24 @@ def create_filterbank_matrix(
         # Ensure bins are within valid range
         bins = torch.clamp(bins, 0, n_fft)
         
-        # Create filterbank matrix
-        filterbank = torch.zeros(n_mels, n_fft // 2 + 1)
+        # Create filterbank matrix: one row of triangle edges per mel bin
+        # against every FFT bin at once
+        fft_bins = torch.arange(n_fft // 2 + 1).unsqueeze(0)
+        left_bin = bins[:n_mels].unsqueeze(1)
+        center_bin = bins[1:n_mels + 1].unsqueeze(1)
+        right_bin = bins[2:n_mels + 2].unsqueeze(1)
         
-        for i in range(n_mels):
-            left_bin = bins[i]
-            center_bin = bins[i + 1]
-            right_bin = bins[i + 2]
-            
-            # Ensure we have valid ranges
-            if left_bin < center_bin:
-                # Rising slope
-                for j in range(left_bin, center_bin + 1):
-                    if j < filterbank.shape[1]:
-                        filterbank[i, j] = (j - left_bin) / (center_bin - left_bin + 1e-8)
-            
-            if center_bin < right_bin:
-                # Falling slope
-                for j in range(center_bin, right_bin + 1):
-                    if j < filterbank.shape[1]:
-                        filterbank[i, j] = (right_bin - j) / (right_bin - center_bin + 1e-8)
+        # Rising slope
+        rising = (fft_bins - left_bin) / (center_bin - left_bin + 1e-8)
+        rising_mask = (left_bin < center_bin) & (fft_bins >= left_bin) & (fft_bins <= center_bin)
+        
+        # Falling slope (takes precedence at the centre bin)
+        falling = (right_bin - fft_bins) / (right_bin - center_bin + 1e-8)
+        falling_mask = (center_bin < right_bin) & (fft_bins >= center_bin) & (fft_bins <= right_bin)
+        
+        filterbank = torch.zeros(n_mels, n_fft // 2 + 1)
+        filterbank = torch.where(rising_mask, rising, filterbank)
+        filterbank = torch.where(falling_mask, falling, filterbank)
         
         # Normalize if requested
         if norm == "slaney":
@@ -128,6 +127,32 @@ def create_filterbank_matrix(
     except Exception as e:
         raise PreprocessingError(f"Failed to create filterbank matrix: {str(e)}")
 
+@lru_cache(maxsize=16)
+def get_filterbank_matrix(
+    n_mels: int,
+    n_fft: int,
+    sample_rate: int,
+    f_min: float = 0.0,
+    f_max: Optional[float] = None,
+    norm: Optional[str] = None,
+    mel_scale: str = "htk",
+) -> torch.Tensor:
+    """Memoized create_filterbank_matrix; the returned tensor is shared and must not be modified."""
+    return create_filterbank_matrix(
+        n_mels=n_mels,
+        n_fft=n_fft,
+        sample_rate=sample_rate,
+        f_min=f_min,
+        f_max=f_max,
+        norm=norm,
+        mel_scale=mel_scale,
+    )
+
+@lru_cache(maxsize=16)
+def get_hann_window(win_length: int, device: Union[str, torch.device] = "cpu") -> torch.Tensor:
+    """Memoized torch.hann_window; the returned tensor is shared and must not be modified."""
+    return torch.hann_window(win_length).to(device)
+
 def extract_log_mel_filterbank_features(
     waveform: torch.Tensor,
     sample_rate: int,
@@ -162,7 +187,7 @@ def extract_log_mel_filterbank_features(
             n_fft=n_fft,
             hop_length=hop_length,
             win_length=win_length,
-            window=torch.hann_window(win_length).to(waveform.device),
+            window=get_hann_window(win_length, waveform.device),
             center=center,
             pad_mode=pad_mode,
             return_complex=True,
@@ -171,8 +196,8 @@ def extract_log_mel_filterbank_features(
         # Power spectrogram
         spec = torch.abs(stft) ** power
         
-        # Create filterbank matrix
-        filterbank = create_filterbank_matrix(
+        # Filterbank matrix (built once per parameter set)
+        filterbank = get_filterbank_matrix(
             n_mels=n_mels,
             n_fft=n_fft,
             sample_rate=sample_rate,
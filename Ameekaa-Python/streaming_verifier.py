@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Streaming speaker verification over live PCM chunks.
+
+    verifier = StreamingSpeakerVerifier(processor, config, enrollment_embedding, 'sami')
+    for chunk in microphone_chunks():          # e.g. 100 ms of 16 kHz float32
+        for decision in verifier.push(chunk):
+            ...
+    decisions = verifier.flush()               # trailing partial windows
+
+Log-mel frames are computed as samples arrive by an
+IncrementalLogMelExtractor: each push runs the STFT only over the frames
+its samples complete (a frame needs n_fft // 2 samples of lookahead), and
+windows of segment_length seconds every segment_step seconds
+are cut from the frame history, mean-normalized, VAD-checked (vad_enabled) and embedded as
+soon as their last frame exists. Because frames come from one continuous
+STFT, window features and decisions match the offline path with
+whole_file_features enabled (offline_decisions), including the reflect
+padding at the start and (after flush) the end of the stream;
+tests/test_streaming_verifier.py checks this on test_data.
+
+    python streaming_verifier.py --enroll test_data/sami_speaker_enrollment.wav \\
+        --audio test_data/sami_meeting_audio.wav --name sami --chunk-ms 100
+"""
+import json
+import time
+import logging
+import argparse
+import numpy as np
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+from run_dynamic_quantized_diarization import load_config
+from enrollment_dynamic_quantize import (
+    get_audio_processor, session_options_from_config, enroll_speaker, DynamicQuantizedDiarizationError
+)
+from diarization_dynamic_quantize import DynamicQuantizedDiarizationEngine, is_speech
+
+logger = logging.getLogger(__name__)
+
+class StreamingSpeakerVerifier:
+    def __init__(self, audio_processor, config: Dict[str, Any], enrollment_embedding: np.ndarray,
+                 speaker_name: str, threshold: Optional[float] = None, latency_budget_ms: Optional[float] = None,
+                 history_windows: int = 8):
+        if getattr(audio_processor, 'waveform_input', False):
+            raise DynamicQuantizedDiarizationError("Streaming verification embeds incrementally computed log-mel frames "
+                                                   "and needs a feature-input model, not a --fused-frontend one")
+        self.audio_processor = audio_processor
+        self.sample_rate = audio_processor.sample_rate
+        self.hop_length = audio_processor.hop_length
+        self.speaker_name = speaker_name
+        self.enrollment_embedding = np.asarray(enrollment_embedding, dtype=np.float32).reshape(-1)
+        self.enrollment_embedding /= np.linalg.norm(self.enrollment_embedding) + 1e-8
+        self.threshold = float(config['default_threshold'] if threshold is None else threshold)
+        self.exit_threshold = self.threshold - float(config.get('turn_hysteresis', 0.05))
+        self.segment_length = config['segment_length']
+        self.segment_step = config['segment_step']
+        self.min_segment_ratio = config['min_segment_ratio']
+        self.latency_budget = float(config.get('stream_latency_budget_ms', 500.0)
+                                    if latency_budget_ms is None else latency_budget_ms) / 1000.0
+        self.vad_enabled = bool(config.get('vad_enabled', False))
+        self.vad_params = {
+            'energy_threshold': float(config.get('vad_energy_threshold', -45.0)),
+            'min_active_ratio': float(config.get('vad_min_active_ratio', 0.1)),
+            'min_energy_range': float(config.get('vad_min_energy_range', 3.0)),
+            'min_flux': float(config.get('vad_min_flux', 0.05))
+        }
+        window_frames = 1 + int(self.segment_length * self.sample_rate) // self.hop_length
+        self.extractor = audio_processor.incremental_log_mel(capacity=2 * window_frames)
+        # Latest window embeddings, for callers that smooth over recent history
+        self.recent_embeddings = deque(maxlen=history_windows)
+        self.reset()
+
+    def reset(self) -> None:
+        self.extractor.reset()
+        self.next_window = 0
+        self.in_turn = False
+        self.turn_end = 0.0
+        self.window_cost = 0.0
+        self.recent_embeddings.clear()
+        self.stats = {'chunks': 0, 'frames': 0, 'windows': 0, 'vad_skipped_windows': 0,
+                      'dropped_windows': 0, 'late_decisions': 0, 'latencies': []}
+
+    @property
+    def samples_received(self) -> int:
+        return self.extractor.samples_received
+
+    def _window_bounds(self, index: int):
+        start = index * self.segment_step
+        first_sample, last_sample = int(start * self.sample_rate), int((start + self.segment_length) * self.sample_rate)
+        return start, first_sample, last_sample
+
+    def _decide(self, start: float, end: float, window_log_mel: np.ndarray, ready_time: float) -> Dict[str, Any]:
+        decision = {'start': float(start), 'end': float(end), 'speaker': self.speaker_name,
+                    'speech': True, 'similarity': None, 'accepted': False}
+        if self.vad_enabled and not is_speech(window_log_mel, **self.vad_params):
+            decision['speech'] = False
+            self.stats['vad_skipped_windows'] += 1
+        else:
+            feats = self.audio_processor.normalize_features(window_log_mel)
+            embedding = self.audio_processor.extract_embeddings_batch(feats[np.newaxis, ...])[0]
+            self.recent_embeddings.append(embedding)
+            similarity = float(np.clip(np.dot(embedding / (np.linalg.norm(embedding) + 1e-8),
+                                              self.enrollment_embedding), -1.0, 1.0))
+            # Same hysteresis as build_speaker_turns: an open turn stays open
+            # down to threshold - turn_hysteresis
+            if self.in_turn and start > self.turn_end:
+                # Windows in between were skipped or dropped
+                self.in_turn = False
+            accepted = similarity >= (self.exit_threshold if self.in_turn else self.threshold)
+            self.in_turn = bool(accepted)
+            if accepted:
+                self.turn_end = end
+            decision['similarity'] = similarity
+            decision['accepted'] = bool(accepted)
+        latency = time.perf_counter() - ready_time
+        decision['latency_ms'] = latency * 1000
+        self.stats['latencies'].append(latency)
+        self.stats['windows'] += 1
+        if latency > self.latency_budget:
+            self.stats['late_decisions'] += 1
+        return decision
+
+    def _emit_windows(self, ready_time: float, final: bool = False) -> List[Dict[str, Any]]:
+        ready = []
+        while True:
+            start, first_sample, last_sample = self._window_bounds(self.next_window)
+            end = start + self.segment_length
+            if last_sample > self.samples_received:
+                if not final or first_sample >= self.samples_received:
+                    break
+                # Trailing partial window, as _iter_windows cuts it
+                end = self.samples_received / self.sample_rate
+                last_sample = int(end * self.sample_rate)
+            first_frame = int(round(start * self.sample_rate / self.hop_length))
+            n_frames = 1 + (last_sample - first_sample) // self.hop_length
+            if first_frame + n_frames > self.extractor.frames_computed:
+                break
+            self.next_window += 1
+            if last_sample - first_sample < int(self.segment_length * self.sample_rate * self.min_segment_ratio):
+                continue
+            ready.append((start, end, first_frame, n_frames))
+        decisions = []
+        for i, (start, end, first_frame, n_frames) in enumerate(ready):
+            # Deciding every queued window would push the newest past the
+            # budget: drop this one to catch up (the newest is always decided)
+            elapsed = time.perf_counter() - ready_time
+            if i + 1 < len(ready) and elapsed + (len(ready) - i) * self.window_cost > self.latency_budget:
+                self.stats['dropped_windows'] += 1
+                logger.debug(f"Window {start:.2f}s dropped to stay within the latency budget")
+                continue
+            window_log_mel = self.extractor.frames(first_frame, n_frames)
+            decision_start = time.perf_counter()
+            decisions.append(self._decide(start, end, window_log_mel, ready_time))
+            # Running estimate of the per-window feature + ONNX cost
+            self.window_cost = 0.8 * self.window_cost + 0.2 * (time.perf_counter() - decision_start)
+        # Frames before the next window are not needed again
+        self.extractor.release(int(round(self.next_window * self.segment_step * self.sample_rate / self.hop_length)))
+        return decisions
+
+    def push(self, chunk: np.ndarray) -> List[Dict[str, Any]]:
+        ready_time = time.perf_counter()
+        chunk = np.asarray(chunk, dtype=np.float32)
+        if chunk.ndim > 1:
+            chunk = chunk.mean(axis=1)
+        self.stats['chunks'] += 1
+        self.stats['frames'] += self.extractor.push(chunk)
+        return self._emit_windows(ready_time)
+
+    def flush(self) -> List[Dict[str, Any]]:
+        # End of stream: reflect-pad the tail and emit the remaining windows
+        ready_time = time.perf_counter()
+        self.stats['frames'] += self.extractor.finish()
+        return self._emit_windows(ready_time, final=True)
+
+    def latency_summary(self) -> Dict[str, Any]:
+        latencies_ms = np.array(self.stats['latencies']) * 1000
+        summary = {key: value for key, value in self.stats.items() if key != 'latencies'}
+        summary['latency_budget_ms'] = self.latency_budget * 1000
+        if len(latencies_ms):
+            summary.update({
+                'latency_p50_ms': float(np.percentile(latencies_ms, 50)),
+                'latency_p95_ms': float(np.percentile(latencies_ms, 95)),
+                'latency_max_ms': float(latencies_ms.max())
+            })
+        return summary
+
+def offline_decisions(engine: DynamicQuantizedDiarizationEngine, audio: np.ndarray, sr: int,
+                      enrollment_embedding: np.ndarray) -> List[Dict[str, Any]]:
+    # Reference per-window similarities from the offline whole-file-features path
+    decisions = []
+    for start, end, feats in engine.window_features(audio, sr):
+        similarity = None
+        if feats is not None:
+            embedding = engine.audio_processor.extract_embeddings_batch(feats[np.newaxis, ...])[0]
+            similarity = engine.compute_similarity(embedding, enrollment_embedding)
+        decisions.append({'start': float(start), 'end': float(end), 'similarity': similarity})
+    return decisions
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a WAV file chunk by chunk through the streaming verifier")
+    parser.add_argument('--enroll', required=True, help='Enrollment audio file')
+    parser.add_argument('--audio', required=True, help='Audio file fed to the verifier in chunks')
+    parser.add_argument('--name', default='speaker', help='Speaker name')
+    parser.add_argument('--model', help='Dynamic quantized ECAPA ONNX model path')
+    parser.add_argument('--config', help='Configuration JSON file')
+    parser.add_argument('--threshold', type=float, help='Similarity threshold (0.0-1.0)')
+    parser.add_argument('--chunk-ms', type=float, default=100.0, help='PCM chunk size in milliseconds')
+    parser.add_argument('--latency-budget-ms', type=float, help='Per-window decision latency budget')
+    parser.add_argument('--output', help='Write decisions and the stream summary to this JSON file')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose logging')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    try:
+        config = load_config(args.config)
+        if args.model:
+            config['model_path'] = args.model
+        session_options = session_options_from_config(config)
+        frontend = config['frontend']
+        processor = get_audio_processor(config['model_path'], config['sample_rate'], session_options=session_options,
+                                        frontend=frontend)
+        enrollment_embedding = enroll_speaker(args.enroll, args.name, config['model_path'], config['sample_rate'],
+                                              session_options, frontend)
+        verifier = StreamingSpeakerVerifier(processor, config, enrollment_embedding, args.name, args.threshold,
+                                            args.latency_budget_ms)
+        decisions = []
+        for chunk in processor.stream_audio(args.audio, args.chunk_ms / 1000.0):
+            for decision in verifier.push(chunk):
+                decisions.append(decision)
+                logger.info(f"{decision['start']:.2f}s-{decision['end']:.2f}s accepted={decision['accepted']} "
+                            f"similarity={decision['similarity']} latency={decision['latency_ms']:.1f}ms")
+        decisions.extend(verifier.flush())
+        report = {'decisions': decisions, 'stream': verifier.latency_summary()}
+        print(json.dumps({key: value for key, value in report.items() if key != 'decisions'}, indent=2))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+    except DynamicQuantizedDiarizationError as e:
+        logger.error(str(e))
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
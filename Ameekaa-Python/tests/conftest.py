@@ -0,0 +1,12 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+# The modules are scripts at the top of Ameekaa-Python, not a package
+sys.path.insert(0, str(ROOT))
+
+@pytest.fixture(scope='session')
+def test_data() -> Path:
+    return ROOT / 'test_data'
@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+import pytest
+
+@pytest.fixture(scope='module')
+def quantization(tmp_path_factory):
+    # Importing the quantization script opens quantization.log in the working directory
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('quantization'))
+    try:
+        import ecapa_onnx_quantization
+    finally:
+        os.chdir(cwd)
+    return ecapa_onnx_quantization
+
+def strided_samples(reader, stride):
+    # The order quantize_static reads samples in with CalibStridedMinMax
+    samples = []
+    for start in range(0, len(reader), stride):
+        reader.set_range(start, start + stride)
+        while (data := reader.get_next()) is not None:
+            samples.append(data['input'])
+    return samples
+
+def test_list_reader_strides(quantization):
+    data = quantization.generate_calibration_data(num_samples=7, input_shape=(1, 20, 80))
+    reader = quantization.ECAPACalibrationDataReader(data)
+    assert len(reader) == 7
+    samples = strided_samples(reader, 3)
+    assert len(samples) == 7
+    for sample, expected in zip(samples, data):
+        assert sample is expected
+
+def test_audio_reader_strides(quantization, test_data):
+    paths = [str(test_data / 'raj_speaker_enrollment.wav'), str(test_data / 'sami_speaker_enrollment.wav')]
+    reader = quantization.AudioCalibrationDataReader(paths, num_samples=6, clip_duration=2.0)
+    assert len(reader) == 6
+    samples = strided_samples(reader, 4)
+    assert len(samples) == 6
+    for index, sample in enumerate(samples):
+        assert sample.shape == (1, 201, 80)
+        np.testing.assert_array_equal(sample, reader.features(index))
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from enrollment_dynamic_quantize import (DynamicQuantizedDiarizationError, IncrementalLogMelExtractor,
+                                         compute_log_mel, decode_audio)
+
+# Frames agree with compute_log_mel on the whole signal to float32 rounding
+TOLERANCE = 1e-5
+
+@pytest.fixture(scope='module', params=['raj_speaker_enrollment.wav', 'sami_speaker_enrollment.wav'])
+def clip(request, test_data):
+    audio, sr = decode_audio(str(test_data / request.param), 16000)
+    return audio, sr
+
+def chunks(audio, size):
+    # Single-sample pushes only over the first second, to keep the test fast
+    if size == 1:
+        audio = audio[:16000]
+    return audio, [audio[first:first + size] for first in range(0, len(audio), size)]
+
+@pytest.mark.parametrize('frontend', ['torch', 'numpy'])
+@pytest.mark.parametrize('push_size', [1, 37, 1600, 100000])
+def test_frames_match_batch_extractor(clip, push_size, frontend):
+    audio, sr = clip
+    audio, pushes = chunks(audio, push_size)
+    extractor = IncrementalLogMelExtractor(sr, capacity=16, frontend=frontend)
+    computed = sum(extractor.push(samples) for samples in pushes) + extractor.finish()
+    expected = compute_log_mel(audio, sr, frontend=frontend)
+    assert computed == extractor.frames_computed == len(expected)
+    # Nothing was released, so the ring buffer had to grow to hold every frame
+    assert extractor.capacity >= len(expected)
+    np.testing.assert_allclose(extractor.frames(0, computed), expected, rtol=0, atol=TOLERANCE)
+
+@pytest.mark.parametrize('frontend', ['torch', 'numpy'])
+@pytest.mark.parametrize('push_size', [37, 1600])
+def test_released_frames_are_reused(clip, push_size, frontend):
+    audio, sr = clip
+    audio, pushes = chunks(audio, push_size)
+    extractor = IncrementalLogMelExtractor(sr, capacity=64, frontend=frontend)
+    frames = []
+
+    def collect():
+        first = extractor.frames_released
+        frames.append(extractor.frames(first, extractor.frames_computed - first).copy())
+        extractor.release(extractor.frames_computed)
+
+    for samples in pushes:
+        extractor.push(samples)
+        collect()
+    extractor.finish()
+    collect()
+    assert extractor.capacity == 64
+    with pytest.raises(DynamicQuantizedDiarizationError):
+        extractor.frames(0, 1)
+    np.testing.assert_allclose(np.concatenate(frames), compute_log_mel(audio, sr, frontend=frontend), rtol=0,
+                               atol=TOLERANCE)
+
+def test_finish_and_reset(clip):
+    audio, sr = clip
+    extractor = IncrementalLogMelExtractor(sr)
+    extractor.push(audio[:8000])
+    extractor.finish()
+    with pytest.raises(DynamicQuantizedDiarizationError):
+        extractor.push(audio[8000:9000])
+    extractor.reset()
+    extractor.push(audio[:8000])
+    extractor.finish()
+    np.testing.assert_allclose(extractor.frames(0, extractor.frames_computed), compute_log_mel(audio[:8000], sr),
+                               rtol=0, atol=TOLERANCE)
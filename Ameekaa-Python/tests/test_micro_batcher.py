@@ -0,0 +1,48 @@
+import asyncio
+
+import numpy as np
+
+from diarization_service import MicroBatcher
+
+class StubProcessor:
+    supports_batching = True
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def input_frames(self, features):
+        return features.shape[0]
+
+    def extract_embeddings_batch(self, batch):
+        self.batch_sizes.append(len(batch))
+        if not np.isfinite(batch).all():
+            raise ValueError("non-finite input")
+        return batch.mean(axis=1)
+
+async def embed_all(batcher, inputs):
+    batcher.start()
+    return await asyncio.gather(*(batcher.embed(features) for features in inputs), return_exceptions=True)
+
+def test_bad_item_fails_only_its_request():
+    processor = StubProcessor()
+    batcher = MicroBatcher(processor, max_batch_size=8, max_wait_ms=50)
+    inputs = [np.full((10, 4), i, dtype=np.float32) for i in range(8)]
+    inputs[3] = np.full((10, 4), np.nan, dtype=np.float32)
+    results = asyncio.run(embed_all(batcher, inputs))
+    assert processor.batch_sizes[0] == 8
+    assert isinstance(results[3], ValueError)
+    for i, result in enumerate(results):
+        if i != 3:
+            np.testing.assert_array_equal(result, np.full(4, i, dtype=np.float32))
+    assert batcher.stats['failed_batches'] == 1
+    assert batcher.stats['failed_items'] == 1
+    assert batcher.stats['items'] == 7
+
+def test_invalid_shape_rejected_on_arrival():
+    processor = StubProcessor()
+    batcher = MicroBatcher(processor, max_batch_size=4, max_wait_ms=20)
+    inputs = [np.ones((10, 4), dtype=np.float32), np.float32(1.0), np.ones((10, 4), dtype=np.float32)]
+    results = asyncio.run(embed_all(batcher, inputs))
+    assert isinstance(results[1], Exception)
+    assert processor.batch_sizes == [2]
+    np.testing.assert_array_equal(results[0], np.ones(4, dtype=np.float32))
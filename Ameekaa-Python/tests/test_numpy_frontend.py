@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from enrollment_dynamic_quantize import compute_log_mel, decode_audio, numpy_hann_window, numpy_mel_filterbank
+from speechbrain_ecapa_preprocessing import create_filterbank_matrix, get_hann_window
+
+# The numpy front-end matches the torch one to float32 rounding; the largest
+# differences are in near-silent mel bins
+LOG_MEL_TOLERANCE = 1e-3
+
+@pytest.mark.parametrize('n_mels, n_fft, sample_rate', [(80, 400, 16000), (40, 512, 16000), (128, 2048, 44100)])
+def test_filterbank_matches_torch(n_mels, n_fft, sample_rate):
+    expected = create_filterbank_matrix(n_mels, n_fft, sample_rate, norm='slaney').numpy().T
+    np.testing.assert_allclose(numpy_mel_filterbank(n_mels, n_fft, sample_rate), expected, rtol=0, atol=1e-6)
+    # Same nonzero pattern, so the FFT bin edges agree exactly
+    assert np.array_equal(numpy_mel_filterbank(n_mels, n_fft, sample_rate) > 0, expected > 0)
+
+def test_hann_window_matches_torch():
+    np.testing.assert_allclose(numpy_hann_window(400), get_hann_window(400).numpy(), rtol=0, atol=1e-6)
+
+@pytest.mark.parametrize('name', ['cheta_speaker_enrollment.wav', 'deepika_speaker_enrollment.wav',
+                                  'raj_speaker_enrollment.wav', 'sami_speaker_enrollment.wav',
+                                  'deepika_meeting_audio.wav', 'sami_meeting_audio.wav'])
+def test_log_mel_matches_torch(name, test_data):
+    audio, sr = decode_audio(str(test_data / name), 16000)
+    for start in range(0, len(audio) - 32000 + 1, 10 * 32000):
+        window = audio[start:start + 32000]
+        np.testing.assert_allclose(compute_log_mel(window, sr, frontend='numpy'),
+                                   compute_log_mel(window, sr, frontend='torch'), rtol=0, atol=LOG_MEL_TOLERANCE)
+    np.testing.assert_allclose(compute_log_mel(audio, sr, frontend='numpy'),
+                               compute_log_mel(audio, sr, frontend='torch'), rtol=0, atol=LOG_MEL_TOLERANCE)
@@ -0,0 +1,34 @@
+import os
+
+import numpy as np
+import onnxruntime as ort
+import pytest
+
+from enrollment_dynamic_quantize import DynamicQuantizedAudioProcessor, compute_log_mel, decode_audio
+
+@pytest.fixture(scope='module')
+def build_frontend_model(tmp_path_factory):
+    # Importing the export script opens model_export.log in the working directory
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('export'))
+    try:
+        from ecapa_to_onnx_pipeline import build_frontend_model
+    finally:
+        os.chdir(cwd)
+    return build_frontend_model
+
+@pytest.mark.parametrize('opset_version', [17, 18])
+def test_frontend_matches_python_features(build_frontend_model, opset_version, test_data):
+    # ReduceMean takes axes as an attribute before opset 18 and as an input from 18
+    model = build_frontend_model(opset_version=opset_version)
+    session = ort.InferenceSession(model.SerializeToString(), providers=['CPUExecutionProvider'])
+    audio, sr = decode_audio(str(test_data / 'raj_speaker_enrollment.wav'), 16000)
+    windows = np.stack([audio[start:start + 32000] for start in (0, 32000, 64000)]).astype(np.float32)
+    features = session.run(None, {'waveform': windows})[0]
+    for window, onnx_features in zip(windows, features):
+        expected = DynamicQuantizedAudioProcessor.normalize_features(compute_log_mel(window, sr))
+        np.testing.assert_allclose(onnx_features, expected, rtol=0, atol=1e-2)
+
+def test_frontend_rejects_old_opsets(build_frontend_model):
+    with pytest.raises(ValueError):
+        build_frontend_model(opset_version=12)
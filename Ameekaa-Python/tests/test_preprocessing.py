@@ -0,0 +1,48 @@
+import pytest
+import torch
+
+from speechbrain_ecapa_preprocessing import (create_filterbank_matrix, get_filterbank_matrix, get_hann_window,
+                                             hz_to_mel, mel_to_hz)
+
+def loop_filterbank(n_mels, n_fft, sample_rate, f_min=0.0, f_max=None, norm=None):
+    # The nested-loop create_filterbank_matrix this module used to have
+    if f_max is None:
+        f_max = sample_rate // 2
+    mel_min = hz_to_mel(torch.tensor(f_min, dtype=torch.float32))
+    mel_max = hz_to_mel(torch.tensor(f_max, dtype=torch.float32))
+    hz_freqs = mel_to_hz(torch.linspace(mel_min, mel_max, n_mels + 2))
+    bins = torch.clamp(torch.floor((n_fft + 1) * hz_freqs / sample_rate).long(), 0, n_fft)
+    filterbank = torch.zeros(n_mels, n_fft // 2 + 1)
+    for i in range(n_mels):
+        left_bin, center_bin, right_bin = bins[i], bins[i + 1], bins[i + 2]
+        if left_bin < center_bin:
+            for j in range(left_bin, center_bin + 1):
+                if j < filterbank.shape[1]:
+                    filterbank[i, j] = (j - left_bin) / (center_bin - left_bin + 1e-8)
+        if center_bin < right_bin:
+            for j in range(center_bin, right_bin + 1):
+                if j < filterbank.shape[1]:
+                    filterbank[i, j] = (right_bin - j) / (right_bin - center_bin + 1e-8)
+    if norm == "slaney":
+        enorm = 2.0 / (hz_freqs[2:n_mels + 2] - hz_freqs[:n_mels])
+        filterbank *= enorm.unsqueeze(1)
+    return filterbank
+
+@pytest.mark.parametrize('n_mels, n_fft, sample_rate, f_min, f_max, norm', [
+    (80, 400, 16000, 0.0, None, 'slaney'),
+    (80, 400, 16000, 0.0, None, None),
+    (40, 512, 16000, 20.0, 7600.0, 'slaney'),
+    (128, 2048, 44100, 0.0, None, 'slaney'),
+    (100, 256, 8000, 0.0, None, None),
+])
+def test_filterbank_matches_loop_version(n_mels, n_fft, sample_rate, f_min, f_max, norm):
+    expected = loop_filterbank(n_mels, n_fft, sample_rate, f_min, f_max, norm)
+    actual = create_filterbank_matrix(n_mels, n_fft, sample_rate, f_min=f_min, f_max=f_max, norm=norm)
+    assert torch.equal(actual, expected)
+
+def test_cached_filterbank_and_window():
+    filterbank = get_filterbank_matrix(80, 400, 16000, 0.0, None, 'slaney', 'htk')
+    assert get_filterbank_matrix(80, 400, 16000, 0.0, None, 'slaney', 'htk') is filterbank
+    assert torch.equal(filterbank, create_filterbank_matrix(80, 400, 16000, norm='slaney'))
+    assert get_hann_window(400) is get_hann_window(400)
+    assert torch.equal(get_hann_window(400), torch.hann_window(400))
@@ -0,0 +1,35 @@
+from diarization_dynamic_quantize import build_speaker_turns
+
+def windows(similarities, step, length):
+    return [(i * step, i * step + length, similarity) for i, similarity in enumerate(similarities)]
+
+def spans(turns):
+    return [(turn['start'], turn['end'], turn['windows']) for turn in turns]
+
+def test_hysteresis_keeps_turn_open():
+    turns = build_speaker_turns(windows([0.1, 0.7, 0.62, 0.61, 0.3], 1.0, 1.0), 0.65, 0.6)
+    assert spans(turns) == [(1.0, 4.0, 3)]
+
+def test_dip_splits_non_overlapping_windows():
+    turns = build_speaker_turns(windows([0.7, 0.5, 0.7], 1.0, 1.0), 0.65, 0.6)
+    assert spans(turns) == [(0.0, 1.0, 1), (2.0, 3.0, 1)]
+
+def test_max_gap_bridges_dip():
+    turns = build_speaker_turns(windows([0.7, 0.5, 0.7], 1.0, 1.0), 0.65, 0.6, max_gap=1.0)
+    assert spans(turns) == [(0.0, 3.0, 2)]
+
+def test_overlapping_reentry_continues_turn():
+    # The window at 4 s re-enters while the turn still runs to 5 s
+    turns = list(build_speaker_turns(windows([0.1, 0.7, 0.62, 0.58, 0.7], 1.0, 3.0), 0.65, 0.6))
+    assert spans(turns) == [(1.0, 7.0, 3)]
+
+def test_turns_never_overlap():
+    similarities = [0.7, 0.1, 0.7, 0.62, 0.1, 0.66, 0.1, 0.1, 0.1, 0.1, 0.7, 0.58, 0.7]
+    turns = list(build_speaker_turns(windows(similarities, 0.5, 2.0), 0.65, 0.6))
+    assert len(turns) > 1
+    for previous, turn in zip(turns, turns[1:]):
+        assert turn['start'] >= previous['end']
+
+def test_min_duration_drops_short_turns():
+    turns = build_speaker_turns(windows([0.7, 0.1, 0.1, 0.7, 0.7], 1.0, 1.0), 0.65, 0.6, min_duration=1.5)
+    assert spans(turns) == [(3.0, 5.0, 2)]
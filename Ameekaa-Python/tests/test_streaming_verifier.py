@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from diarization_dynamic_quantize import DynamicQuantizedDiarizationEngine
+from enrollment_dynamic_quantize import DecodedAudioCache, DynamicQuantizedAudioProcessor
+from run_dynamic_quantized_diarization import load_config
+from streaming_verifier import StreamingSpeakerVerifier, offline_decisions
+
+class StubEmbeddingProcessor(DynamicQuantizedAudioProcessor):
+    # The real feature path with a fixed random projection instead of the
+    # ONNX model, so every frame of a window moves its embedding
+    def __init__(self, sample_rate=16000):
+        self.sample_rate = sample_rate
+        self.hop_length = 160
+        self.frontend = 'torch'
+        self.audio_cache = DecodedAudioCache()
+        self.waveform_input = False
+        self.benchmark_results = {}
+        self.projection = np.random.default_rng(0).standard_normal((80, 192)).astype(np.float32) / 80
+
+    @property
+    def supports_batching(self):
+        return True
+
+    def extract_embeddings_batch(self, features):
+        return np.tanh(features @ self.projection).mean(axis=1)
+
+def compare_with_offline(streamed, offline, threshold):
+    offline_by_start = {round(d['start'], 6): d for d in offline}
+    matched = [(d, offline_by_start.get(round(d['start'], 6))) for d in streamed]
+    both = [(s['similarity'], o['similarity']) for s, o in matched
+            if o is not None and s['similarity'] is not None and o['similarity'] is not None]
+    diffs = np.array([abs(a - b) for a, b in both])
+    return {
+        'compared_windows': len(both),
+        'missing_windows': sum(o is None for _, o in matched) + max(len(offline) - len(streamed), 0),
+        'vad_mismatches': sum(o is not None and (s['similarity'] is None) != (o['similarity'] is None)
+                              for s, o in matched),
+        'max_similarity_diff': float(diffs.max()) if len(diffs) else 0.0,
+        'threshold_agreement': float(np.mean([(a >= threshold) == (b >= threshold) for a, b in both])) if both else 1.0
+    }
+
+@pytest.fixture(scope='module')
+def processor():
+    return StubEmbeddingProcessor()
+
+@pytest.fixture(scope='module')
+def meeting(processor, test_data):
+    return processor.load_audio(str(test_data / 'sami_meeting_audio.wav'))
+
+@pytest.fixture(scope='module')
+def enrollment_embedding(processor, test_data):
+    audio, sr = processor.load_audio(str(test_data / 'sami_speaker_enrollment.wav'))
+    return processor.extract_embeddings_batch(processor.extract_features(audio, sr)[np.newaxis, ...])[0]
+
+@pytest.mark.parametrize('segment_step, chunk_ms, vad_enabled', [
+    (2.0, 100, False),
+    (2.0, 1000, True),
+    (0.5, 20, False),
+    (0.5, 333, True),
+    (0.7, 100, False),
+    (0.7, 1000, False),
+])
+def test_streamed_windows_match_offline(processor, meeting, enrollment_embedding, segment_step, chunk_ms, vad_enabled):
+    audio, sr = meeting
+    config = load_config()
+    config.update({'segment_step': segment_step, 'vad_enabled': vad_enabled, 'whole_file_features': True,
+                   'stream_latency_budget_ms': 1e9})
+    engine = DynamicQuantizedDiarizationEngine(config['model_path'], config, processor)
+    offline = offline_decisions(engine, audio, sr, enrollment_embedding)
+    # A threshold in the widest gap between the middle half of the offline
+    # similarities, so rounding differences cannot flip a decision
+    similarities = np.sort([d['similarity'] for d in offline if d['similarity'] is not None])
+    middle = similarities[len(similarities) // 4:3 * len(similarities) // 4]
+    widest = int(np.argmax(np.diff(middle)))
+    threshold = float(middle[widest] + middle[widest + 1]) / 2
+
+    verifier = StreamingSpeakerVerifier(processor, config, enrollment_embedding, 'sami', threshold)
+    chunk = int(chunk_ms * sr / 1000)
+    streamed = []
+    for first in range(0, len(audio), chunk):
+        streamed.extend(verifier.push(audio[first:first + chunk]))
+    streamed.extend(verifier.flush())
+
+    comparison = compare_with_offline(streamed, offline, threshold)
+    assert len(streamed) == len(offline)
+    assert comparison['missing_windows'] == 0
+    assert comparison['vad_mismatches'] == 0
+    assert comparison['compared_windows'] > 0
+    assert comparison['max_similarity_diff'] < 1e-3
+    assert comparison['threshold_agreement'] == 1.0
+    assert verifier.stats['dropped_windows'] == 0